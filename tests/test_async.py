@@ -0,0 +1,35 @@
+#
+# Diagnostics from the asyncio build.
+#
+
+from wandle.wandle_async import wandle_model_build_async
+
+import asyncio
+import unittest
+
+
+WANDLE_SRC = '''class Int;
+
+single S {
+    sync Void a(Int x);
+}
+
+flow f {
+    Int x!
+    void = S.foo(x);
+}
+'''
+
+
+class TestAsyncBuild(unittest.TestCase):
+
+    def test_error_has_position(self):
+        result = asyncio.run(wandle_model_build_async(WANDLE_SRC))
+        self.assertFalse(result.b_valid)
+        (diagnostic,) = result.lst_error()
+        self.assertEqual(diagnostic.message, '[S.foo] Could not find foo.')
+        self.assertEqual(result.get_linecol(diagnostic), (9, 5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+#
+# Latency budgets are checked on validate, not on build.
+#
+
+from wandle.arpeggio_parse import arpeggio_parse_go
+from wandle.wandle_model import BuildError
+from wandle.wandle_model import wandle_model_build
+
+import unittest
+
+
+WANDLE_SRC = '''class Int;
+
+single S {
+    sync Void a(Int x) cost 5ms;
+}
+
+flow f budget 1ms {
+    Int x!
+    void = S.a(x);
+}
+'''
+
+
+class TestBudget(unittest.TestCase):
+
+    def test_build_ignores_budget(self):
+        wandle_model = wandle_model_build(
+            parse_tree=arpeggio_parse_go(WANDLE_SRC),
+            b_print_diagnostic=False)
+        self.assertEqual(wandle_model.get_flow_latency('f').done_ms, 5.0)
+
+    def test_check_budgets_raises_once(self):
+        wandle_model = wandle_model_build(
+            parse_tree=arpeggio_parse_go(WANDLE_SRC),
+            b_print_diagnostic=False)
+        with self.assertRaises(BuildError) as cm:
+            wandle_model.check_budgets()
+        self.assertEqual(
+            cm.exception.message,
+            'Flow f takes 5ms, over its budget of 1ms. (f -> S.a)')
+        self.assertEqual(wandle_model.lst_diagnostic, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+#
+# Errors in the source come out as a BuildError, at the statement or
+# declaration that caused them.
+#
+
+from wandle.arpeggio_parse import LineTable
+from wandle.arpeggio_parse import arpeggio_parse_go
+from wandle.wandle_model import BuildError
+from wandle.wandle_model import wandle_model_build
+
+import unittest
+
+
+WANDLE_HEAD = '''class Int;
+class String;
+
+single S {
+    sync Int a(Int x);
+    async String s(Int x);
+}
+'''
+
+
+class TestBuildErrors(unittest.TestCase):
+
+    def build_error(self, wandle_src):
+        wandle_src = WANDLE_HEAD + wandle_src
+        with self.assertRaises(BuildError) as cm:
+            wandle_model_build(
+                parse_tree=arpeggio_parse_go(wandle_src),
+                b_print_diagnostic=False)
+        e = cm.exception
+        return (e.message, LineTable(wandle_src).linecol(e.position))
+
+    def test_unknown_class_in_ready_var(self):
+        (message, linecol) = self.build_error('flow f {\n    Foo x!\n}\n')
+        self.assertEqual(message, 'Class Foo does not exist.')
+        self.assertEqual(linecol, (9, 5))
+
+    def test_send_return_type(self):
+        (message, linecol) = self.build_error(
+            'flow f {\n    Int x!\n    x << S.s(x);\n}\n')
+        self.assertIn('LHS is Int, RHS is String.', message)
+        self.assertEqual(linecol, (10, 5))
+
+    def test_members_of_a_method(self):
+        (message, linecol) = self.build_error(
+            'flow f {\n    Int x!\n    x = S.a.b(x);\n}\n')
+        self.assertEqual(message, '[S.a.b] a is a method, and has no members.')
+        self.assertEqual(linecol, (10, 5))
+
+    def test_unknown_field_class(self):
+        (message, linecol) = self.build_error('class Q {\n    Foo b;\n}\n')
+        self.assertEqual(message, 'Class Foo does not exist.')
+        self.assertEqual(linecol, (9, 5))
+
+
+if __name__ == '__main__':
+    unittest.main()
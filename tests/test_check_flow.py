@@ -0,0 +1,101 @@
+#
+# --flow checks a flow on its own. It should agree with the full build.
+#
+
+from wandle.arpeggio_parse import arpeggio_parse_go
+from wandle.wandle_model import wandle_model_build
+
+import unittest
+
+
+# Flow f reads self.x, which only flow g's method sets.
+WANDLE_SRC = '''
+class Int;
+
+class Foo {
+    Int x;
+
+    sync Void setx(Int v) {
+        self.x = v;
+    }
+
+    sync Void take(Int v) {
+    }
+
+    sync Void use() {
+        void = self.take(self.x);
+    }
+}
+
+single App {
+    Foo foo;
+}
+
+flow f {
+    void = App.foo.use();
+}
+
+flow g {
+    Int v!
+    void = App.foo.setx(v);
+}
+'''
+
+# Both classes have a put. Flow h only reaches A's.
+WANDLE_SRC_SHARED = '''
+class Int;
+
+class A {
+    sync Void put(Int v) {
+    }
+}
+
+class B {
+    sync Void put(Int v) {
+    }
+}
+
+single App {
+    A a;
+    B b;
+}
+
+flow h {
+    Int v!
+    void = App.a.put(v);
+}
+'''
+
+def build(b_lazy, wandle_src=WANDLE_SRC):
+    return wandle_model_build(
+        parse_tree=arpeggio_parse_go(wandle_src),
+        b_lazy=b_lazy,
+        b_print_diagnostic=False)
+
+
+class TestCheckFlow(unittest.TestCase):
+
+    def test_full_build(self):
+        build(b_lazy=False)
+
+    def test_flow_agrees_with_full_build(self):
+        for name in ('f', 'g'):
+            wandle_model = build(b_lazy=True)
+            lst_checked = wandle_model.check_flow(name=name)
+            self.assertIn(name, [fn.name for fn in lst_checked])
+
+    def test_flow_checks_the_setter(self):
+        wandle_model = build(b_lazy=True)
+        lst_name = [fn.name for fn in wandle_model.check_flow(name='f')]
+        self.assertIn('setx', lst_name)
+
+    def test_flow_follows_the_receiver(self):
+        wandle_model = build(b_lazy=True, wandle_src=WANDLE_SRC_SHARED)
+        lst_checked = wandle_model.check_flow(name='h')
+        self.assertEqual(
+            [fn.get_qualified_name() for fn in lst_checked],
+            ['A.put', 'h'])
+
+
+if __name__ == '__main__':
+    unittest.main()
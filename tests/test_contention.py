@@ -0,0 +1,53 @@
+#
+# Contention, on small models.
+#
+
+from wandle.arpeggio_parse import arpeggio_parse_go
+from wandle.wandle_contention import contention_analyze
+from wandle.wandle_model import wandle_model_build
+
+import unittest
+
+
+def build(wandle_src):
+    return wandle_model_build(
+        parse_tree=arpeggio_parse_go(wandle_src),
+        b_print_diagnostic=False)
+
+def chain_src(depth):
+    '''
+    Each method calls the next twice, so the last runs 2**depth times.
+    '''
+    lst = ['class Int;', 'single S {']
+    for i in range(depth):
+        lst.append('    sync Void m%s(Int x) {'%(i))
+        lst.append('        void = S.m%s(x);'%(i + 1))
+        lst.append('        void = S.m%s(x);'%(i + 1))
+        lst.append('    }')
+    lst.append('    sync Void m%s(Int x) cost 1ms;'%(depth))
+    lst.append('    async Void a(Int x) {')
+    lst.append('        void = S.m0(x);')
+    lst.append('    }')
+    lst.append('}')
+    lst.append('flow f {')
+    lst.append('    Int x!')
+    lst.append('    void << S.a(x);')
+    lst.append('    void = S.m0(x);')
+    lst.append('}')
+    return '\n'.join(lst)
+
+
+class TestContention(unittest.TestCase):
+
+    def test_deep_chain(self):
+        # Walking every call site would make 2**22 accesses here.
+        depth = 22
+        d = contention_analyze(build(chain_src(depth)))
+        (d_lock,) = d['locks']
+        self.assertEqual(d_lock['guard'], 'S')
+        self.assertEqual(d_lock['writers'], ['f', 'f << S.a'])
+        self.assertEqual(d_lock['hold_ms'], {'f': 2.0 * 2 ** depth})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+#
+# Def-use graphs, and the asyncio.gather they let pygen write.
+#
+
+from wandle.arpeggio_parse import arpeggio_parse_go
+from wandle.wandle_model import wandle_model_build
+from wandle.wandle_pygen import pygen_write_all
+
+import os
+import shutil
+import tempfile
+import unittest
+
+
+# Two sends to the same single, and two sync calls on the same var.
+WANDLE_SRC = '''
+class Int;
+
+class Box {
+    sync Void put(Int v);
+}
+
+single Net {
+    async Int a() cost 10ms;
+}
+
+flow f {
+    Int x;
+    Int y;
+    x << Net.a();
+    y << Net.a();
+}
+
+flow g {
+    Int v!
+    Box box!
+    void = box.put(v);
+    void = box.put(v);
+}
+'''
+
+def build():
+    return wandle_model_build(
+        parse_tree=arpeggio_parse_go(WANDLE_SRC),
+        b_print_diagnostic=False)
+
+
+class TestDataFlow(unittest.TestCase):
+
+    def test_sends_to_one_single_are_independent(self):
+        dataflow = build().d_flow['f'].get_dataflow()
+        self.assertNotIn(2, dataflow.get_preds(3))
+
+    def test_sync_calls_on_a_var_are_ordered(self):
+        dataflow = build().d_flow['g'].get_dataflow()
+        self.assertIn(2, dataflow.get_preds(3))
+
+    def test_pygen_gathers_sends_to_one_single(self):
+        out_dir = tempfile.mkdtemp()
+        try:
+            pygen_write_all(build(), out_dir)
+            lst_py = []
+            for (dirpath, lst_dir, lst_file) in os.walk(out_dir):
+                for filename in lst_file:
+                    if filename == 'flows.py':
+                        f_ptr = open(os.path.join(dirpath, filename))
+                        lst_py.append(f_ptr.read())
+                        f_ptr.close()
+            self.assertEqual(len(lst_py), 1)
+            self.assertIn('(x, y) = await asyncio.gather(', lst_py[0])
+        finally:
+            shutil.rmtree(out_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
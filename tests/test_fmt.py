@@ -0,0 +1,52 @@
+#
+# The formatter. Its output should not change when formatted again.
+#
+
+from wandle.wandle_fmt import wandle_fmt
+
+import os
+import unittest
+
+
+DOC_DIR = os.path.join(os.path.dirname(__file__), '..', 'doc')
+
+
+# The first body line has two statements, so goes through the token path.
+# The others are single statements, for the fast path.
+WANDLE_SRC = '''class Int;
+single S {
+    sync Void a() cost 1ms effect io,net; sync Void b() effect cpu , io;
+    sync Void c() effect net,io;
+    sync Map/Int,Int d(Int k) effect io ,net;
+}
+'''
+
+WANDLE_FMT = '''class Int;
+single S {
+    sync Void a() cost 1ms effect io, net;
+    sync Void b() effect cpu, io;
+    sync Void c() effect net, io;
+    sync Map/Int,Int d(Int k) effect io, net;
+}
+'''
+
+
+class TestFmt(unittest.TestCase):
+
+    def test_effect_lists(self):
+        self.assertEqual(wandle_fmt(WANDLE_SRC), WANDLE_FMT)
+
+    def test_idempotent(self):
+        for filename in ('sample.wandle', 'readme_example.wandle'):
+            path = os.path.join(DOC_DIR, filename)
+            f_ptr = open(path)
+            wandle_src = f_ptr.read()
+            f_ptr.close()
+            once = wandle_fmt(wandle_src)
+            self.assertEqual(wandle_fmt(once), once, path)
+        once = wandle_fmt(WANDLE_SRC)
+        self.assertEqual(wandle_fmt(once), once)
+
+
+if __name__ == '__main__':
+    unittest.main()
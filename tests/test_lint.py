@@ -0,0 +1,142 @@
+#
+# Lints, on small models.
+#
+
+from wandle.arpeggio_parse import arpeggio_parse_go
+from wandle.wandle_lint import LINT_LOOP_BLOCKING
+from wandle.wandle_lint import LINT_SERIALIZED_ASYNC
+from wandle.wandle_lint import lint_run
+from wandle.wandle_model import wandle_model_build
+
+import unittest
+
+
+def build(wandle_src):
+    return wandle_model_build(
+        parse_tree=arpeggio_parse_go(wandle_src),
+        b_print_diagnostic=False)
+
+
+# b and c call each other, and c goes on to d. Both r1 and r2 reach d,
+# through the cycle from different ends.
+WANDLE_SRC_CYCLE = '''
+single S {
+    sync Void b() {
+        void = S.c();
+    }
+
+    sync Void c() {
+        void = S.b();
+        void = S.d();
+    }
+
+    sync Void d() effect io;
+
+    async Void r1() {
+        void = S.c();
+    }
+
+    async Void r2() {
+        void = S.b();
+    }
+}
+'''
+
+
+# The same send in two flows. f declares w after the slow call, g before it.
+WANDLE_SRC_DECLARE = '''
+class Int;
+class String;
+
+single Db {
+    sync String slow(Int key) cost 10ms;
+    async String fetch(Int key) cost 5ms;
+}
+
+flow f {
+    Int key!
+    String a;
+    a = Db.slow(key);
+    String w;
+    w << Db.fetch(key);
+}
+
+flow g {
+    Int key!
+    String a;
+    String w;
+    a = Db.slow(key);
+    w << Db.fetch(key);
+}
+'''
+
+
+class TestSerializedAsync(unittest.TestCase):
+
+    def test_declare_first(self):
+        wandle_model = build(WANDLE_SRC_DECLARE)
+        d_finding = dict([
+            (f.wandle_function.name, f)
+            for f in lint_run(wandle_model, lst_lint=[LINT_SERIALIZED_ASYNC])])
+        self.assertEqual(sorted(d_finding.keys()), ['f', 'g'])
+        for finding in d_finding.values():
+            self.assertEqual(finding.saved_ms, 5.0)
+        self.assertIn(
+            "straight after 'Int key!'. Move 'String w;' up with it.",
+            d_finding['f'].message)
+        self.assertIn(
+            "straight after 'String w;'.",
+            d_finding['g'].message)
+
+
+def diamond_src(n_level):
+    '''
+    Each level has a and b, and both call a and b on the next level. So
+    there are 2**n_level chains from r to the blocking method at the end.
+    '''
+    sb = ['single S {']
+    for level in range(n_level):
+        for name in ('a', 'b'):
+            sb.append('    sync Void %s%s() {'%(name, level))
+            if level + 1 < n_level:
+                sb.append('        void = S.a%s();'%(level + 1))
+                sb.append('        void = S.b%s();'%(level + 1))
+            else:
+                sb.append('        void = S.d();')
+            sb.append('    }')
+    sb.append('    sync Void d() effect io;')
+    sb.append('    async Void r() {')
+    sb.append('        void = S.a0();')
+    sb.append('        void = S.b0();')
+    sb.append('    }')
+    sb.append('}')
+    return '\n'.join(sb)
+
+
+class TestLoopBlocking(unittest.TestCase):
+
+    def test_one_chain_per_blocker(self):
+        wandle_model = build(diamond_src(22))
+        lst_message = [
+            f.message
+            for f in lint_run(wandle_model, lst_lint=[LINT_LOOP_BLOCKING])]
+        self.assertEqual(len(lst_message), 1)
+        self.assertIn(
+            'S.r -> %s -> S.d.'%(
+                ' -> '.join(['S.a%s'%(level) for level in range(22)])),
+            lst_message[0])
+
+    def test_each_root_through_a_cycle(self):
+        wandle_model = build(WANDLE_SRC_CYCLE)
+        lst_message = [
+            f.message
+            for f in lint_run(wandle_model, lst_lint=[LINT_LOOP_BLOCKING])]
+        self.assertEqual(len(lst_message), 2)
+        self.assertTrue(any(
+            'S.r1 -> S.c -> S.d.' in m for m in lst_message))
+        self.assertTrue(any(
+            'S.r2 -> S.b -> S.c -> S.d.' in m for m in lst_message))
+
+
+if __name__ == '__main__':
+    unittest.main()
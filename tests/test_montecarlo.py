@@ -0,0 +1,42 @@
+#
+# Monte Carlo latency, on small models.
+#
+
+from wandle.arpeggio_parse import arpeggio_parse_go
+from wandle.wandle_model import wandle_model_build
+from wandle.wandle_montecarlo import montecarlo_run
+
+import unittest
+
+
+WANDLE_SRC = '''
+single Db {
+    sync Void a() cost exponential(10ms);
+}
+
+flow f {
+    void = Db.a();
+    void = Db.a();
+    void = Db.a();
+}
+'''
+
+
+class TestMontecarlo(unittest.TestCase):
+
+    def test_one_sample_does_not_compound(self):
+        # Each call is exponential(10ms), so a flow averages 30ms. A draw
+        # that scaled the shared pool would multiply later draws by 10.
+        wandle_model = wandle_model_build(
+            parse_tree=arpeggio_parse_go(WANDLE_SRC),
+            b_print_diagnostic=False)
+        lst_ms = []
+        for seed in range(200):
+            (d,) = montecarlo_run(wandle_model, n_samples=1, seed=seed)
+            lst_ms.append(d['mean_ms'])
+        mean_ms = sum(lst_ms) / len(lst_ms)
+        self.assertTrue(20.0 < mean_ms < 40.0, mean_ms)
+
+
+if __name__ == '__main__':
+    unittest.main()
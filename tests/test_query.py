@@ -0,0 +1,47 @@
+#
+# Queries on a built model.
+#
+
+from wandle.arpeggio_parse import arpeggio_parse_go
+from wandle.wandle_model import wandle_model_build
+
+import unittest
+
+
+WANDLE_SRC = '''class Int;
+
+single S {
+    sync Void a(Int x);
+}
+
+flow f {
+    Int x!
+    void = S.a(x);
+}
+'''
+
+
+class TestQuery(unittest.TestCase):
+
+    def setUp(self):
+        self.wandle_model = wandle_model_build(
+            parse_tree=arpeggio_parse_go(WANDLE_SRC),
+            b_print_diagnostic=False)
+
+    def test_callers(self):
+        self.assertEqual(
+            [fn.get_qualified_name()
+                for fn in self.wandle_model.query_callers('S.a')],
+            ['f'])
+
+    def test_unknown_method(self):
+        self.assertTrue(self.wandle_model.has_function('f'))
+        self.assertFalse(self.wandle_model.has_function('S.b'))
+        with self.assertRaises(Exception):
+            self.wandle_model.query_callers('S.b')
+        with self.assertRaises(Exception):
+            self.wandle_model.query_flows_calling('T.a')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,6 +6,8 @@ from arpeggio import Optional, ZeroOrMore, OneOrMore, EOF, OrderedChoice
 from arpeggio import RegExMatch as _
 from arpeggio import ParserPython
 import arpeggio
+import bisect
+import threading
 
 
 def _word():                return _(r'\w+')
@@ -15,6 +17,9 @@ def _single_name():         return _(r'[A-Z][a-zA-Z0-9/,]*')
 def _snake():               return _(r'[a-zA-Z0-9_]*')
 def _note_word():           return _(r'[a-zA-Z0-9/,()-.]*')
 
+def _duration():            return _(r'[0-9]+(\.[0-9]+)?(us|ms|s)\b')
+def _number():              return _(r'[0-9]+(\.[0-9]+)?')
+
 def _csep_words():          return _word, ZeroOrMore(',', _word)
 def _csep_caps():           return _caps, ZeroOrMore(',', _caps)
 
@@ -57,13 +62,31 @@ def _cb_grammar():          return '{', ZeroOrMore(OrderedChoice([
 def _normal_sig_pair():     return _type, _snake
 def _method_sig():          return '(', Optional(_normal_sig_pair, ZeroOrMore(',', _normal_sig_pair)), ')'
 
+# Expected latency of a method. Either a fixed duration, as in 'cost 2ms',
+# or a distribution.
+def _dist_lognormal():      return 'lognormal', '(', _duration, ',', _number, ')'
+def _dist_exponential():    return 'exponential', '(', _duration, ')'
+def _hist_bin():            return _duration, ':', _number
+def _dist_histogram():      return 'histogram', '(', _hist_bin, ZeroOrMore(',', _hist_bin), ')'
+def _cost():                return 'cost', OrderedChoice([
+                                _dist_lognormal,
+                                _dist_exponential,
+                                _dist_histogram,
+                                _duration,
+                            ])
+
+# The kinds of blocking work a method does, as in 'effect io' or
+# 'effect net, cpu'. Goes after the cost.
+def _effect_kind():         return _(r'(io|net|cpu)\b')
+def _effect():              return 'effect', _effect_kind, ZeroOrMore(',', _effect_kind)
+
 # cgs is short for class/generic/single
-def _cgs_async_stub():      return 'async', _type, _snake, _method_sig, ';'
-def _cgs_async_impl():      return 'async', _type, _snake, _method_sig, _cb_grammar
+def _cgs_async_stub():      return 'async', _type, _snake, _method_sig, Optional(_cost), Optional(_effect), ';'
+def _cgs_async_impl():      return 'async', _type, _snake, _method_sig, Optional(_cost), Optional(_effect), _cb_grammar
 def _cgs_async_gram():      return OrderedChoice([_cgs_async_stub, _cgs_async_impl])
 
-def _cgs_sync_stub():       return 'sync', _type, _snake, _method_sig, ';'
-def _cgs_sync_impl():       return 'sync', _type, _snake, _method_sig, _cb_grammar
+def _cgs_sync_stub():       return 'sync', _type, _snake, _method_sig, Optional(_cost), Optional(_effect), ';'
+def _cgs_sync_impl():       return 'sync', _type, _snake, _method_sig, Optional(_cost), Optional(_effect), _cb_grammar
 def _cgs_sync_gram():       return OrderedChoice([_cgs_sync_stub, _cgs_sync_impl])
 
 def _cgs_var_stub():        return _(r'[A-Z][a-zA-Z0-9/,]*'), _(r'[a-zA-Z0-9_]*'), ';'
@@ -75,8 +98,12 @@ def _cgs_block():           return '{', ZeroOrMore(OrderedChoice([
                                 _cgs_sync_gram,
                             ])), '}'
 
+# Wire layout of a stub class or a generic, for generated codecs, as in
+# 'class Int layout i64;' or 'generic List ITEM layout list;'.
+def _layout():              return 'layout', _(r'(i8|i16|i32|i64|u8|u16|u32|u64|f32|f64|bool|utf8|list)\b')
+
 def _class_inh_list():      return _word, ZeroOrMore(',', _word)
-def _class_base_stub():     return 'class', _word, ';'
+def _class_base_stub():     return 'class', _word, Optional(_layout), ';'
 def _class_base_impl():     return 'class', _word, _cgs_block
 def _class_inh_stub():      return 'class', _word, 'is', _class_inh_list, ';'
 def _class_inh_impl():      return 'class', _word, 'is', _class_inh_list, _cgs_block
@@ -91,8 +118,8 @@ def _single_stub():         return 'single', _single_name, ';'
 def _single_impl():         return 'single', _snake, _cgs_block
 def _single_gram():         return OrderedChoice([_single_stub, _single_impl])
 
-def _generic_stub():        return 'generic', _type, _csep_caps, ';'
-def _generic_impl():        return 'generic', _type, _csep_caps, _cgs_block
+def _generic_stub():        return 'generic', _type, _csep_caps, Optional(_layout), ';'
+def _generic_impl():        return 'generic', _type, _csep_caps, Optional(_layout), _cgs_block
 def _generic_gram():        return OrderedChoice([
                                 _generic_stub,
                                 _generic_impl,
@@ -100,8 +127,11 @@ def _generic_gram():        return OrderedChoice([
 
 def _alias_gram():          return 'alias', _type, 'to', _type, ';'
 
-def _flow_stub():           return 'flow', _snake, ';'
-def _flow_impl():           return 'flow', _snake, _cb_grammar
+# Latency that a flow must finish within, as in 'budget 50ms'.
+def _budget():              return 'budget', _duration
+
+def _flow_stub():           return 'flow', _snake, Optional(_budget), ';'
+def _flow_impl():           return 'flow', _snake, Optional(_budget), _cb_grammar
 def _flow_gram():           return OrderedChoice([
                                 _flow_stub,
                                 _flow_impl,
@@ -117,7 +147,19 @@ def _grammar():             return ZeroOrMore(
                                 ]),
                             ), EOF
 
-def arpeggio_parse_go(wandle_src):
+# Building the parser from the grammar is expensive compared to a parse of a
+# small document, so we keep one around. Parsers hold state while they work,
+# so there is one per thread.
+_tls = threading.local()
+
+def arpeggio_parser_get():
+    parser = getattr(_tls, 'parser', None)
+    if parser == None:
+        parser = ParserPython(_grammar)
+        _tls.parser = parser
+    return parser
+
+def arpeggio_strip_comments(wandle_src):
     # I could not find a way in arpeggio to make it match to the end of the
     # line. But, I want to use hash as a comment marker until end of line, as
     # with bash and python. So, I am doing a pre-transform of the src
@@ -126,9 +168,12 @@ def arpeggio_parse_go(wandle_src):
     for line in wandle_src.split('\n'):
         line = line.split('#')[0]
         sb.append(line.rstrip())
-    wandle_src = '\n'.join(sb)
+    return '\n'.join(sb)
 
-    parser = ParserPython(_grammar)
+def arpeggio_parse_go(wandle_src):
+    wandle_src = arpeggio_strip_comments(wandle_src)
+
+    parser = arpeggio_parser_get()
     parse_tree = parser.parse(wandle_src)
     return parse_tree
 
@@ -143,3 +188,23 @@ def arpeggio_parse_debug(parse_tree):
                 recurse(itm)
             incl[0] -= 1
     recurse(parse_tree)
+
+class LineTable:
+    # Converts character offsets from the parse tree into 1-based (line,
+    # col). Offsets are into the source with comments stripped. Stripping
+    # only removes the tail of a line, so the line and column that we get
+    # back are also correct for the original source.
+
+    def __init__(self, wandle_src):
+        stripped = arpeggio_strip_comments(wandle_src)
+        self.lst_start = [0]
+        for (idx, c) in enumerate(stripped):
+            if c == '\n':
+                self.lst_start.append(idx + 1)
+
+    def linecol(self, position):
+        idx = bisect.bisect_right(self.lst_start, position) - 1
+        return (idx + 1, position - self.lst_start[idx] + 1)
+
+def arpeggio_pos_to_linecol(wandle_src, position):
+    return LineTable(wandle_src).linecol(position)
@@ -1,10 +1,51 @@
 #!/usr/bin/env python3
 
 from .arpeggio_parse import arpeggio_parse_debug
+from .arpeggio_parse import LineTable
 from .arpeggio_parse import arpeggio_parse_go
+from .wandle_batch import STATUS_VALID
+from .wandle_batch import batch_find_files
+from .wandle_batch import batch_validate
+from .wandle_codec import codec_bench
+from .wandle_codec import codec_write
+from .wandle_conform import MAX_OPEN_TRACES
+from .wandle_conform import WINDOW_SPANS
+from .wandle_conform import conform_run
+from .wandle_contention import contention_analyze
+from .wandle_diff import merkle_diff
+from .wandle_diff import merkle_tree_build
+from .wandle_fmt import wandle_fmt
+from .wandle_harness import harness_write
+from .wandle_json import json_export
+from .wandle_json import json_load
+from .wandle_lint import D_LINT
+from .wandle_lint import lint_run
+from .wandle_load import load_analyze
+from .wandle_graph import wandle_graph_build
+from .wandle_model import BuildError
+from .wandle_model import duration_as_ms
 from .wandle_model import wandle_model_build
+from .wandle_montecarlo import LST_PERCENTILE
+from .wandle_montecarlo import montecarlo_run
+from .wandle_montecarlo import percentile_label
+from .wandle_pydata import pydata_write
+from .wandle_pygen import pygen_write_all
+from .wandle_run import load_impl
+from .wandle_run import run_flows
+from .wandle_seqdiag import D_FMT_SUFFIX
+from .wandle_seqdiag import FMT_PLANTUML
+from .wandle_seqdiag import seqdiag_write
+from .wandle_seqdiag import seqdiag_write_all
+from .wandle_sim import sim_run
+from .wandle_trace import measured_load
+from .wandle_trace import measured_path
+from .wandle_trace import trace_ingest
+from .wandle_sqlite import sqlite_index_find
+from .wandle_sqlite import sqlite_index_open
+from .wandle_sqlite import sqlite_index_update
 
 import argparse
+import json
 import os
 import pprint
 import sys
@@ -17,13 +58,7 @@ def read_file(path):
     f_ptr.close()
     return data
 
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument('model_filename',
-        help='File containing the model.')
-    ns_args = parser.parse_args()
-
-    model_filename = ns_args.model_filename
+def check_model_filename(model_filename):
     if not os.path.exists(model_filename):
         print('ERROR: %s does not exist.'%(model_filename))
         sys.exit(1)
@@ -31,18 +66,1065 @@ def main():
         print('ERROR: %s is not a file.'%(model_filename))
         sys.exit(1)
 
-    # Transform Wandle DSL into a parse tree
-    wandle_src = read_file(model_filename)
-    parse_tree = arpeggio_parse_go(wandle_src)
+def build_error_exit(model_filename, e):
+    '''
+    Prints a BuildError at its place in the model source, and exits.
+    '''
+    if e.position == None or model_filename.endswith('.jsonl'):
+        print('%s: error: %s'%(model_filename, e.message))
+    else:
+        (line, col) = LineTable(read_file(model_filename)).linecol(e.position)
+        print('%s:%s:%s: error: %s'%(model_filename, line, col, e.message))
+    sys.exit(1)
+
+def load_model(model_filename, b_lazy=False, b_measured=False):
+    check_model_filename(model_filename)
+
+    # An export from the export sub-command loads without parsing.
+    if model_filename.endswith('.jsonl'):
+        f_ptr = open(model_filename)
+        wandle_model = json_load(f_ptr)
+        f_ptr.close()
+    else:
+        # Transform Wandle DSL into a parse tree
+        wandle_src = read_file(model_filename)
+        parse_tree = arpeggio_parse_go(wandle_src)
+
+        # Build the data model
+        try:
+            wandle_model = wandle_model_build(
+                parse_tree=parse_tree,
+                b_lazy=b_lazy)
+        except BuildError as e:
+            build_error_exit(model_filename, e)
+
+    # Costs from the ingest sub-command's sidecar, in place of the declared
+    # ones.
+    if b_measured:
+        measured_load(
+            wandle_model=wandle_model,
+            model_filename=model_filename)
+    return wandle_model
+
+def main_batch(ns_args):
+    lst_path = batch_find_files(ns_args.batch)
+    if not lst_path:
+        print('ERROR: no files match %s.'%(ns_args.batch))
+        sys.exit(1)
+
+    d_summary = batch_validate(
+        lst_path=lst_path,
+        jobs=ns_args.jobs)
+
+    if ns_args.summary == '-':
+        print(json.dumps(d_summary, indent=4))
+    else:
+        for d in d_summary['files']:
+            print('%-8s %s'%(d['status'], d['path']))
+            for error in d['lst_error']:
+                print('    %s'%(error))
+        print('%s files, %s valid, in %.3fs.'%(
+            len(lst_path),
+            d_summary['count'][STATUS_VALID],
+            d_summary['seconds']))
+        if ns_args.summary != None:
+            f_ptr = open(ns_args.summary, 'w')
+            json.dump(d_summary, f_ptr, indent=4)
+            f_ptr.close()
+
+    if d_summary['count'][STATUS_VALID] != len(lst_path):
+        sys.exit(1)
+
+def main_validate(lst_arg):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('model_filename', nargs='?', default=None,
+        help='File containing the model.')
+    parser.add_argument('--flow', default=None,
+        help='Only check this flow, and the method bodies it reaches.')
+    parser.add_argument('--batch', default=None,
+        help='Validate every .wandle file under a directory, or matching a glob.')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+        help='Number of worker processes for --batch.')
+    parser.add_argument('--summary', default=None,
+        help='Write a JSON summary of --batch here. Use - for stdout.')
+    ns_args = parser.parse_args(lst_arg)
+
+    if ns_args.batch != None:
+        main_batch(ns_args)
+        return
+    if ns_args.model_filename == None:
+        parser.error('model_filename is required, unless using --batch.')
 
-    # Build the data model
-    wandle_model = wandle_model_build(
-        parse_tree=parse_tree)
+    b_lazy = ns_args.flow != None
+    wandle_model = load_model(
+        model_filename=ns_args.model_filename,
+        b_lazy=b_lazy)
 
     # xxx debug 
     #print(wandle_model.as_code())
 
-    print('Model is valid.')
+    if ns_args.flow != None:
+        try:
+            lst_visited = wandle_model.check_flow(name=ns_args.flow)
+            wandle_model.check_budget(name=ns_args.flow)
+        except BuildError as e:
+            build_error_exit(ns_args.model_filename, e)
+        print('Flow %s is valid. (%s functions checked)'%(
+            ns_args.flow, len(lst_visited)))
+    else:
+        try:
+            wandle_model.check_budgets()
+        except BuildError as e:
+            build_error_exit(ns_args.model_filename, e)
+        print('Model is valid.')
+
+def main_ingest(lst_arg):
+    parser = argparse.ArgumentParser(prog='wandle.main ingest')
+    parser.add_argument('model_filename',
+        help='File containing the model. The sidecar goes next to it.')
+    parser.add_argument('lst_trace', nargs='+', metavar='TRACE',
+        help='Chrome trace or OpenTelemetry JSON files, which may be gzipped.')
+    parser.add_argument('--map', dest='lst_map', action='append',
+        metavar='SPAN=NAME',
+        help='Count spans called SPAN against the flow or method NAME.')
+    parser.add_argument('--reset', action='store_true',
+        help='Start the sidecar again, rather than add to it.')
+    parser.add_argument('--top', type=int, default=10,
+        help='How many unmatched span names to list.')
+    ns_args = parser.parse_args(lst_arg)
+
+    wandle_model = load_model(
+        model_filename=ns_args.model_filename)
+    d_map = parse_name_value(ns_args.lst_map, str, 'map')
+    if None in d_map:
+        parser.error('--map needs a span name, as in db.query=Db.get')
+
+    sidecar_path = measured_path(ns_args.model_filename)
+    d_result = trace_ingest(
+        wandle_model=wandle_model,
+        lst_path=ns_args.lst_trace,
+        sidecar_path=sidecar_path,
+        d_map=d_map,
+        b_reset=ns_args.reset)
+    print('Read %s spans, matched %s. Wrote %s.'%(
+        d_result['spans'], d_result['matched'], sidecar_path))
+
+    def ms(value):
+        if value == None:
+            return '-'
+        return '%.3gms'%(value)
+
+    d_function = wandle_model.get_functions()
+    print()
+    print('%-40s %10s %10s %10s %10s %10s'%(
+        'measured', 'calls', 'mean', 'p50', 'p99', 'declared'))
+    # The sidecar can hold names from earlier ingests that the model has
+    # since dropped or renamed. Those are listed on their own.
+    lst_stale = []
+    for (name, measured) in sorted(d_result['measured'].items()):
+        if name not in d_function:
+            lst_stale.append((name, measured))
+            continue
+        print('%-40s %10s %10s %10s %10s %10s'%(
+            name, measured.count, ms(measured.mean_ms()),
+            ms(measured.percentile_ms(50.0)), ms(measured.percentile_ms(99.0)),
+            ms(d_function[name].cost_ms)))
+    if lst_stale:
+        print()
+        print('%-40s %10s'%('measured, not in the model', 'calls'))
+        for (name, measured) in lst_stale:
+            print('%-40s %10s'%(name, measured.count))
+    lst_unmatched = sorted(d_result['unmatched'].items(),
+        key=lambda t: (-t[1], t[0]))
+    if lst_unmatched:
+        print()
+        print('%-40s %10s'%('unmatched span', 'count'))
+        for (name, count) in lst_unmatched[:ns_args.top]:
+            print('%-40s %10s'%(name, count))
+
+def main_latency(lst_arg):
+    parser = argparse.ArgumentParser(prog='wandle.main latency')
+    parser.add_argument('model_filename',
+        help='File containing the model.')
+    parser.add_argument('--flow', dest='lst_flow', action='append',
+        metavar='FLOW', default=None,
+        help='Flows to report. Repeat for more. Default is all flows.')
+    parser.add_argument('--measured', action='store_true',
+        help='Use the costs measured by ingest, where there are any.')
+    ns_args = parser.parse_args(lst_arg)
+
+    wandle_model = load_model(
+        model_filename=ns_args.model_filename,
+        b_lazy=True,
+        b_measured=ns_args.measured)
+    lst_flow = ns_args.lst_flow
+    if lst_flow == None:
+        lst_flow = list(wandle_model.d_flow.keys())
+
+    d_memo = {}
+    print('%-30s %10s %10s %5s %10s'%(
+        'flow', 'return', 'critical', 'hops', 'budget'))
+    for flow_name in lst_flow:
+        try:
+            wandle_model.check_flow(name=flow_name)
+        except BuildError as e:
+            build_error_exit(ns_args.model_filename, e)
+        latency = wandle_model.get_flow_latency(
+            name=flow_name,
+            d_memo=d_memo)
+        budget_ms = wandle_model.d_flow[flow_name].budget_ms
+        s_budget = '-'
+        if budget_ms != None:
+            s_budget = '%gms'%(budget_ms)
+            if latency.done_ms > budget_ms:
+                s_budget = s_budget + ' !'
+        print('%-30s %10s %10s %5s %10s'%(
+            flow_name,
+            '%gms'%(latency.ret_ms),
+            '%gms'%(latency.done_ms),
+            latency.hops,
+            s_budget))
+        print('    %s'%(' -> '.join(latency.lst_path)))
+
+def main_montecarlo(lst_arg):
+    parser = argparse.ArgumentParser(prog='wandle.main montecarlo')
+    parser.add_argument('model_filename',
+        help='File containing the model.')
+    parser.add_argument('--flow', dest='lst_flow', action='append',
+        metavar='FLOW', default=None,
+        help='Flows to simulate. Repeat for more. Default is all flows.')
+    parser.add_argument('-n', '--samples', type=int, default=1000000,
+        help='Samples per flow.')
+    parser.add_argument('--seed', type=int, default=None,
+        help='Seed for the random generator, for repeatable runs.')
+    parser.add_argument('--return', dest='b_return', action='store_true',
+        help='Measure until the flow returns, without waiting for async sends.')
+    parser.add_argument('--json', action='store_true',
+        help='Print the results as json.')
+    parser.add_argument('--measured', action='store_true',
+        help='Use the costs measured by ingest, where there are any.')
+    ns_args = parser.parse_args(lst_arg)
+
+    wandle_model = load_model(
+        model_filename=ns_args.model_filename,
+        b_measured=ns_args.measured)
+    lst_result = montecarlo_run(
+        wandle_model=wandle_model,
+        n_samples=ns_args.samples,
+        lst_flow_name=ns_args.lst_flow,
+        seed=ns_args.seed,
+        b_return=ns_args.b_return)
+
+    if ns_args.json:
+        print(json.dumps(lst_result, indent=4))
+        return
+
+    lst_label = [percentile_label(p) for p in LST_PERCENTILE]
+    print('%-30s %10s %s'%(
+        'flow', 'mean', ' '.join(['%10s'%(l) for l in lst_label])))
+    for d in lst_result:
+        print('%-30s %10s %s'%(
+            d['flow'],
+            '%.3gms'%(d['mean_ms']),
+            ' '.join(['%10s'%('%.3gms'%(d[l])) for l in lst_label])))
+
+def arg_seconds(s):
+    '''
+    argparse type for a duration in seconds. Takes a bare number of
+    seconds, as the harness does, or a duration such as 500ms.
+    '''
+    try:
+        seconds = float(s)
+    except ValueError:
+        try:
+            seconds = duration_as_ms(s) / 1000.0
+        except Exception:
+            seconds = None
+    if seconds == None or not seconds > 0:
+        raise argparse.ArgumentTypeError(
+            "invalid duration %r, use seconds or a unit, as in 10 or 500ms"%(s))
+    return seconds
+
+def parse_name_value(lst_s, fn_value, what):
+    '''
+    Turns a list of NAME=VALUE strings into a dict. A VALUE on its own
+    is keyed by None.
+    '''
+    d = {}
+    for s in lst_s or []:
+        (name, sep, value) = s.rpartition('=')
+        if not sep:
+            name = None
+        try:
+            d[name] = fn_value(value)
+        except ValueError:
+            raise Exception("Invalid %s %s"%(what, s))
+    return d
+
+def parse_rates(lst_rate, wandle_model):
+    '''
+    As parse_name_value. A rate with no flow name applies to every flow
+    that is not named.
+    '''
+    d_rate = parse_name_value(lst_rate, float, 'rate')
+    if None in d_rate:
+        rate = d_rate.pop(None)
+        for flow_name in wandle_model.d_flow.keys():
+            d_rate.setdefault(flow_name, rate)
+    return d_rate
+
+def main_lint(lst_arg):
+    parser = argparse.ArgumentParser(prog='wandle.main lint')
+    parser.add_argument('model_filename',
+        help='File containing the model.')
+    parser.add_argument('--lint', dest='lst_lint', action='append',
+        choices=sorted(D_LINT.keys()), default=None,
+        help='Lints to run. Repeat for more. Default is all.')
+    parser.add_argument('--json', action='store_true',
+        help='Print the findings as json.')
+    ns_args = parser.parse_args(lst_arg)
+
+    wandle_model = load_model(
+        model_filename=ns_args.model_filename)
+    lst_finding = lint_run(
+        wandle_model=wandle_model,
+        lst_lint=ns_args.lst_lint)
+
+    line_table = None
+    if not ns_args.model_filename.endswith('.jsonl'):
+        line_table = LineTable(read_file(ns_args.model_filename))
+    lst_d = []
+    for finding in lst_finding:
+        d = finding.as_dict()
+        d['line'] = None
+        d['col'] = None
+        position = finding.get_position()
+        if line_table != None and position != None:
+            (d['line'], d['col']) = line_table.linecol(position)
+        lst_d.append(d)
+
+    if ns_args.json:
+        print(json.dumps(lst_d, indent=4))
+    else:
+        for d in lst_d:
+            if d['line'] != None:
+                s_where = '%s:%s:%s'%(
+                    ns_args.model_filename, d['line'], d['col'])
+            else:
+                s_where = ns_args.model_filename
+            print('%s: %s: %s: %s'%(
+                s_where, d['lint'], d['function'], d['message']))
+    if lst_finding:
+        sys.exit(1)
+
+def main_load(lst_arg):
+    parser = argparse.ArgumentParser(prog='wandle.main load')
+    parser.add_argument('model_filename',
+        help='File containing the model.')
+    parser.add_argument('--rate', dest='lst_rate', action='append',
+        metavar='[FLOW=]N', required=True,
+        help='Arrivals per second. N alone applies to every flow. Repeat for more.')
+    parser.add_argument('--servers', dest='lst_servers', action='append',
+        metavar='NAME=N',
+        help='Concurrency limit of a resource. Default 1.')
+    parser.add_argument('--instances', action='store_true',
+        help='Treat classes as resources too, one pool per class.')
+    parser.add_argument('--top', type=int, default=20,
+        help='How many resources and methods to list.')
+    parser.add_argument('--json', action='store_true',
+        help='Print the results as json.')
+    parser.add_argument('--measured', action='store_true',
+        help='Use the costs measured by ingest, where there are any.')
+    ns_args = parser.parse_args(lst_arg)
+
+    wandle_model = load_model(
+        model_filename=ns_args.model_filename,
+        b_measured=ns_args.measured)
+    d_result = load_analyze(
+        wandle_model=wandle_model,
+        d_rate=parse_rates(ns_args.lst_rate, wandle_model),
+        d_servers=parse_name_value(ns_args.lst_servers, int, 'servers'),
+        b_instances=ns_args.instances)
+    if ns_args.json:
+        print(json.dumps(d_result, indent=4))
+        return
+
+    print('%-20s %7s %10s %9s %6s %7s %10s %10s'%(
+        'resource', 'servers', 'per sec', 'hold', 'util', 'p wait',
+        'mean wait', 'saturates'))
+    for d in d_result['resources'][:ns_args.top]:
+        s_wait = 'inf'
+        if d['mean_wait_ms'] != None:
+            s_wait = '%.3gms'%(d['mean_wait_ms'])
+        s_saturation = '-'
+        if d['saturation_per_s'] != None:
+            s_saturation = '%.4g/s'%(d['saturation_per_s'])
+        print('%-20s %7s %10s %9s %5.1f%% %7.3f %10s %10s%s'%(
+            d['resource'], d['servers'], '%.4g'%(d['rate_per_s']),
+            '%.3gms'%(d['hold_ms']), 100.0 * d['utilization'], d['p_wait'],
+            s_wait, s_saturation, ' !' if d['saturated'] else ''))
+    print()
+    print('%-40s %10s %9s %12s'%('method', 'per sec', 'cost', 'ms per sec'))
+    for d in d_result['methods'][:ns_args.top]:
+        print('%-40s %10s %9s %12s'%(
+            d['method'], '%.4g'%(d['rate_per_s']), '%.3gms'%(d['cost_ms']),
+            '%.4g'%(d['demand_ms_per_s'])))
+
+def main_simulate(lst_arg):
+    parser = argparse.ArgumentParser(prog='wandle.main simulate')
+    parser.add_argument('model_filename',
+        help='File containing the model.')
+    parser.add_argument('--rate', dest='lst_rate', action='append',
+        metavar='[FLOW=]N', required=True,
+        help='Arrivals per second. N alone applies to every flow. Repeat for more.')
+    parser.add_argument('--duration', type=arg_seconds, default=10.0,
+        help='How long flows keep arriving, in seconds, or with a unit, '
+            'as in 500ms.')
+    parser.add_argument('--servers', dest='lst_servers', action='append',
+        metavar='NAME=N',
+        help='Concurrency limit of a resource. Default 1.')
+    parser.add_argument('--queue', dest='lst_queue', action='append',
+        metavar='NAME=N',
+        help='Queue limit of a resource. Calls past it are rejected. Default none.')
+    parser.add_argument('--instances', action='store_true',
+        help='Treat classes as resources too, one pool per class.')
+    parser.add_argument('--seed', type=int, default=None,
+        help='Seed for the random generator, for repeatable runs.')
+    parser.add_argument('--trace', metavar='FILE', default=None,
+        help='Write the timeline to FILE as a Chrome trace.')
+    parser.add_argument('--json', action='store_true',
+        help='Print the results as json.')
+    parser.add_argument('--measured', action='store_true',
+        help='Use the costs measured by ingest, where there are any.')
+    ns_args = parser.parse_args(lst_arg)
+
+    wandle_model = load_model(
+        model_filename=ns_args.model_filename,
+        b_measured=ns_args.measured)
+
+    d_rate = parse_rates(ns_args.lst_rate, wandle_model)
+
+    f_trace = None
+    if ns_args.trace != None:
+        f_trace = open(ns_args.trace, 'w')
+    d_result = sim_run(
+        wandle_model=wandle_model,
+        d_rate=d_rate,
+        duration_ms=ns_args.duration * 1000.0,
+        d_servers=parse_name_value(ns_args.lst_servers, int, 'servers'),
+        d_queue=parse_name_value(ns_args.lst_queue, int, 'queue'),
+        b_instances=ns_args.instances,
+        seed=ns_args.seed,
+        f_trace=f_trace)
+    if f_trace != None:
+        f_trace.close()
+
+    if ns_args.json:
+        print(json.dumps(d_result, indent=4))
+        return
+
+    def ms(value):
+        if value == None:
+            return '-'
+        return '%.3gms'%(value)
+
+    print('%-30s %8s %8s %8s %10s %10s %10s'%(
+        'flow', 'arrived', 'done', 'dropped', 'mean', 'p95', 'p99'))
+    for d in d_result['flows']:
+        print('%-30s %8s %8s %8s %10s %10s %10s'%(
+            d['flow'], d['arrived'], d['completed'], d['dropped'],
+            ms(d['mean_ms']), ms(d['p95_ms']), ms(d['p99_ms'])))
+    print()
+    print('%-20s %7s %9s %6s %10s %10s %6s %8s %12s'%(
+        'resource', 'servers', 'per sec', 'util', 'mean wait', 'p95 wait',
+        'queue', 'rejected', 'saturates'))
+    for d in d_result['resources']:
+        s_saturation = '-'
+        if d['saturation_per_s'] != None:
+            s_saturation = '%.4g/s x%.3g'%(
+                d['saturation_per_s'], d['saturation_load'])
+        print('%-20s %7s %9s %5.1f%% %10s %10s %6s %8s %12s'%(
+            d['resource'], d['servers'], '%.4g'%(d['throughput_per_s']),
+            100.0 * d['utilization'], ms(d['mean_wait_ms']),
+            ms(d['p95_wait_ms']), d['max_queue'], d['rejected'],
+            s_saturation))
+    if d_result['deadlocked']:
+        print()
+        print('Deadlock. %s runs never finished. Queued on: %s'%(
+            sum([d['stuck'] for d in d_result['flows']]),
+            ', '.join(d_result['deadlocked'])))
+
+def main_run(lst_arg):
+    parser = argparse.ArgumentParser(prog='wandle.main run')
+    parser.add_argument('model_filename',
+        help='File containing the model.')
+    parser.add_argument('lst_flow', nargs='+', metavar='FLOW',
+        help='Flows to run. Workers take them in turn.')
+    parser.add_argument('--concurrency', type=int, default=10,
+        help='Number of workers, each running flows back to back.')
+    parser.add_argument('--duration', type=arg_seconds, default=10.0,
+        help='How long the workers keep starting flows, in seconds, or '
+            'with a unit, as in 500ms.')
+    parser.add_argument('--impl', dest='lst_impl', action='append',
+        metavar='METHOD=MODULE:FUNCTION',
+        help='Python implementation of a method. Repeat for more. '
+            'The rest are faked.')
+    parser.add_argument('--latency', dest='lst_latency', action='append',
+        metavar='METHOD=DURATION',
+        help='Latency of the fake for a method, in place of its cost.')
+    parser.add_argument('--scale', type=float, default=1.0,
+        help='Multiplies the latency of every fake.')
+    parser.add_argument('--sync-yields', action='store_true',
+        help='Sync fakes sleep with asyncio, rather than block the loop.')
+    parser.add_argument('--seed', type=int, default=None,
+        help='Seed for the random generator, for repeatable runs.')
+    parser.add_argument('--json', action='store_true',
+        help='Print the results as json.')
+    ns_args = parser.parse_args(lst_arg)
+
+    wandle_model = load_model(
+        model_filename=ns_args.model_filename)
+
+    d_impl = {}
+    for (name, spec) in parse_name_value(ns_args.lst_impl, str, 'impl').items():
+        if name == None:
+            parser.error('--impl needs a method name, as in Db.get=mod:get')
+        d_impl[name] = load_impl(spec)
+    d_latency_ms = parse_name_value(
+        ns_args.lst_latency, duration_as_ms, 'latency')
+    if None in d_latency_ms:
+        parser.error('--latency needs a method name, as in Db.get=5ms')
+
+    d_result = run_flows(
+        wandle_model=wandle_model,
+        lst_flow=ns_args.lst_flow,
+        concurrency=ns_args.concurrency,
+        duration_s=ns_args.duration,
+        d_impl=d_impl,
+        d_latency_ms=d_latency_ms,
+        scale=ns_args.scale,
+        b_sync_yields=ns_args.sync_yields,
+        seed=ns_args.seed)
+
+    if ns_args.json:
+        print(json.dumps(d_result, indent=4))
+        return
+
+    def ms(value):
+        if value == None:
+            return '-'
+        return '%.3gms'%(value)
+
+    print('%-30s %8s %6s %9s %10s %10s %10s %10s'%(
+        'flow', 'done', 'errors', 'per sec', 'return', 'mean', 'p95', 'p99'))
+    for d in d_result['flows']:
+        print('%-30s %8s %6s %9s %10s %10s %10s %10s'%(
+            d['flow'], d['count'], d['errors'],
+            '%.4g'%(d['throughput_per_s']), ms(d['return_mean_ms']),
+            ms(d['mean_ms']), ms(d['p95_ms']), ms(d['p99_ms'])))
+    for d in d_result['flows']:
+        if d['first_error'] != None:
+            print('%s: first error, %s'%(d['flow'], d['first_error']))
+    print()
+    print('%-30s %5s %8s %9s %10s %10s'%(
+        'method', 'impl', 'calls', 'per sec', 'mean', 'p99'))
+    for d in d_result['methods']:
+        print('%-30s %5s %8s %9s %10s %10s'%(
+            d['method'], d['impl'], d['count'],
+            '%.4g'%(d['throughput_per_s']), ms(d['mean_ms']),
+            ms(d['p99_ms'])))
+
+def main_query(lst_arg):
+    parser = argparse.ArgumentParser(prog='wandle.main query')
+    parser.add_argument('model_filename',
+        help='File containing the model.')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--callers', metavar='METHOD',
+        help='Methods and flows that call METHOD directly. (e.g. Org.init)')
+    group.add_argument('--flows-calling', metavar='METHOD',
+        help='Flows that reach METHOD, directly or indirectly.')
+    group.add_argument('--users', metavar='TYPE',
+        help='Fields, params, returns and vars of TYPE.')
+    group.add_argument('--single-flows', metavar='SINGLE',
+        help='Flows that touch SINGLE, directly or indirectly.')
+    ns_args = parser.parse_args(lst_arg)
+
+    wandle_model = load_model(
+        model_filename=ns_args.model_filename)
+
+    # A name the model does not have is an error, not an empty answer.
+    s_missing = None
+    for qname in (ns_args.callers, ns_args.flows_calling):
+        if qname != None and not wandle_model.has_function(qname):
+            s_missing = 'no method %s'%(qname)
+    if ns_args.users != None:
+        # get_class raises for a generic it does not know.
+        try:
+            wandle_class = wandle_model.get_class(cstring=ns_args.users)
+        except Exception:
+            wandle_class = None
+        if wandle_class == None:
+            s_missing = 'no class %s'%(ns_args.users)
+    if ns_args.single_flows != None:
+        if ns_args.single_flows not in wandle_model.d_single:
+            s_missing = 'no single %s'%(ns_args.single_flows)
+    if s_missing != None:
+        print('ERROR: %s in %s.'%(s_missing, ns_args.model_filename))
+        sys.exit(1)
+
+    if ns_args.callers != None:
+        for wandle_function in wandle_model.query_callers(ns_args.callers):
+            print(wandle_function.get_qualified_name())
+    elif ns_args.flows_calling != None:
+        for wandle_function in wandle_model.query_flows_calling(
+                ns_args.flows_calling):
+            print(wandle_function.get_qualified_name())
+    elif ns_args.users != None:
+        for (kind, where, position) in wandle_model.query_type_users(
+                ns_args.users):
+            print('%-8s %s'%(kind, where))
+    elif ns_args.single_flows != None:
+        for wandle_function in wandle_model.query_single_flows(
+                ns_args.single_flows):
+            print(wandle_function.get_qualified_name())
+
+def main_harness(lst_arg):
+    parser = argparse.ArgumentParser(prog='wandle.main harness')
+    parser.add_argument('model_filename',
+        help='File containing the model.')
+    parser.add_argument('package_dir',
+        help='Package written by pygen. The driver goes in here.')
+    ns_args = parser.parse_args(lst_arg)
+
+    wandle_model = load_model(
+        model_filename=ns_args.model_filename)
+    print(harness_write(
+        wandle_model=wandle_model,
+        package_dir=ns_args.package_dir))
+
+def main_index(lst_arg):
+    parser = argparse.ArgumentParser(prog='wandle.main index')
+    parser.add_argument('db_filename',
+        help='SQLite database that holds the index.')
+    parser.add_argument('lst_path', nargs='*', metavar='PATH',
+        help='Files, directories or globs to index.')
+    parser.add_argument('--find', metavar='PATTERN', default=None,
+        help='Show definitions and references matching PATTERN (a glob).')
+    ns_args = parser.parse_args(lst_arg)
+
+    conn = sqlite_index_open(ns_args.db_filename)
+
+    if ns_args.lst_path:
+        lst_path = []
+        for dir_or_glob in ns_args.lst_path:
+            lst_path.extend(batch_find_files(dir_or_glob))
+        (count_indexed, count_unchanged, count_dropped) = sqlite_index_update(
+            conn=conn,
+            lst_path=lst_path)
+        print('Indexed %s, unchanged %s, dropped %s.'%(
+            count_indexed, count_unchanged, count_dropped))
+
+    if ns_args.find != None:
+        (lst_definition, lst_reference) = sqlite_index_find(
+            conn=conn,
+            pattern=ns_args.find)
+        for (path, line, col, kind, name) in lst_definition:
+            print('%s:%s:%s: def %s %s'%(path, line, col, kind, name))
+        for (path, line, col, kind, name, context) in lst_reference:
+            print('%s:%s:%s: ref %s %s in %s'%(
+                path, line, col, kind, name, context))
+
+    conn.close()
+
+def main_conform(lst_arg):
+    parser = argparse.ArgumentParser(prog='wandle.main conform')
+    parser.add_argument('model_filename',
+        help='File containing the model.')
+    parser.add_argument('lst_log', nargs='+', metavar='LOG',
+        help='OpenTelemetry spans as JSON lines, which may be gzipped.')
+    parser.add_argument('--map', dest='lst_map', action='append',
+        metavar='SPAN=NAME',
+        help='Take spans called SPAN as calls to the flow or method NAME.')
+    parser.add_argument('--window', type=int, default=WINDOW_SPANS,
+        help='Spans to wait, after the last span of a trace, before '
+            'checking it.')
+    parser.add_argument('--max-open', type=int, default=MAX_OPEN_TRACES,
+        help='Most traces held at once.')
+    parser.add_argument('--top', type=int, default=20,
+        help='How many findings to list.')
+    parser.add_argument('--json', action='store_true',
+        help='Print the results as json.')
+    ns_args = parser.parse_args(lst_arg)
+
+    wandle_model = load_model(
+        model_filename=ns_args.model_filename)
+    d_map = parse_name_value(ns_args.lst_map, str, 'map')
+    if None in d_map:
+        parser.error('--map needs a span name, as in db.query=Db.get')
+
+    d_result = conform_run(
+        wandle_model=wandle_model,
+        lst_path=ns_args.lst_log,
+        d_map=d_map,
+        window=ns_args.window,
+        max_open=ns_args.max_open)
+    if ns_args.json:
+        print(json.dumps(d_result, indent=4))
+        return
+
+    print('%s spans in %s traces. %s conform, %s match nothing in the model.'%(
+        d_result['spans'], d_result['traces'], d_result['conformant'],
+        d_result['unmatched']))
+    if d_result['checked_early']:
+        print('%s traces were checked early, past --max-open.'%(
+            d_result['checked_early']))
+    if not d_result['findings']:
+        return
+    print()
+    print('%-30s %-9s %-30s %12s  %s'%(
+        'function', 'finding', 'call', 'count', 'example trace'))
+    for d in d_result['findings'][:ns_args.top]:
+        print('%-30s %-9s %-30s %12s  %s'%(
+            d['function'], d['kind'], d['call'],
+            '%s/%s'%(d['count'], d['checked']), d['example_trace']))
+
+def main_contention(lst_arg):
+    parser = argparse.ArgumentParser(prog='wandle.main contention')
+    parser.add_argument('model_filename',
+        help='File containing the model.')
+    parser.add_argument('--rate', dest='lst_rate', action='append',
+        metavar='[FLOW=]N', default=None,
+        help='Runs per second, for the utilization of each lock. N alone '
+            'applies to every flow.')
+    parser.add_argument('--measured', action='store_true',
+        help='Use the costs measured by ingest, where there are any.')
+    parser.add_argument('--paths', action='store_true',
+        help='List the paths of each flow.')
+    parser.add_argument('--json', action='store_true',
+        help='Print the results as json.')
+    ns_args = parser.parse_args(lst_arg)
+
+    wandle_model = load_model(
+        model_filename=ns_args.model_filename,
+        b_measured=ns_args.measured)
+    d_result = contention_analyze(
+        wandle_model=wandle_model,
+        d_rate=parse_rates(ns_args.lst_rate, wandle_model))
+    if ns_args.json:
+        print(json.dumps(d_result, indent=4))
+        return
+
+    if not d_result['locks']:
+        print('No contended state.')
+    for d in d_result['locks']:
+        s_limit = ''
+        if d['ceiling_per_s'] != None:
+            s_limit = ', at most %.4g runs/s'%(d['ceiling_per_s'])
+        if d['utilization'] != None:
+            s_limit = '%s, %.1f%% busy%s'%(s_limit, 100.0 * d['utilization'],
+                ' !' if d['utilization'] >= 1.0 else '')
+        print('%s (%s)%s'%(d['guard'], d['scope'], s_limit))
+        print('    covers   %s'%(', '.join(d['locations'])))
+        print('    written  %s'%(', '.join(d['writers'])))
+        if d['others']:
+            print('    read     %s'%(', '.join(d['others'])))
+        if d['hold_ms']:
+            print('    held     %s'%(', '.join([
+                '%gms per %s'%(ms, root)
+                for (root, ms) in d['hold_ms'].items()])))
+    if d_result['read_only']:
+        print()
+        print('Shared, read only, needs no lock: %s'%(
+            ', '.join(d_result['read_only'])))
+    if ns_args.paths:
+        print()
+        for (root, lst_path) in d_result['paths'].items():
+            for path in lst_path:
+                print(path)
+
+def main_diff(lst_arg):
+    parser = argparse.ArgumentParser(prog='wandle.main diff')
+    parser.add_argument('old_filename',
+        help='The earlier version of the model.')
+    parser.add_argument('new_filename',
+        help='The later version of the model.')
+    ns_args = parser.parse_args(lst_arg)
+
+    old_tree = merkle_tree_build(load_model(ns_args.old_filename))
+    new_tree = merkle_tree_build(load_model(ns_args.new_filename))
+
+    d_op_char = {'added': '+', 'removed': '-', 'changed': '~'}
+    for change in merkle_diff(old_tree=old_tree, new_tree=new_tree):
+        print('%s %s'%(d_op_char[change.op], change.get_label()))
+        if change.lst_flow:
+            print('    flows: %s'%(', '.join(change.lst_flow)))
+
+def main_export(lst_arg):
+    parser = argparse.ArgumentParser(prog='wandle.main export')
+    parser.add_argument('model_filename',
+        help='File containing the model.')
+    parser.add_argument('--out', default=None,
+        help='Write the export here. Default is stdout.')
+    ns_args = parser.parse_args(lst_arg)
+
+    wandle_model = load_model(
+        model_filename=ns_args.model_filename)
+    # Line and column come from the source, where we have it.
+    wandle_src = None
+    if not ns_args.model_filename.endswith('.jsonl'):
+        wandle_src = read_file(ns_args.model_filename)
+    if ns_args.out == None:
+        json_export(
+            f_out=sys.stdout,
+            wandle_model=wandle_model,
+            wandle_src=wandle_src)
+    else:
+        f_ptr = open(ns_args.out, 'w')
+        json_export(
+            f_out=f_ptr,
+            wandle_model=wandle_model,
+            wandle_src=wandle_src)
+        f_ptr.close()
+
+def main_fmt(lst_arg):
+    parser = argparse.ArgumentParser(prog='wandle.main fmt')
+    parser.add_argument('lst_filename', nargs='+', metavar='model_filename',
+        help='Files to format.')
+    parser.add_argument('--check', action='store_true',
+        help='Do not write. List files that would change, and exit 1 if any.')
+    ns_args = parser.parse_args(lst_arg)
+
+    lst_changed = []
+    for filename in ns_args.lst_filename:
+        check_model_filename(filename)
+        wandle_src = read_file(filename)
+        formatted = wandle_fmt(wandle_src)
+        if formatted == wandle_src:
+            continue
+        lst_changed.append(filename)
+        if not ns_args.check:
+            f_ptr = open(filename, 'w')
+            f_ptr.write(formatted)
+            f_ptr.close()
+
+    for filename in lst_changed:
+        if ns_args.check:
+            print('would reformat %s'%(filename))
+        else:
+            print('reformatted %s'%(filename))
+    if ns_args.check and lst_changed:
+        sys.exit(1)
+
+def main_graph(lst_arg):
+    parser = argparse.ArgumentParser(prog='wandle.main graph')
+    parser.add_argument('model_filename',
+        help='File containing the model.')
+    parser.add_argument('--from', dest='lst_flow', action='append',
+        metavar='FLOW', default=None,
+        help='Flows to start from. Repeat for more. Default is all flows.')
+    parser.add_argument('--top', type=int, default=10,
+        help='How many entries to show for fan-in and fan-out.')
+    parser.add_argument('--npz', default=None,
+        help='Also save the CSR arrays to this .npz file.')
+    ns_args = parser.parse_args(lst_arg)
+
+    wandle_model = load_model(
+        model_filename=ns_args.model_filename)
+    graph = wandle_graph_build(wandle_model)
+    print(graph)
+
+    for (title, arr) in (('fan-in', graph.fan_in()), ('fan-out', graph.fan_out())):
+        print('')
+        print('// %s'%(title))
+        for idx in arr.argsort(kind='stable')[::-1][:ns_args.top]:
+            if arr[idx] == 0:
+                break
+            print('%6s %s'%(arr[idx], graph.get_name(idx)))
+
+    d_unreachable = graph.unreachable(lst_flow_name=ns_args.lst_flow)
+    for (kind_name, lst_name) in d_unreachable.items():
+        print('')
+        print('// unreachable %s (%s)'%(kind_name, len(lst_name)))
+        for name in lst_name:
+            print('    %s'%(name))
+
+    if ns_args.npz != None:
+        graph.as_npz(ns_args.npz)
+
+def main_codec(lst_arg):
+    parser = argparse.ArgumentParser(prog='wandle.main codec')
+    parser.add_argument('model_filename',
+        help='File containing the model.')
+    parser.add_argument('--out', default=None,
+        help='Write the module here. Default is stdout.')
+    parser.add_argument('--bench', action='store_true',
+        help='Time the codec against pickle and json, instead of writing it.')
+    parser.add_argument('--class', dest='lst_class', action='append',
+        metavar='CLASS', default=None,
+        help='Class to bench. Repeat for more. Default is all of them.')
+    parser.add_argument('-n', type=int, default=10000,
+        help='Round trips to time, per class and format.')
+    ns_args = parser.parse_args(lst_arg)
+
+    wandle_model = load_model(
+        model_filename=ns_args.model_filename)
+    if not ns_args.bench:
+        if ns_args.out == None:
+            codec_write(
+                f_out=sys.stdout,
+                wandle_model=wandle_model)
+        else:
+            f_ptr = open(ns_args.out, 'w')
+            codec_write(
+                f_out=f_ptr,
+                wandle_model=wandle_model)
+            f_ptr.close()
+        return
+
+    lst_row = codec_bench(
+        wandle_model=wandle_model,
+        n=ns_args.n,
+        lst_cstring=ns_args.lst_class)
+    print('%-24s %-7s %8s %10s %10s'%(
+        'class', 'format', 'bytes', 'pack us', 'unpack us'))
+    for row in lst_row:
+        for fmt in ('codec', 'pickle', 'json'):
+            print('%-24s %-7s %8d %10.2f %10.2f'%(
+                row['class'],
+                fmt,
+                row['%s_bytes'%(fmt)],
+                row['%s_pack_us'%(fmt)],
+                row['%s_unpack_us'%(fmt)]))
+
+def main_pydata(lst_arg):
+    parser = argparse.ArgumentParser(prog='wandle.main pydata')
+    parser.add_argument('model_filename',
+        help='File containing the model.')
+    parser.add_argument('--out', default=None,
+        help='Write the module here. Default is stdout.')
+    parser.add_argument('--struct', dest='b_struct', action='store_true',
+        help='Classes with only primitive fields become struct records.')
+    parser.add_argument('--primitive', dest='lst_primitive', action='append',
+        metavar='CLASS=PYTYPE', default=None,
+        help='Python type that stands for a stub class. Repeat for more.')
+    parser.add_argument('--code', dest='lst_code', action='append',
+        metavar='CLASS=CODE', default=None,
+        help='struct format code for a primitive class. Repeat for more.')
+    ns_args = parser.parse_args(lst_arg)
+
+    wandle_model = load_model(
+        model_filename=ns_args.model_filename)
+    d_primitive = parse_name_value(ns_args.lst_primitive, str, 'primitive')
+    d_struct_code = parse_name_value(ns_args.lst_code, str, 'code')
+    for (name, code) in d_struct_code.items():
+        if name == None:
+            raise Exception("Invalid code %s, give it as CLASS=CODE"%(code))
+        d_primitive.setdefault(name, 'int')
+    if ns_args.out == None:
+        f_out = sys.stdout
+    else:
+        f_out = open(ns_args.out, 'w')
+    pydata_write(
+        f_out=f_out,
+        wandle_model=wandle_model,
+        b_struct=ns_args.b_struct,
+        d_primitive=d_primitive,
+        d_struct_code=d_struct_code)
+    if ns_args.out != None:
+        f_out.close()
+
+def main_pygen(lst_arg):
+    parser = argparse.ArgumentParser(prog='wandle.main pygen')
+    parser.add_argument('model_filename',
+        help='File containing the model.')
+    parser.add_argument('out_dir',
+        help='Directory to write the Python package into.')
+    ns_args = parser.parse_args(lst_arg)
+
+    wandle_model = load_model(
+        model_filename=ns_args.model_filename)
+    for path in pygen_write_all(
+            wandle_model=wandle_model,
+            out_dir=ns_args.out_dir):
+        print(path)
+
+def main_seqdiag(lst_arg):
+    parser = argparse.ArgumentParser(prog='wandle.main seqdiag')
+    parser.add_argument('model_filename',
+        help='File containing the model.')
+    parser.add_argument('--flow', dest='lst_flow', action='append',
+        metavar='FLOW', default=None,
+        help='Flows to draw. Repeat for more. Default is all flows.')
+    parser.add_argument('--format', dest='fmt', default=FMT_PLANTUML,
+        choices=sorted(D_FMT_SUFFIX.keys()),
+        help='Diagram syntax.')
+    parser.add_argument('--depth', type=int, default=1,
+        help='How many levels of method bodies to expand.')
+    parser.add_argument('--out', default=None,
+        help='Write one file per flow into this directory. Default is stdout.')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+        help='Number of worker processes, with --out.')
+    ns_args = parser.parse_args(lst_arg)
+
+    if ns_args.out != None:
+        check_model_filename(ns_args.model_filename)
+        lst_path = seqdiag_write_all(
+            model_filename=ns_args.model_filename,
+            out_dir=ns_args.out,
+            fmt=ns_args.fmt,
+            max_depth=ns_args.depth,
+            lst_flow_name=ns_args.lst_flow,
+            jobs=ns_args.jobs)
+        for path in lst_path:
+            print(path)
+        return
+
+    wandle_model = load_model(
+        model_filename=ns_args.model_filename)
+    lst_flow = ns_args.lst_flow
+    if lst_flow == None:
+        lst_flow = list(wandle_model.d_flow.keys())
+    for (idx, flow_name) in enumerate(lst_flow):
+        if idx > 0:
+            sys.stdout.write('\n')
+        seqdiag_write(
+            f_out=sys.stdout,
+            wandle_model=wandle_model,
+            flow_name=flow_name,
+            fmt=ns_args.fmt,
+            max_depth=ns_args.depth)
+
+# Sub-commands. Anything else on the command line is treated as a model to
+# validate.
+D_COMMAND = {
+    'codec': main_codec,
+    'conform': main_conform,
+    'contention': main_contention,
+    'diff': main_diff,
+    'export': main_export,
+    'fmt': main_fmt,
+    'graph': main_graph,
+    'harness': main_harness,
+    'index': main_index,
+    'ingest': main_ingest,
+    'latency': main_latency,
+    'lint': main_lint,
+    'load': main_load,
+    'montecarlo': main_montecarlo,
+    'pydata': main_pydata,
+    'pygen': main_pygen,
+    'query': main_query,
+    'run': main_run,
+    'seqdiag': main_seqdiag,
+    'simulate': main_simulate,
+}
+
+def main():
+    lst_arg = sys.argv[1:]
+    if lst_arg and lst_arg[0] in D_COMMAND:
+        D_COMMAND[lst_arg[0]](lst_arg[1:])
+    else:
+        main_validate(lst_arg)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,153 @@
+#
+# Asyncio entry points, for embedding wandle in services that run on an
+# event loop.
+#
+# Parsing and model building are blocking calls. Here we run them in an
+# executor, one pass at a time, so that the event loop stays responsive and
+# a build can be cancelled in between passes. Diagnostics are collected on
+# the result rather than printed.
+#
+
+from .arpeggio_parse import arpeggio_parse_go
+from .arpeggio_parse import arpeggio_pos_to_linecol
+from .wandle_model import BuildError
+from .wandle_model import Diagnostic
+from .wandle_model import SEVERITY_ERROR
+from .wandle_model import WandleModel
+from .wandle_model import wandle_model_build_passes
+
+import arpeggio
+import asyncio
+
+
+class BuildResult:
+
+    def __init__(self, wandle_src):
+        self.wandle_src = wandle_src
+
+        self.wandle_model = None
+        self.b_valid = False
+        # List<str>. The passes that completed, in order.
+        self.lst_pass_name = []
+        # List<Diagnostic>
+        self.lst_diagnostic = []
+
+    def __repr__(self):
+        return '<BuildResult valid:%s diagnostics:%s>'%(
+            self.b_valid, len(self.lst_diagnostic))
+
+    def get_linecol(self, diagnostic):
+        if diagnostic.position == None:
+            return None
+        return arpeggio_pos_to_linecol(
+            wandle_src=self.wandle_src,
+            position=diagnostic.position)
+
+    def lst_error(self):
+        return [d for d in self.lst_diagnostic if d.severity == SEVERITY_ERROR]
+
+
+class AsyncBuilder:
+    '''
+    Runs parses and builds off the event loop.
+
+    executor is passed to loop.run_in_executor, so None means the loop's
+    default thread pool. The passes of one build share a model, so this
+    should be a thread-based executor.
+
+    max_concurrent caps how many builds run at once through this builder.
+    Further callers wait their turn.
+    '''
+
+    def __init__(self, executor=None, max_concurrent=4, b_lazy=False,
+            b_freeze=False):
+        self.executor = executor
+        self.b_lazy = b_lazy
+        self.b_freeze = b_freeze
+
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+
+    async def parse(self, wandle_src):
+        async with self.semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self.executor, arpeggio_parse_go, wandle_src)
+
+    async def build(self, wandle_src):
+        '''
+        Parses and builds the model. Returns a BuildResult. Errors in the
+        source are reported as diagnostics on the result, and do not raise.
+
+        If the task is cancelled, the pass that is currently running in the
+        executor finishes, and no further passes are started.
+        '''
+        async with self.semaphore:
+            return await self.__build(wandle_src)
+
+    async def __build(self, wandle_src):
+        loop = asyncio.get_running_loop()
+        result = BuildResult(
+            wandle_src=wandle_src)
+
+        try:
+            parse_tree = await loop.run_in_executor(
+                self.executor, arpeggio_parse_go, wandle_src)
+        except arpeggio.NoMatch as e:
+            result.lst_diagnostic.append(Diagnostic(
+                severity=SEVERITY_ERROR,
+                message=str(e),
+                position=e.position))
+            return result
+        result.lst_pass_name.append('parse')
+
+        wandle_model = WandleModel(
+            b_print_diagnostic=False)
+        result.wandle_model = wandle_model
+        gen = wandle_model_build_passes(
+            parse_tree=parse_tree,
+            b_lazy=self.b_lazy,
+            wandle_model=wandle_model)
+        try:
+            while True:
+                step = await loop.run_in_executor(
+                    self.executor, next, gen, None)
+                if step == None:
+                    break
+                (pass_name, _) = step
+                result.lst_pass_name.append(pass_name)
+
+            if self.b_freeze:
+                await loop.run_in_executor(
+                    self.executor, wandle_model.freeze)
+                result.lst_pass_name.append('freeze')
+        except asyncio.CancelledError:
+            raise
+        except BuildError as e:
+            result.lst_diagnostic.extend(wandle_model.lst_diagnostic)
+            result.lst_diagnostic.append(Diagnostic(
+                severity=SEVERITY_ERROR,
+                message=e.message,
+                position=e.position))
+            return result
+        except Exception as e:
+            result.lst_diagnostic.extend(wandle_model.lst_diagnostic)
+            result.lst_diagnostic.append(Diagnostic(
+                severity=SEVERITY_ERROR,
+                message=str(e)))
+            return result
+
+        result.lst_diagnostic.extend(wandle_model.lst_diagnostic)
+        result.b_valid = True
+        return result
+
+
+async def wandle_model_build_async(wandle_src, executor=None, b_lazy=False):
+    '''
+    Convenience for a one-off build. Services that want to cap concurrent
+    builds should share one AsyncBuilder instead.
+    '''
+    builder = AsyncBuilder(
+        executor=executor,
+        max_concurrent=1,
+        b_lazy=b_lazy)
+    return await builder.build(wandle_src)
@@ -0,0 +1,125 @@
+#
+# Validates many model files in one invocation.
+#
+# Files are spread across a pool of worker processes. Each worker builds its
+# parser once, at startup, and reuses it for every file it is given. A
+# failure in one file is recorded against that file, and does not stop the
+# run.
+#
+
+from .arpeggio_parse import LineTable
+from .arpeggio_parse import arpeggio_parse_go
+from .arpeggio_parse import arpeggio_parser_get
+from .wandle_model import BuildError
+from .wandle_model import SEVERITY_ERROR
+from .wandle_model import WandleModel
+from .wandle_model import wandle_model_build_passes
+
+from concurrent.futures import ProcessPoolExecutor
+import arpeggio
+import glob
+import os
+import time
+
+
+STATUS_VALID = 'valid'
+STATUS_INVALID = 'invalid'
+STATUS_ERROR = 'error'
+
+
+def batch_find_files(dir_or_glob):
+    if os.path.isdir(dir_or_glob):
+        pattern = os.path.join(dir_or_glob, '**', '*.wandle')
+    else:
+        pattern = dir_or_glob
+    lst_path = [p for p in glob.glob(pattern, recursive=True)
+        if os.path.isfile(p)]
+    return sorted(lst_path)
+
+def batch_worker_init():
+    # Warm the parser, so that the first file does not pay for it.
+    arpeggio_parser_get()
+
+def batch_validate_one(path):
+    '''
+    Returns a dict that describes the outcome for one file. This never
+    raises for problems in the file itself.
+    '''
+    d = {
+        'path': path,
+        'status': None,
+        'lst_error': [],
+        'seconds_parse': None,
+        'seconds_build': None,
+    }
+
+    try:
+        f_ptr = open(path)
+        wandle_src = f_ptr.read()
+        f_ptr.close()
+    except Exception as e:
+        d['status'] = STATUS_ERROR
+        d['lst_error'].append(str(e))
+        return d
+
+    t_start = time.perf_counter()
+    try:
+        parse_tree = arpeggio_parse_go(wandle_src)
+    except arpeggio.NoMatch as e:
+        d['seconds_parse'] = time.perf_counter() - t_start
+        d['status'] = STATUS_INVALID
+        d['lst_error'].append(str(e))
+        return d
+    d['seconds_parse'] = time.perf_counter() - t_start
+
+    t_start = time.perf_counter()
+    wandle_model = WandleModel(
+        b_print_diagnostic=False)
+    try:
+        for (pass_name, _) in wandle_model_build_passes(
+                parse_tree=parse_tree,
+                wandle_model=wandle_model):
+            pass
+        wandle_model.check_budgets()
+        d['status'] = STATUS_VALID
+    except Exception as e:
+        for diagnostic in wandle_model.lst_diagnostic:
+            if diagnostic.severity == SEVERITY_ERROR:
+                d['lst_error'].append(diagnostic.message)
+        if isinstance(e, BuildError) and e.position != None:
+            (line, col) = LineTable(wandle_src).linecol(e.position)
+            d['lst_error'].append('%s:%s: %s'%(line, col, e.message))
+        else:
+            d['lst_error'].append(str(e))
+        d['status'] = STATUS_INVALID
+    d['seconds_build'] = time.perf_counter() - t_start
+
+    return d
+
+def batch_validate(lst_path, jobs):
+    '''
+    Returns a summary dict, suitable for json. Results are in the same order
+    as lst_path.
+    '''
+    t_start = time.perf_counter()
+    if jobs <= 1:
+        batch_worker_init()
+        lst_result = [batch_validate_one(path) for path in lst_path]
+    else:
+        with ProcessPoolExecutor(
+                max_workers=jobs,
+                initializer=batch_worker_init) as executor:
+            lst_result = list(executor.map(
+                batch_validate_one, lst_path, chunksize=4))
+
+    d_count = {}
+    for status in (STATUS_VALID, STATUS_INVALID, STATUS_ERROR):
+        d_count[status] = len(
+            [r for r in lst_result if r['status'] == status])
+
+    return {
+        'jobs': jobs,
+        'seconds': time.perf_counter() - t_start,
+        'count': d_count,
+        'files': lst_result,
+    }
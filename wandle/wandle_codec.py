@@ -0,0 +1,483 @@
+#
+# Generates fixed-layout binary codecs for the data classes of a model.
+#
+# The module holds the classes that pydata would write, and then a pack and
+# an unpack function for each class whose fields all have a known layout:
+#
+#     scalar  a stub class with a struct code, from its layout (class Int
+#             layout i64;) or the pydata defaults
+#     utf8    a string: u32 byte count, then the bytes
+#     list    an instantiation of a generic with layout list, or of List:
+#             u32 item count, then the items
+#     record  another class whose fields all have a known layout
+#
+# Records are written field by field in pydata order, little-endian, with
+# no padding. Nested records that are fixed size are written inline, and a
+# run of fixed-size fields is packed with one struct. Recursive classes have
+# no layout, as there is no way to write None.
+#
+# pack_X(out, obj) appends to a bytearray. unpack_X(buf, off) reads from any
+# buffer, and returns (obj, off after it). Unpacking works on a memoryview
+# of the input, so nothing is copied before it is decoded. Lists of fixed
+# records are read with iter_unpack over a slice of that view. dumps and
+# loads wrap these for a whole message.
+#
+# codec_bench builds a sample of each class, and times the codec against
+# pickle and json.
+#
+
+from .wandle_model import LAYOUT_LIST
+from .wandle_pydata import PyData
+from .wandle_pydata import flat_fields
+from .wandle_pygen import INDENT
+
+import json
+import pickle
+import struct
+import sys
+import time
+import types
+
+
+KIND_SCALAR = 'scalar'
+KIND_UTF8 = 'utf8'
+KIND_LIST = 'list'
+KIND_RECORD = 'record'
+
+# Generics taken as lists without declaring a layout.
+LST_LIST_GENERIC = ['List']
+
+# Struct code of length prefixes.
+LEN_CODE = 'I'
+
+# Items in each list of a bench sample.
+BENCH_LIST_LEN = 16
+
+BENCH_MODULE = 'wandle_codec_bench'
+
+
+class CodecGen(PyData):
+
+    def __init__(self, wandle_model, d_primitive=None, d_struct_code=None):
+        PyData.__init__(
+            self,
+            wandle_model=wandle_model,
+            b_struct=False,
+            d_primitive=d_primitive,
+            d_struct_code=d_struct_code)
+        self.set_list_generic = set()
+        for (gname, wandle_generic) in wandle_model.d_generic.items():
+            if wandle_generic.layout == LAYOUT_LIST:
+                self.set_list_generic.add(gname)
+            elif gname in LST_LIST_GENERIC:
+                if len(wandle_generic.lst_template_type) == 1:
+                    self.set_list_generic.add(gname)
+
+        # cstring vs list of (name, tstring), for classes with a layout.
+        self.d_record = {}
+        # cstring vs bool
+        self.d_fixed = {}
+
+    def resolve(self):
+        '''
+        Works out which classes have a layout. A class has one when all of
+        its fields do, so we go round until nothing changes.
+        '''
+        self.wandle_model.check_all()
+        d_field = {}
+        for cstring in self.class_names():
+            if self.list_item(cstring) != None:
+                continue
+            wandle_class = self.wandle_model.d_specific[cstring]
+            lst_field = self.field_types(
+                cstring,
+                flat_fields(self.wandle_model, wandle_class))
+            if lst_field:
+                d_field[cstring] = lst_field
+        b_change = True
+        while b_change:
+            b_change = False
+            for (cstring, lst_field) in d_field.items():
+                if cstring in self.d_record:
+                    continue
+                if all([self.kind(t) != None for (f, t) in lst_field]):
+                    self.d_record[cstring] = lst_field
+                    b_change = True
+
+    def list_item(self, tstring):
+        if '/' not in tstring:
+            return None
+        (gname, s_args) = tstring.split('/', 1)
+        if gname not in self.set_list_generic:
+            return None
+        return s_args
+
+    def kind(self, tstring):
+        '''
+        (kind, detail) for values of tstring, or None if it has no layout.
+        detail is the struct code for a scalar, and the item type for a
+        list.
+        '''
+        if tstring in self.d_struct_code:
+            return (KIND_SCALAR, self.d_struct_code[tstring])
+        if self.d_primitive.get(tstring) == 'str':
+            return (KIND_UTF8, None)
+        item = self.list_item(tstring)
+        if item != None:
+            if self.kind(item) == None:
+                return None
+            return (KIND_LIST, item)
+        if tstring in self.d_record:
+            return (KIND_RECORD, tstring)
+        return None
+
+    def is_fixed(self, tstring):
+        (kind, detail) = self.kind(tstring)
+        if kind == KIND_SCALAR:
+            return True
+        if kind != KIND_RECORD:
+            return False
+        if tstring not in self.d_fixed:
+            self.d_fixed[tstring] = all([
+                self.is_fixed(t) for (f, t) in self.d_record[tstring]])
+        return self.d_fixed[tstring]
+
+    def leaves(self, tstring, expr):
+        '''
+        List of (expression, struct code) for a fixed-size value.
+        '''
+        (kind, detail) = self.kind(tstring)
+        if kind == KIND_SCALAR:
+            return [(expr, detail)]
+        lst = []
+        for (f, t) in self.d_record[tstring]:
+            lst.extend(self.leaves(t, '%s.%s'%(expr, f)))
+        return lst
+
+    def ctor(self, tstring, fn_next):
+        '''
+        Expression that builds a fixed-size value. fn_next gives the
+        expression for each leaf in turn.
+        '''
+        (kind, detail) = self.kind(tstring)
+        if kind == KIND_SCALAR:
+            return fn_next()
+        return '%s(%s)'%(self.d_name[tstring], ', '.join([
+            self.ctor(t, fn_next) for (f, t) in self.d_record[tstring]]))
+
+    # --------------------------------------------------------
+    #   generated code
+    # --------------------------------------------------------
+    def call(self, depth, head, lst_arg, tail):
+        line = '%s%s%s'%(head, ', '.join(lst_arg), tail)
+        if len(INDENT * depth + line) < 80:
+            self.add(depth, line)
+            return
+        self.add(depth, head)
+        for arg in lst_arg[:-1]:
+            self.add(depth + 2, arg + ',')
+        self.add(depth + 2, lst_arg[-1] + tail)
+
+    def helpers(self):
+        s_len = self.code_struct(LEN_CODE)
+        for line in [
+                'def _pack_utf8(out, s):',
+                "    b = s.encode('utf-8')",
+                '    out += %s.pack(len(b))'%(s_len),
+                '    out += b',
+                '',
+                'def _unpack_utf8(buf, off):',
+                '    (n,) = %s.unpack_from(buf, off)'%(s_len),
+                '    off += %s.size'%(s_len),
+                "    return (str(buf[off:off + n], 'utf-8'), off + n)",
+                '',
+                'def _pack_scalars(out, code, lst):',
+                '    out += %s.pack(len(lst))'%(s_len),
+                "    out += struct.pack('<%d%s'%(len(lst), code), *lst)",
+                '',
+                'def _unpack_scalars(buf, off, code):',
+                '    (n,) = %s.unpack_from(buf, off)'%(s_len),
+                '    off += %s.size'%(s_len),
+                "    fmt = '<%d%s'%(n, code)",
+                '    lst = list(struct.unpack_from(fmt, buf, off))',
+                '    return (lst, off + struct.calcsize(fmt))',
+                '',
+                '']:
+            self.add(0, line)
+
+    def pack_function(self, cstring):
+        name = self.d_name[cstring]
+        s_len = self.code_struct(LEN_CODE)
+        self.add(0, 'def pack_%s(out, obj):'%(name))
+        lst_run = []
+        def flush():
+            if not lst_run:
+                return
+            s_struct = self.code_struct(''.join([c for (e, c) in lst_run]))
+            self.call(1, 'out += %s.pack('%(s_struct),
+                [e for (e, c) in lst_run], ')')
+            del lst_run[:]
+        for (f, t) in self.d_record[cstring]:
+            expr = 'obj.%s'%(f)
+            if self.is_fixed(t):
+                lst_run.extend(self.leaves(t, expr))
+                continue
+            flush()
+            (kind, detail) = self.kind(t)
+            if kind == KIND_UTF8:
+                self.add(1, '_pack_utf8(out, %s)'%(expr))
+            elif kind == KIND_RECORD:
+                self.add(1, 'pack_%s(out, %s)'%(self.d_name[t], expr))
+            elif self.kind(detail)[0] == KIND_SCALAR:
+                self.add(1, "_pack_scalars(out, '%s', %s)"%(
+                    self.kind(detail)[1], expr))
+            else:
+                self.add(1, 'out += %s.pack(len(%s))'%(s_len, expr))
+                self.add(1, 'for item in %s:'%(expr))
+                self.pack_item(2, detail, 'item')
+        flush()
+        self.add(0, '')
+
+    def pack_item(self, depth, tstring, expr):
+        (kind, detail) = self.kind(tstring)
+        if self.is_fixed(tstring):
+            lst_leaf = self.leaves(tstring, expr)
+            s_struct = self.code_struct(''.join([c for (e, c) in lst_leaf]))
+            self.call(depth, 'out += %s.pack('%(s_struct),
+                [e for (e, c) in lst_leaf], ')')
+        elif kind == KIND_UTF8:
+            self.add(depth, '_pack_utf8(out, %s)'%(expr))
+        else:
+            self.add(depth, 'pack_%s(out, %s)'%(self.d_name[tstring], expr))
+
+    def unpack_function(self, cstring):
+        name = self.d_name[cstring]
+        s_len = self.code_struct(LEN_CODE)
+        self.add(0, 'def unpack_%s(buf, off):'%(name))
+        lst_var = []
+        lst_run = []
+        def new_var():
+            var = 'v%s'%(len(lst_var))
+            lst_var.append(var)
+            return var
+        def flush():
+            if not lst_run:
+                return
+            lst_code = [c for (e, c) in lst_run]
+            s_struct = self.code_struct(''.join(lst_code))
+            lst = [v for (v, c) in lst_run]
+            if len(lst) == 1:
+                s_lhs = '(%s,)'%(lst[0])
+            else:
+                s_lhs = '(%s)'%(', '.join(lst))
+            self.add(1, '%s = %s.unpack_from(buf, off)'%(s_lhs, s_struct))
+            self.add(1, 'off += %s'%(struct.calcsize('<' + ''.join(lst_code))))
+            del lst_run[:]
+        lst_expr = []
+        for (f, t) in self.d_record[cstring]:
+            if self.is_fixed(t):
+                lst_leaf = self.leaves(t, '')
+                lst_leaf_var = []
+                for (e, c) in lst_leaf:
+                    var = new_var()
+                    lst_leaf_var.append(var)
+                    lst_run.append((var, c))
+                it = iter(lst_leaf_var)
+                lst_expr.append(self.ctor(t, lambda: next(it)))
+                continue
+            flush()
+            var = new_var()
+            lst_expr.append(var)
+            (kind, detail) = self.kind(t)
+            if kind == KIND_UTF8:
+                self.add(1, '(%s, off) = _unpack_utf8(buf, off)'%(var))
+            elif kind == KIND_RECORD:
+                self.add(1, '(%s, off) = unpack_%s(buf, off)'%(
+                    var, self.d_name[t]))
+            elif self.kind(detail)[0] == KIND_SCALAR:
+                self.add(1, "(%s, off) = _unpack_scalars(buf, off, '%s')"%(
+                    var, self.kind(detail)[1]))
+            elif self.is_fixed(detail):
+                lst_leaf = self.leaves(detail, '')
+                s_code = ''.join([c for (e, c) in lst_leaf])
+                s_struct = self.code_struct(s_code)
+                it = iter(['t[%s]'%(i) for i in range(len(lst_leaf))])
+                self.add(1, '(n,) = %s.unpack_from(buf, off)'%(s_len))
+                self.add(1, 'off += %s.size'%(s_len))
+                self.add(1, 'end = off + n * %s'%(
+                    struct.calcsize('<' + s_code)))
+                if len(lst_leaf) == len(self.d_record[detail]):
+                    # Flat, so each tuple is the constructor's arguments.
+                    self.set_import.add('itertools')
+                    self.add(1, '%s = list(itertools.starmap('%(var))
+                    self.add(2, self.d_name[detail] + ',')
+                    self.add(2, '%s.iter_unpack(buf[off:end])))'%(s_struct))
+                else:
+                    self.add(1, '%s = ['%(var))
+                    self.add(2, self.ctor(detail, lambda: next(it)))
+                    self.add(2, 'for t in %s.iter_unpack(buf[off:end])]'%(
+                        s_struct))
+                self.add(1, 'off = end')
+            else:
+                self.add(1, '(n,) = %s.unpack_from(buf, off)'%(s_len))
+                self.add(1, 'off += %s.size'%(s_len))
+                self.add(1, '%s = []'%(var))
+                self.add(1, 'for i in range(n):')
+                if self.kind(detail)[0] == KIND_UTF8:
+                    self.add(2, '(item, off) = _unpack_utf8(buf, off)')
+                else:
+                    self.add(2, '(item, off) = unpack_%s(buf, off)'%(
+                        self.d_name[detail]))
+                self.add(2, '%s.append(item)'%(var))
+        flush()
+        self.call(1, 'return (%s('%(name), lst_expr, '), off)')
+        self.add(0, '')
+
+    def generate(self):
+        PyData.generate(self)
+        self.resolve()
+        self.helpers()
+        for cstring in self.d_record.keys():
+            self.pack_function(cstring)
+            self.unpack_function(cstring)
+        self.add(0, '')
+        self.add(0, 'D_PACK = {')
+        for cstring in self.d_record.keys():
+            self.add(1, '%s: pack_%s,'%(
+                self.d_name[cstring], self.d_name[cstring]))
+        self.add(0, '}')
+        self.add(0, '')
+        self.add(0, 'D_UNPACK = {')
+        for cstring in self.d_record.keys():
+            self.add(1, '%s: unpack_%s,'%(
+                self.d_name[cstring], self.d_name[cstring]))
+        self.add(0, '}')
+        self.add(0, '')
+        for line in [
+                'def dumps(obj):',
+                '    out = bytearray()',
+                '    D_PACK[type(obj)](out, obj)',
+                '    return out',
+                '',
+                'def loads(cls, data):',
+                '    (obj, off) = D_UNPACK[cls](memoryview(data), 0)',
+                '    return obj']:
+            self.add(0, line)
+
+
+def codec_write(f_out, wandle_model, d_primitive=None, d_struct_code=None):
+    codec_gen = CodecGen(
+        wandle_model=wandle_model,
+        d_primitive=d_primitive,
+        d_struct_code=d_struct_code)
+    for line in codec_gen.lines():
+        f_out.write(line + '\n')
+
+
+# --------------------------------------------------------
+#   bench
+# --------------------------------------------------------
+D_SAMPLE_SCALAR = {
+    '?': True,
+    'd': 1.5,
+    'f': 1.5,
+}
+
+def _sample(codec_gen, module, tstring):
+    (kind, detail) = codec_gen.kind(tstring)
+    if kind == KIND_SCALAR:
+        return D_SAMPLE_SCALAR.get(detail, 7)
+    if kind == KIND_UTF8:
+        return 'wandle'
+    if kind == KIND_LIST:
+        return [
+            _sample(codec_gen, module, detail)
+            for i in range(BENCH_LIST_LEN)]
+    cls = getattr(module, codec_gen.d_name[tstring])
+    return cls(**dict([
+        (f, _sample(codec_gen, module, t))
+        for (f, t) in codec_gen.d_record[tstring]]))
+
+def _to_plain(codec_gen, tstring, value):
+    (kind, detail) = codec_gen.kind(tstring)
+    if kind == KIND_LIST:
+        return [_to_plain(codec_gen, detail, v) for v in value]
+    if kind == KIND_RECORD:
+        return dict([
+            (f, _to_plain(codec_gen, t, getattr(value, f)))
+            for (f, t) in codec_gen.d_record[tstring]])
+    return value
+
+def _from_plain(codec_gen, module, tstring, value):
+    (kind, detail) = codec_gen.kind(tstring)
+    if kind == KIND_LIST:
+        return [_from_plain(codec_gen, module, detail, v) for v in value]
+    if kind == KIND_RECORD:
+        cls = getattr(module, codec_gen.d_name[tstring])
+        return cls(**dict([
+            (f, _from_plain(codec_gen, module, t, value[f]))
+            for (f, t) in codec_gen.d_record[tstring]]))
+    return value
+
+def _time_us(fn, n):
+    t_start = time.perf_counter()
+    for i in range(n):
+        fn()
+    return (time.perf_counter() - t_start) * 1e6 / n
+
+def codec_bench(wandle_model, n=10000, lst_cstring=None, d_primitive=None,
+        d_struct_code=None):
+    '''
+    Times the generated codec against pickle and json, on a sample of each
+    class in lst_cstring, or of every class with a layout. json goes
+    through dicts, and is turned back into objects. Returns a list of dict,
+    one per class, with sizes in bytes and times in microseconds.
+    '''
+    codec_gen = CodecGen(
+        wandle_model=wandle_model,
+        d_primitive=d_primitive,
+        d_struct_code=d_struct_code)
+    src = '\n'.join(codec_gen.lines()) + '\n'
+    module = types.ModuleType(BENCH_MODULE)
+    exec(compile(src, '<wandle codec>', 'exec'), module.__dict__)
+
+    if lst_cstring == None:
+        lst_cstring = list(codec_gen.d_record.keys())
+    # pickle finds classes by module name.
+    sys.modules[BENCH_MODULE] = module
+    try:
+        return [
+            _bench_class(codec_gen, module, cstring, n)
+            for cstring in lst_cstring]
+    finally:
+        del sys.modules[BENCH_MODULE]
+
+def _bench_class(codec_gen, module, cstring, n):
+    if cstring not in codec_gen.d_record:
+        raise Exception("Class %s has no layout."%(cstring))
+    cls = getattr(module, codec_gen.d_name[cstring])
+    obj = _sample(codec_gen, module, cstring)
+
+    data_codec = module.dumps(obj)
+    if module.loads(cls, data_codec) != obj:
+        raise Exception("Codec round trip failed for %s."%(cstring))
+    data_pickle = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+    data_json = json.dumps(_to_plain(codec_gen, cstring, obj))
+
+    return {
+        'class': cstring,
+        'codec_bytes': len(data_codec),
+        'pickle_bytes': len(data_pickle),
+        'json_bytes': len(data_json),
+        'codec_pack_us': _time_us(lambda: module.dumps(obj), n),
+        'codec_unpack_us': _time_us(
+            lambda: module.loads(cls, data_codec), n),
+        'pickle_pack_us': _time_us(
+            lambda: pickle.dumps(obj, pickle.HIGHEST_PROTOCOL), n),
+        'pickle_unpack_us': _time_us(lambda: pickle.loads(data_pickle), n),
+        'json_pack_us': _time_us(
+            lambda: json.dumps(_to_plain(codec_gen, cstring, obj)), n),
+        'json_unpack_us': _time_us(
+            lambda: _from_plain(
+                codec_gen, module, cstring, json.loads(data_json)), n),
+    }
@@ -0,0 +1,323 @@
+#
+# Checks the call sequences of the running system against the flows.
+#
+# The input is OpenTelemetry spans as JSON lines, plain or gzipped. A line
+# is either one span, or an ExportTraceServiceRequest as written by the
+# OTLP file exporter. We read a line at a time.
+#
+# Spans are grouped by trace id, one trace per request. Spans of different
+# traces arrive mixed together, so we hold a trace open until window more
+# spans have gone by without one for it, and then check it and drop it.
+# At most max_open traces are held at once; past that, the one seen least
+# recently is checked early. So memory depends on the window, and not on
+# the size of the log.
+#
+# Span names map to flows and methods as in wandle_trace. Spans that do
+# not map are transparent: their children count as children of the
+# nearest span above them that does. For each span of a flow or of a
+# method with a body, the calls below it, in order of start time, are
+# lined up against the calls in the body (difflib), and we report
+#
+#   extra       a call the body does not make
+#   missing     a call the body makes, that did not happen
+#   blocking    an async send (<<) that the caller waited for
+#   detached    a sync call that the caller did not wait for
+#
+# A caller waited for a call if the call ended before the next call
+# started, or for the last call, before the caller ended.
+#
+# Findings are totalled by function, kind and callee, with a trace id as
+# an example of each.
+#
+
+from .wandle_model import STYPE_ASYNC_LHS_RHS
+from .wandle_trace import ATTR_METHOD
+from .wandle_trace import SpanMapper
+from .wandle_trace import trace_open
+
+import collections
+import difflib
+import json
+
+
+FIND_EXTRA = 'extra'
+FIND_MISSING = 'missing'
+FIND_BLOCKING = 'blocking'
+FIND_DETACHED = 'detached'
+
+WINDOW_SPANS = 10000
+MAX_OPEN_TRACES = 10000
+
+
+def iter_spans(f_ptr):
+    '''
+    Yields the OpenTelemetry spans in a JSON lines file.
+    '''
+    for line in f_ptr:
+        line = line.strip()
+        if not line:
+            continue
+        d = json.loads(line)
+        if 'resourceSpans' not in d:
+            yield d
+            continue
+        for d_resource in d['resourceSpans']:
+            for d_scope in d_resource.get('scopeSpans', []):
+                for d_span in d_scope.get('spans', []):
+                    yield d_span
+
+
+class Span:
+
+    __slots__ = ('span_id', 'parent_id', 'qname', 'start_ns', 'end_ns')
+
+    def __init__(self, span_id, parent_id, qname, start_ns, end_ns):
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.qname = qname
+        self.start_ns = start_ns
+        self.end_ns = end_ns
+
+
+class OpenTrace:
+
+    def __init__(self):
+        self.lst_span = []
+        self.last_seen = 0
+
+
+class Conform:
+
+    def __init__(self, wandle_model, d_map=None, window=WINDOW_SPANS,
+            max_open=MAX_OPEN_TRACES):
+        self.wandle_model = wandle_model
+        self.window = window
+        self.max_open = max_open
+
+        # qualified name vs WandleFunction
+        self.d_function = wandle_model.get_functions()
+        self.span_mapper = SpanMapper(
+            set_qname=set(self.d_function.keys()),
+            d_map=d_map)
+        # qualified name vs list of (callee qualified name, b_async)
+        self.d_declared = {}
+
+        # trace id vs OpenTrace, least recently seen first.
+        self.d_open = collections.OrderedDict()
+        self.count_span = 0
+        self.count_trace = 0
+        self.count_early = 0
+        self.count_conformant = 0
+        self.count_unmatched = 0
+
+        # flow name vs traces
+        self.d_flow = {}
+        # qualified name vs spans checked
+        self.d_checked = {}
+        # (qualified name, kind, callee) vs [count, example trace id]
+        self.d_finding = {}
+
+    def declared(self, qname):
+        if qname not in self.d_declared:
+            lst = []
+            for statement in self.d_function[qname].lst_statement:
+                callee = statement.wandle_function
+                if callee == None:
+                    continue
+                lst.append((
+                    callee.get_qualified_name(),
+                    statement.stype == STYPE_ASYNC_LHS_RHS))
+            self.d_declared[qname] = lst
+        return self.d_declared[qname]
+
+    # --------------------------------------------------------
+    #   streaming
+    # --------------------------------------------------------
+    def add_span(self, d):
+        self.count_span += 1
+        trace_id = d.get('traceId', '')
+        qname = None
+        for d_attr in d.get('attributes', []):
+            if d_attr.get('key') == ATTR_METHOD:
+                qname = self.span_mapper.qname(
+                    d_attr.get('value', {}).get('stringValue', ''))
+        if qname == None:
+            qname = self.span_mapper.qname(d.get('name', ''))
+        span = Span(
+            span_id=d.get('spanId'),
+            parent_id=d.get('parentSpanId') or None,
+            qname=qname,
+            start_ns=int(d['startTimeUnixNano']),
+            end_ns=int(d['endTimeUnixNano']))
+
+        open_trace = self.d_open.get(trace_id)
+        if open_trace == None:
+            open_trace = OpenTrace()
+            self.d_open[trace_id] = open_trace
+        else:
+            self.d_open.move_to_end(trace_id)
+        open_trace.lst_span.append(span)
+        open_trace.last_seen = self.count_span
+
+        while self.d_open:
+            (oldest_id, oldest) = next(iter(self.d_open.items()))
+            if len(self.d_open) > self.max_open:
+                self.count_early += 1
+            elif oldest.last_seen > self.count_span - self.window:
+                break
+            del self.d_open[oldest_id]
+            self.check_trace(oldest_id, oldest.lst_span)
+
+    def finish(self):
+        while self.d_open:
+            (trace_id, open_trace) = self.d_open.popitem(last=False)
+            self.check_trace(trace_id, open_trace.lst_span)
+
+    # --------------------------------------------------------
+    #   checking
+    # --------------------------------------------------------
+    def __calls(self, span, d_children):
+        '''
+        The mapped spans below span, looking through unmapped ones, in
+        order of start time.
+        '''
+        lst = []
+        lst_todo = list(d_children.get(span.span_id, []))
+        while lst_todo:
+            child = lst_todo.pop()
+            if child.qname != None:
+                lst.append(child)
+            else:
+                lst_todo.extend(d_children.get(child.span_id, []))
+        lst.sort(key=lambda s: (s.start_ns, s.end_ns))
+        return lst
+
+    def __find(self, qname, kind, callee, trace_id):
+        key = (qname, kind, callee)
+        if key not in self.d_finding:
+            self.d_finding[key] = [0, trace_id]
+        self.d_finding[key][0] += 1
+
+    def check_span(self, span, lst_call, trace_id):
+        '''
+        Lines the calls under span up against the body of its function.
+        Returns the number of findings.
+        '''
+        qname = span.qname
+        self.d_checked[qname] = self.d_checked.get(qname, 0) + 1
+        lst_declared = self.declared(qname)
+        lst_observed = [c.qname for c in lst_call]
+        matcher = difflib.SequenceMatcher(
+            None, [name for (name, b_async) in lst_declared], lst_observed,
+            autojunk=False)
+        count = 0
+        for (op, i1, i2, j1, j2) in matcher.get_opcodes():
+            if op == 'equal':
+                for (i, j) in zip(range(i1, i2), range(j1, j2)):
+                    call = lst_call[j]
+                    if j + 1 < len(lst_call):
+                        next_ns = lst_call[j + 1].start_ns
+                    else:
+                        next_ns = span.end_ns
+                    b_waited = call.end_ns <= next_ns
+                    b_async = lst_declared[i][1]
+                    if b_async and b_waited:
+                        self.__find(qname, FIND_BLOCKING, call.qname, trace_id)
+                        count += 1
+                    elif not b_async and not b_waited:
+                        self.__find(qname, FIND_DETACHED, call.qname, trace_id)
+                        count += 1
+                continue
+            for (name, b_async) in lst_declared[i1:i2]:
+                self.__find(qname, FIND_MISSING, name, trace_id)
+                count += 1
+            for name in lst_observed[j1:j2]:
+                self.__find(qname, FIND_EXTRA, name, trace_id)
+                count += 1
+        return count
+
+    def check_trace(self, trace_id, lst_span):
+        self.count_trace += 1
+        d_span = {}
+        for span in lst_span:
+            d_span[span.span_id] = span
+        d_children = {}
+        lst_root = []
+        for span in lst_span:
+            if span.parent_id in d_span:
+                d_children.setdefault(span.parent_id, []).append(span)
+            else:
+                lst_root.append(span)
+
+        # Top-level mapped spans, under the roots.
+        lst_top = []
+        for span in lst_root:
+            if span.qname != None:
+                lst_top.append(span)
+            else:
+                lst_top.extend(self.__calls(span, d_children))
+        if not lst_top:
+            self.count_unmatched += 1
+            return
+        for span in lst_top:
+            if span.qname in self.wandle_model.d_flow:
+                self.d_flow[span.qname] = self.d_flow.get(span.qname, 0) + 1
+
+        count = 0
+        for span in lst_span:
+            if span.qname == None:
+                continue
+            if not self.d_function[span.qname].has_body():
+                continue
+            count += self.check_span(
+                span=span,
+                lst_call=self.__calls(span, d_children),
+                trace_id=trace_id)
+        if count == 0:
+            self.count_conformant += 1
+
+    def report(self):
+        lst_finding = []
+        for ((qname, kind, callee), (count, example)) in self.d_finding.items():
+            lst_finding.append({
+                'function': qname,
+                'kind': kind,
+                'call': callee,
+                'count': count,
+                'checked': self.d_checked[qname],
+                'example_trace': example,
+            })
+        lst_finding.sort(key=lambda d: (-d['count'], d['function'],
+            d['kind'], d['call']))
+        return {
+            'spans': self.count_span,
+            'traces': self.count_trace,
+            'conformant': self.count_conformant,
+            'unmatched': self.count_unmatched,
+            'checked_early': self.count_early,
+            'flows': dict(sorted(self.d_flow.items())),
+            'findings': lst_finding,
+        }
+
+
+def conform_run(wandle_model, lst_path, d_map=None, window=WINDOW_SPANS,
+        max_open=MAX_OPEN_TRACES):
+    '''
+    Checks the traces in the span logs at lst_path against the model, and
+    returns a report of where they differ.
+    '''
+    wandle_model.check_all()
+    conform = Conform(
+        wandle_model=wandle_model,
+        d_map=d_map,
+        window=window,
+        max_open=max_open)
+    for path in lst_path:
+        f_ptr = trace_open(path)
+        try:
+            for d in iter_spans(f_ptr):
+                conform.add_span(d)
+        finally:
+            f_ptr.close()
+    conform.finish()
+    return conform.report()
@@ -0,0 +1,631 @@
+#
+# Shared state, and where it needs a lock or an actor.
+#
+# We walk every flow, following sync calls into their bodies and starting
+# a new path at each async send. A path is one thread of control: the
+# flow's own body, or the work behind a send, named by the chain of sends
+# that started it (read << Audit.log). Along the way we note each read and
+# write of state, by location.
+#
+# A location is a dotted path from where an object lives:
+#   - Db, Db.cache    a single, and its fields. Shared by every run.
+#   - read:org, read:org.person_map
+#                     an object held by a variable of a flow or method,
+#                     and its fields. Each run has its own. Where one
+#                     function is entered more than once in a run, its
+#                     variables get #2, #3 and so on.
+# A variable that is copied from another location is an alias of it, and
+# so is a parameter of the argument it was given.
+#
+# What counts as an access:
+#   - An assignment writes its left-hand side, when that is a field, and
+#     reads its right-hand side.
+#   - A call to a method with no body writes its receiver if it returns
+#     Void, and reads it otherwise. So Map.put writes and Map.get reads.
+#   - A call to a method with a body is followed. Its own accesses are
+#     what count, with self at the receiver's location.
+#
+# A shared location that anything writes is contended, since runs of the
+# flows overlap. A location of a run is contended if two paths of the run
+# touch it, one of them writes, and neither access happens before the
+# other. The sender of an async send carries on at once, so its accesses
+# after the send, and everything else the send's path can overlap with,
+# count as concurrent. Accesses before the send do not.
+#
+# Locks. For each contended location, we look at the method calls that
+# enclose each access. If every access happens inside a call on the same
+# object (or on the location itself), a lock on that object, or making it
+# an actor, covers the location. We take the outermost such object, so
+# that locations reached only through one object's methods share its lock.
+# That gives the fewest locks that cover everything.
+#
+# Serialization. A lock is held for the return time (function_latency
+# ret_ms) of each outermost call on its object. The sum over one run of a
+# flow is the lock's hold time for that flow. 1000 / hold is the most runs
+# a second the lock lets through, and given rates, the sum of rate * hold
+# is its utilization. Past 1, the lock is the bottleneck. A lock on a
+# run's own object only holds up that run, so it has a hold time but no
+# ceiling. Read-only shared state needs no lock, and we list it so.
+#
+# A body that sends nothing, and calls nothing that does, stays on its
+# caller's path. We walk it once into a summary of what it does, with its
+# receiver and params as placeholders (Summary), and fill those in at each
+# call site, as function_latency does with its memo. Its own variables
+# never leave the path, so they cannot be contended, and the summary leaves
+# them out. Only bodies that send are walked at each call.
+#
+# Recursion is skipped, as in the static latency analysis.
+#
+
+from .wandle_model import STYPE_ASYNC_LHS_RHS
+from .wandle_model import STYPE_SYNC_LHS_RHS
+from .wandle_model import STYPE_SYNC_VAR_NUL
+from .wandle_model import STYPE_SYNC_VAR_VAL
+from .wandle_model import function_latency
+
+
+SCOPE_SHARED = 'shared'
+SCOPE_RUN = 'run'
+
+# Placeholders in a Summary, for the receiver and for param n.
+SELF_LOC = '$self'
+ARG_LOC = '$%s'
+
+
+def location_scope(location):
+    if ':' in location:
+        return SCOPE_RUN
+    return SCOPE_SHARED
+
+def location_covers(outer, location):
+    return location == outer or location.startswith(outer + '.')
+
+def location_subst(location, d_subst):
+    '''
+    Fills in the placeholder that location starts with, if any. Returns
+    None where the placeholder stands for nothing.
+    '''
+    if not location.startswith('$'):
+        return location
+    lst = location.split('.', 1)
+    base = d_subst.get(lst[0])
+    if base == None or len(lst) == 1:
+        return base
+    return '%s.%s'%(base, lst[1])
+
+def entry_add(entry, receiver):
+    if receiver == None or receiver in entry:
+        return entry
+    return entry + (receiver,)
+
+
+class Path:
+
+    def __init__(self, name, root, parent, spawn_seq):
+        self.name = name
+        # Name of the flow, or single method, that the run started from.
+        self.root = root
+        self.parent = parent
+        # seq in the parent at which this path was sent.
+        self.spawn_seq = spawn_seq
+        # Sends made from this path so far. An access is numbered with the
+        # count at the time, which is all that happens_before needs.
+        self.seq = 0
+
+    def next_seq(self):
+        self.seq += 1
+        return self.seq
+
+    def happens_before(self, seq, other):
+        '''
+        True if our access at seq comes before everything on path other.
+        '''
+        path = other
+        while path.parent != None:
+            if path.parent is self:
+                return seq < path.spawn_seq
+            path = path.parent
+        return False
+
+
+class Access:
+
+    def __init__(self, location, b_write, path, seq, entry, wandle_function,
+            statement):
+        self.location = location
+        self.b_write = b_write
+        self.path = path
+        self.seq = seq
+        # Receivers of the calls that enclose the access, outermost first.
+        self.entry = entry
+        self.wandle_function = wandle_function
+        self.statement = statement
+
+    def concurrent(self, other):
+        if self.path is other.path:
+            return False
+        if self.path.happens_before(self.seq, other.path):
+            return False
+        if other.path.happens_before(other.seq, self.path):
+            return False
+        return True
+
+    def guards(self):
+        '''
+        Objects whose lock would cover this access, outermost first.
+        '''
+        lst = [e for e in self.entry if location_covers(e, self.location)]
+        if self.location not in lst:
+            lst.append(self.location)
+        return lst
+
+
+class Summary:
+    '''
+    What a body that sends nothing does to state, with SELF_LOC and ARG_LOC
+    in place of its receiver and params.
+    '''
+
+    def __init__(self, low):
+        # (location, b_write, entry) vs (wandle_function, statement)
+        self.d_access = {}
+        # (receiver, entry) vs ms held
+        self.d_hold = {}
+        # Lowest index on the walk stack of a call left out as recursion.
+        self.low = low
+
+    def enter(self, qname):
+        return None
+
+    def cut(self, low):
+        self.low = min(self.low, low)
+
+    def access(self, location, b_write, entry, wandle_function, statement):
+        if location == None:
+            return
+        key = (location, b_write, entry)
+        if key not in self.d_access:
+            self.d_access[key] = (wandle_function, statement)
+
+    def hold(self, receiver, ms, entry):
+        if receiver == None or receiver in entry:
+            return
+        key = (receiver, entry)
+        self.d_hold[key] = self.d_hold.get(key, 0.0) + ms
+
+
+class PathSink:
+    '''
+    Takes the accesses of a walk along one path of a run.
+    '''
+
+    def __init__(self, contention, path, d_invocation):
+        self.contention = contention
+        self.path = path
+        # qualified name vs times entered in this run
+        self.d_invocation = d_invocation
+
+    def enter(self, qname):
+        self.d_invocation[qname] = self.d_invocation.get(qname, 0) + 1
+        if self.d_invocation[qname] > 1:
+            return '%s#%s'%(qname, self.d_invocation[qname])
+        return qname
+
+    def cut(self, low):
+        pass
+
+    def access(self, location, b_write, entry, wandle_function, statement):
+        self.contention.add_access(location, b_write, self.path, entry,
+            wandle_function, statement)
+
+    def hold(self, receiver, ms, entry):
+        if receiver == None or receiver in entry:
+            return
+        key = (self.path.root, receiver)
+        d_hold = self.contention.d_hold
+        d_hold[key] = d_hold.get(key, 0.0) + ms
+
+
+def summary_apply(summary, sink, receiver, lst_loc, entry):
+    '''
+    Plays summary into sink, for a call on receiver with arguments at
+    lst_loc, inside the calls in entry.
+    '''
+    d_subst = {SELF_LOC: receiver}
+    for (idx, location) in enumerate(lst_loc):
+        d_subst[ARG_LOC%(idx)] = location
+
+    def subst_entry(sub_entry):
+        result = entry
+        for location in sub_entry:
+            result = entry_add(result, location_subst(location, d_subst))
+        return result
+
+    for ((location, b_write, sub_entry), (wandle_function, statement)) in \
+            summary.d_access.items():
+        location = location_subst(location, d_subst)
+        if location == None:
+            continue
+        sink.access(location, b_write, subst_entry(sub_entry),
+            wandle_function, statement)
+    for ((location, sub_entry), ms) in summary.d_hold.items():
+        sink.hold(location_subst(location, d_subst), ms,
+            subst_entry(sub_entry))
+    sink.cut(summary.low)
+
+
+class Contention:
+
+    def __init__(self, wandle_model):
+        self.wandle_model = wandle_model
+        self.d_memo = {}
+        # id(WandleFunction) vs Summary
+        self.d_summary = {}
+        # id(WandleFunction) of the bodies that send, or call one that does
+        self.set_sends = set()
+
+        # location vs list of Access
+        self.d_access = {}
+        # location vs set of keys in d_access, so each is kept once
+        self.d_access_key = {}
+        # (root, receiver) vs ms held, over one run
+        self.d_hold = {}
+        # root vs paths of one run
+        self.d_path = {}
+
+    def __ret_ms(self, wandle_function):
+        return function_latency(
+            wandle_function=wandle_function,
+            d_memo=self.d_memo).ret_ms
+
+    def find_sends(self, lst_root):
+        '''
+        Fills set_sends, for everything that lst_root reach. A body sends
+        if it has a send, or a sync call into a body that sends.
+        '''
+        # id(callee) vs callers, over sync calls
+        d_caller = {}
+        set_seen = set()
+        lst_todo = list(lst_root)
+        lst_send = []
+        while lst_todo:
+            wandle_function = lst_todo.pop()
+            if id(wandle_function) in set_seen:
+                continue
+            set_seen.add(id(wandle_function))
+            for statement in wandle_function.lst_statement:
+                callee = statement.wandle_function
+                if callee == None:
+                    continue
+                if statement.stype == STYPE_ASYNC_LHS_RHS:
+                    lst_send.append(wandle_function)
+                else:
+                    d_caller.setdefault(id(callee), []).append(wandle_function)
+                if callee.has_body():
+                    lst_todo.append(callee)
+        while lst_send:
+            wandle_function = lst_send.pop()
+            if id(wandle_function) in self.set_sends:
+                continue
+            self.set_sends.add(id(wandle_function))
+            lst_send.extend(d_caller.get(id(wandle_function), []))
+
+    def summary(self, wandle_function, lst_stack):
+        key = id(wandle_function)
+        if key in self.d_summary:
+            return self.d_summary[key]
+        idx = len(lst_stack)
+        summary = Summary(low=idx)
+        self.walk_body(
+            wandle_function=wandle_function,
+            self_loc=SELF_LOC,
+            lst_arg_loc=[
+                ARG_LOC%(i) for i in range(len(wandle_function.lst_param))],
+            sink=summary,
+            entry=(),
+            lst_stack=lst_stack + [wandle_function])
+        # One that left out a call lower on the stack depends on how we
+        # got here, so is not kept.
+        if summary.low >= idx:
+            self.d_summary[key] = summary
+        return summary
+
+    # --------------------------------------------------------
+    #   walk
+    # --------------------------------------------------------
+    def walk_root(self, root, wandle_function, self_loc):
+        path = Path(
+            name=root,
+            root=root,
+            parent=None,
+            spawn_seq=0)
+        self.d_path[root] = [path]
+        sink = PathSink(self, path, {})
+        entry = entry_add((), self_loc)
+        sink.hold(self_loc, self.__ret_ms(wandle_function), ())
+        self.walk_body(
+            wandle_function=wandle_function,
+            self_loc=self_loc,
+            lst_arg_loc=[],
+            sink=sink,
+            entry=entry,
+            lst_stack=[wandle_function])
+
+    def add_access(self, location, b_write, path, entry, wandle_function,
+            statement):
+        if location == None:
+            return
+        key = (location, b_write, id(path), path.seq, entry)
+        set_key = self.d_access_key.setdefault(location, set())
+        if key in set_key:
+            return
+        set_key.add(key)
+        self.d_access.setdefault(location, []).append(Access(
+            location=location,
+            b_write=b_write,
+            path=path,
+            seq=path.seq,
+            entry=entry,
+            wandle_function=wandle_function,
+            statement=statement))
+
+    def __resolve(self, dotref, d_loc, self_loc):
+        name = dotref[0]
+        if name in d_loc:
+            location = d_loc[name]
+        elif name == 'self':
+            location = self_loc
+        elif name in self.wandle_model.d_single:
+            location = name
+        elif self_loc != None:
+            location = '%s.%s'%(self_loc, name)
+        else:
+            return None
+        if location == None:
+            return None
+        for name in dotref[1:]:
+            location = '%s.%s'%(location, name)
+        return location
+
+    def __is_local(self, dotref, d_loc):
+        return len(dotref) == 1 and dotref[0] in d_loc
+
+    def walk_body(self, wandle_function, self_loc, lst_arg_loc, sink, entry,
+            lst_stack):
+        tag = sink.enter(wandle_function.get_qualified_name())
+
+        d_loc = {}
+        for (param, location) in zip(wandle_function.lst_param, lst_arg_loc):
+            d_loc[param.name] = location
+
+        for statement in wandle_function.lst_statement:
+            stype = statement.stype
+            if stype in (STYPE_SYNC_VAR_NUL, STYPE_SYNC_VAR_VAL):
+                # A summary's own vars stay on the caller's path, and are
+                # left out.
+                d_loc[statement.lhs_dotref] = None
+                if tag != None:
+                    d_loc[statement.lhs_dotref] = '%s:%s'%(
+                        tag, statement.lhs_dotref)
+                continue
+            if stype not in (STYPE_SYNC_LHS_RHS, STYPE_ASYNC_LHS_RHS):
+                continue
+
+            callee = statement.wandle_function
+            if callee == None:
+                # Copy
+                rhs_loc = self.__resolve(statement.rhs_dotref, d_loc, self_loc)
+                sink.access(rhs_loc, False, entry, wandle_function, statement)
+                if self.__is_local(statement.lhs_dotref, d_loc):
+                    d_loc[statement.lhs_dotref[0]] = rhs_loc
+                else:
+                    sink.access(
+                        self.__resolve(statement.lhs_dotref, d_loc, self_loc),
+                        True, entry, wandle_function, statement)
+                continue
+
+            if len(statement.rhs_dotref) == 1:
+                receiver = self_loc
+            else:
+                receiver = self.__resolve(
+                    statement.rhs_dotref[:-1], d_loc, self_loc)
+            lst_loc = [
+                self.__resolve(dotref, d_loc, self_loc)
+                for dotref in statement.lst_rhs_param]
+
+            if callee in lst_stack:
+                sink.cut(lst_stack.index(callee))
+            elif stype == STYPE_ASYNC_LHS_RHS:
+                # Only a PathSink meets a send.
+                path = sink.path
+                sub_path = Path(
+                    name='%s << %s'%(path.name, callee.get_qualified_name()),
+                    root=path.root,
+                    parent=path,
+                    spawn_seq=path.next_seq())
+                self.d_path[path.root].append(sub_path)
+                sub_sink = PathSink(self, sub_path, sink.d_invocation)
+                sub_sink.hold(receiver, self.__ret_ms(callee), ())
+                self.__call(callee, receiver, lst_loc, sub_sink,
+                    entry_add((), receiver), lst_stack, statement)
+            else:
+                sink.hold(receiver, self.__ret_ms(callee), entry)
+                self.__call(callee, receiver, lst_loc, sink,
+                    entry_add(entry, receiver), lst_stack, statement)
+
+            if statement.lhs_dotref[0] == 'void':
+                continue
+            if not self.__is_local(statement.lhs_dotref, d_loc):
+                sink.access(
+                    self.__resolve(statement.lhs_dotref, d_loc, self_loc),
+                    True, entry, wandle_function, statement)
+
+    def __call(self, callee, receiver, lst_loc, sink, entry, lst_stack,
+            statement):
+        if not callee.has_body():
+            sink.access(
+                location=receiver,
+                b_write=callee.rtype.name == 'Void',
+                entry=entry,
+                wandle_function=callee,
+                statement=statement)
+        elif id(callee) in self.set_sends:
+            self.walk_body(
+                wandle_function=callee,
+                self_loc=receiver,
+                lst_arg_loc=lst_loc,
+                sink=sink,
+                entry=entry,
+                lst_stack=lst_stack + [callee])
+        else:
+            summary_apply(
+                summary=self.summary(callee, lst_stack),
+                sink=sink,
+                receiver=receiver,
+                lst_loc=lst_loc,
+                entry=entry)
+
+    # --------------------------------------------------------
+    #   results
+    # --------------------------------------------------------
+    def contended(self, lst_access):
+        '''
+        Returns (writer paths, other paths) if the accesses contend, or
+        None.
+        '''
+        lst_write = [a for a in lst_access if a.b_write]
+        if not lst_write:
+            return None
+        location = lst_access[0].location
+        if location_scope(location) == SCOPE_SHARED:
+            set_write = set([a.path.name for a in lst_write])
+            set_other = set([a.path.name for a in lst_access]) - set_write
+            return (sorted(set_write), sorted(set_other))
+        # Only the path and seq matter from here, and there are far fewer
+        # of those than accesses.
+        d_unique = {}
+        for a in lst_access:
+            key = (id(a.path), a.seq, a.b_write)
+            if key not in d_unique:
+                d_unique[key] = a
+        lst_access = list(d_unique.values())
+        lst_write = [a for a in lst_access if a.b_write]
+        set_write = set()
+        set_other = set()
+        for a in lst_write:
+            for b in lst_access:
+                if a is b or a.path.root != b.path.root:
+                    continue
+                if a.concurrent(b):
+                    set_write.add(a.path.name)
+                    if b.b_write:
+                        set_write.add(b.path.name)
+                    else:
+                        set_other.add(b.path.name)
+        if not set_write:
+            return None
+        return (sorted(set_write), sorted(set_other - set_write))
+
+    def report(self, d_rate):
+        # guard vs dict
+        d_guard = {}
+        lst_read_only = []
+        for location in sorted(self.d_access.keys()):
+            lst_access = self.d_access[location]
+            t = self.contended(lst_access)
+            if t == None:
+                if location_scope(location) == SCOPE_SHARED and \
+                        not [a for a in lst_access if a.b_write]:
+                    lst_read_only.append(location)
+                continue
+            (lst_writer, lst_other) = t
+            set_common = None
+            for access in lst_access:
+                set_guard = set(access.guards())
+                if set_common == None:
+                    set_common = set_guard
+                else:
+                    set_common &= set_guard
+            guard = min(set_common, key=len)
+            if guard not in d_guard:
+                d_guard[guard] = {
+                    'guard': guard,
+                    'scope': location_scope(guard),
+                    'locations': [],
+                    'writers': set(),
+                    'others': set(),
+                }
+            d = d_guard[guard]
+            d['locations'].append(location)
+            d['writers'].update(lst_writer)
+            d['others'].update(lst_other)
+
+        lst_guard = []
+        for d in d_guard.values():
+            d['writers'] = sorted(d['writers'])
+            d['others'] = sorted(d['others'] - set(d['writers']))
+            d_hold_ms = {}
+            for ((root, receiver), ms) in self.d_hold.items():
+                if receiver == d['guard'] and ms > 0:
+                    d_hold_ms[root] = ms
+            d['hold_ms'] = dict(sorted(d_hold_ms.items()))
+            d['ceiling_per_s'] = None
+            d['utilization'] = None
+            if d['scope'] == SCOPE_SHARED and d_hold_ms:
+                d['ceiling_per_s'] = 1000.0 / max(d_hold_ms.values())
+                if d_rate:
+                    d['utilization'] = sum([
+                        d_rate.get(root, 0.0) * ms
+                        for (root, ms) in d_hold_ms.items()]) / 1000.0
+            lst_guard.append(d)
+        lst_guard.sort(key=lambda d: (
+            d['scope'] != SCOPE_SHARED,
+            -(d['utilization'] or 0.0),
+            -max(list(d['hold_ms'].values()) + [0.0]),
+            d['guard']))
+        return {
+            'locks': lst_guard,
+            'read_only': lst_read_only,
+            'paths': dict([
+                (root, [p.name for p in lst_path])
+                for (root, lst_path) in sorted(self.d_path.items())]),
+        }
+
+
+def contention_analyze(wandle_model, d_rate=None):
+    '''
+    Finds contended state, and the locks that would cover it. d_rate is
+    flow name vs runs per second, and is optional. Returns a dict with
+    'locks', 'read_only' and 'paths'.
+    '''
+    wandle_model.check_all()
+    d_rate = d_rate or {}
+    for flow_name in d_rate.keys():
+        if flow_name not in wandle_model.d_flow:
+            raise Exception("No flow exists called %s"%(flow_name))
+
+    contention = Contention(wandle_model)
+    lst_root = list(wandle_model.d_flow.values())
+    for wandle_single in wandle_model.d_single.values():
+        lst_root.extend([
+            f for f in wandle_single.wandle_class.d_fab_async.values()
+            if f.has_body()])
+    contention.find_sends(lst_root)
+
+    set_reached = set()
+    for (flow_name, wandle_function) in sorted(wandle_model.d_flow.items()):
+        contention.walk_root(flow_name, wandle_function, None)
+    for lst_path in contention.d_path.values():
+        for path in lst_path:
+            set_reached.add(path.name.split(' << ')[-1])
+
+    # Async methods of singles can be sent from anywhere, so they are paths
+    # of their own, where no flow reaches them.
+    for (name, wandle_single) in sorted(wandle_model.d_single.items()):
+        wandle_class = wandle_single.wandle_class
+        for wandle_function in wandle_class.d_fab_async.values():
+            qname = wandle_function.get_qualified_name()
+            if qname in set_reached or not wandle_function.has_body():
+                continue
+            contention.walk_root(qname, wandle_function, name)
+    return contention.report(d_rate)
@@ -0,0 +1,295 @@
+#
+# Structural diff between two versions of a model.
+#
+# Each declaration (class, generic, single, alias, flow) gets a Merkle hash
+# built from the hashes of its members. A member hash covers a method's
+# signature and body, or a field's type. Declarations are grouped into
+# buckets by the hash of their name, and the buckets are hashed in turn into
+# a root. The diff walks down from the root and only descends into subtrees
+# whose hashes differ. Once each model has been hashed, the cost of the
+# comparison follows the size of the change, not the size of the model.
+#
+
+import hashlib
+
+
+DECL_ALIAS = 'alias'
+DECL_CLASS = 'class'
+DECL_FLOW = 'flow'
+DECL_GENERIC = 'generic'
+DECL_SINGLE = 'single'
+
+MEMBER_BODY = 'body'
+MEMBER_FIELD = 'field'
+MEMBER_METHOD = 'method'
+
+OP_ADDED = 'added'
+OP_CHANGED = 'changed'
+OP_REMOVED = 'removed'
+
+BUCKET_COUNT = 256
+
+
+def _hash(lst_part):
+    h = hashlib.sha1()
+    for part in lst_part:
+        h.update(part.encode('utf8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+def statement_key(statement):
+    lst = [statement.stype]
+    if statement.wandle_class != None:
+        lst.append(statement.wandle_class.name)
+    for dotref in (statement.lhs_dotref, statement.rhs_dotref):
+        if dotref == None:
+            lst.append('')
+        elif type(dotref) == str:
+            lst.append(dotref)
+        else:
+            lst.append('.'.join(dotref))
+    lst.append(','.join(['.'.join(p) for p in statement.lst_rhs_param]))
+    if statement.txt != None:
+        lst.append(statement.txt)
+    return '|'.join(lst)
+
+def function_signature(wandle_function):
+    if wandle_function.is_async(): s_kind = 'async'
+    else: s_kind = 'sync'
+    signature = '%s %s %s(%s)'%(
+        s_kind,
+        wandle_function.rtype.name,
+        wandle_function.name,
+        ', '.join([str(p) for p in wandle_function.lst_param]))
+    if wandle_function.cost_dist != None:
+        signature = '%s cost %s'%(signature, wandle_function.cost_dist.as_code())
+    if wandle_function.lst_effect:
+        signature = '%s effect %s'%(signature, ', '.join(wandle_function.lst_effect))
+    if wandle_function.budget_ms != None:
+        signature = '%s budget %gms'%(signature, wandle_function.budget_ms)
+    return signature
+
+def function_hash(wandle_function):
+    lst = [function_signature(wandle_function)]
+    for statement in wandle_function.lst_statement:
+        lst.append(statement_key(statement))
+    return _hash(lst)
+
+
+class MerkleDecl:
+
+    def __init__(self, kind, name):
+        self.kind = kind
+        self.name = name
+
+        # List<str>. Things about the declaration itself, such as parents.
+        self.lst_head = []
+        # (member kind, member name) vs hash
+        self.d_member = {}
+        self.digest = None
+
+    def seal(self):
+        lst = [self.kind, self.name] + self.lst_head
+        for key in sorted(self.d_member.keys()):
+            lst.append('%s:%s:%s'%(key[0], key[1], self.d_member[key]))
+        self.digest = _hash(lst)
+
+
+class MerkleTree:
+
+    def __init__(self, wandle_model):
+        self.wandle_model = wandle_model
+
+        # str vs MerkleDecl. Keyed by 'kind name'.
+        self.d_decl = {}
+        # int vs (hash, List<str>). Keys in each bucket are sorted.
+        self.d_bucket = {}
+        self.digest = None
+
+    def add(self, decl):
+        decl.seal()
+        self.d_decl['%s %s'%(decl.kind, decl.name)] = decl
+
+    def seal(self):
+        d_key = {}
+        for key in self.d_decl.keys():
+            idx = int(hashlib.sha1(key.encode('utf8')).hexdigest()[:4], 16)
+            idx = idx % BUCKET_COUNT
+            if idx not in d_key:
+                d_key[idx] = []
+            d_key[idx].append(key)
+        for (idx, lst_key) in d_key.items():
+            lst_key.sort()
+            digest = _hash(['%s:%s'%(k, self.d_decl[k].digest) for k in lst_key])
+            self.d_bucket[idx] = (digest, lst_key)
+        self.digest = _hash([
+            '%s:%s'%(idx, self.d_bucket[idx][0])
+            for idx in sorted(self.d_bucket.keys())])
+
+
+def _add_members(decl, owner, wandle_class):
+    # Only what this owner declares. Inherited members are hashed against
+    # the class that declares them.
+    for d in (wandle_class.d_fab_sync, wandle_class.d_fab_async):
+        for (name, wandle_function) in d.items():
+            if wandle_function.compile_container is not owner:
+                continue
+            decl.d_member[(MEMBER_METHOD, name)] = function_hash(
+                wandle_function)
+
+    d_inherited = {}
+    for parent_name in wandle_class.lst_inherits_from:
+        parent = wandle_class.wandle_model.d_specific[parent_name]
+        for (name, wandle_object) in parent.d_object.items():
+            d_inherited[name] = wandle_object
+    for (name, wandle_object) in wandle_class.d_object.items():
+        if d_inherited.get(name) is wandle_object:
+            continue
+        decl.d_member[(MEMBER_FIELD, name)] = _hash([wandle_object.get_type()])
+
+def merkle_tree_build(wandle_model):
+    wandle_model.check_all()
+    tree = MerkleTree(wandle_model)
+
+    for (cname, wandle_class) in wandle_model.d_specific.items():
+        if wandle_class.position == None:
+            # Void, placeholders, single classes, and derived classes.
+            continue
+        decl = MerkleDecl(DECL_CLASS, cname)
+        decl.lst_head.extend(wandle_class.lst_inherits_from)
+        if wandle_class.layout != None:
+            decl.lst_head.append('layout %s'%(wandle_class.layout))
+        _add_members(decl, wandle_class, wandle_class)
+        tree.add(decl)
+    for (gname, wandle_generic) in wandle_model.d_generic.items():
+        decl = MerkleDecl(DECL_GENERIC, gname)
+        decl.lst_head.extend(wandle_generic.lst_template_type)
+        if wandle_generic.layout != None:
+            decl.lst_head.append('layout %s'%(wandle_generic.layout))
+        for d in (wandle_generic.d_fab_sync, wandle_generic.d_fab_async):
+            for (name, wandle_function) in d.items():
+                decl.d_member[(MEMBER_METHOD, name)] = function_hash(
+                    wandle_function)
+        for (name, wandle_object) in wandle_generic.d_object.items():
+            decl.d_member[(MEMBER_FIELD, name)] = _hash(
+                [wandle_object.get_type()])
+        tree.add(decl)
+    for (sname, wandle_single) in wandle_model.d_single.items():
+        decl = MerkleDecl(DECL_SINGLE, sname)
+        _add_members(decl, wandle_single, wandle_single.wandle_class)
+        tree.add(decl)
+    for (aname, tstring) in wandle_model.d_alias.items():
+        decl = MerkleDecl(DECL_ALIAS, aname)
+        decl.lst_head.append(tstring)
+        tree.add(decl)
+    for (fname, wandle_function) in wandle_model.d_flow.items():
+        decl = MerkleDecl(DECL_FLOW, fname)
+        decl.d_member[(MEMBER_BODY, '')] = function_hash(wandle_function)
+        tree.add(decl)
+
+    tree.seal()
+    return tree
+
+
+class Change:
+
+    def __init__(self, op, decl_kind, decl_name, member_kind=None,
+            member_name=None):
+        self.op = op
+        self.decl_kind = decl_kind
+        self.decl_name = decl_name
+        self.member_kind = member_kind
+        self.member_name = member_name
+
+        # List<str>. Flows that depend on what changed, in either version.
+        self.lst_flow = []
+
+    def __repr__(self):
+        return '<Change %s %s>'%(self.op, self.get_label())
+
+    def get_label(self):
+        if self.member_kind == None:
+            return '%s %s'%(self.decl_kind, self.decl_name)
+        if self.member_kind == MEMBER_BODY:
+            return '%s %s body'%(self.decl_kind, self.decl_name)
+        return '%s %s.%s'%(
+            self.member_kind, self.decl_name, self.member_name)
+
+
+def _affected_flows(wandle_model, change):
+    if wandle_model == None:
+        return set()
+    if change.decl_kind == DECL_FLOW:
+        if change.decl_name in wandle_model.d_flow:
+            return set([change.decl_name])
+        return set()
+    if change.decl_kind == DECL_ALIAS:
+        return set()
+
+    if change.member_kind == MEMBER_METHOD:
+        lst_qname = ['%s.%s'%(change.decl_name, change.member_name)]
+    else:
+        # A declaration or field change. Any flow that reaches a method of
+        # the owner depends on it.
+        lst_qname = wandle_model.wandle_index.get_members(change.decl_name)
+
+    wandle_index = wandle_model.wandle_index
+    lst_caller = []
+    for qname in lst_qname:
+        lst_caller.extend(wandle_index.get_callers(qname))
+    return set([
+        wandle_function.name
+        for wandle_function in wandle_index.get_flows_reaching(lst_caller)])
+
+def merkle_diff(old_tree, new_tree):
+    '''
+    Returns List<Change>, sorted by label.
+    '''
+    lst_change = []
+    if old_tree.digest == new_tree.digest:
+        return lst_change
+
+    set_key = set()
+    for idx in set(old_tree.d_bucket.keys()) | set(new_tree.d_bucket.keys()):
+        old_bucket = old_tree.d_bucket.get(idx)
+        new_bucket = new_tree.d_bucket.get(idx)
+        if old_bucket != None and new_bucket != None:
+            if old_bucket[0] == new_bucket[0]:
+                continue
+        if old_bucket != None:
+            set_key.update(old_bucket[1])
+        if new_bucket != None:
+            set_key.update(new_bucket[1])
+
+    for key in set_key:
+        old_decl = old_tree.d_decl.get(key)
+        new_decl = new_tree.d_decl.get(key)
+        if old_decl == None:
+            lst_change.append(Change(OP_ADDED, new_decl.kind, new_decl.name))
+            continue
+        if new_decl == None:
+            lst_change.append(Change(OP_REMOVED, old_decl.kind, old_decl.name))
+            continue
+        if old_decl.digest == new_decl.digest:
+            continue
+
+        if old_decl.lst_head != new_decl.lst_head:
+            lst_change.append(Change(OP_CHANGED, new_decl.kind, new_decl.name))
+        for mkey in set(old_decl.d_member.keys()) | set(new_decl.d_member.keys()):
+            old_digest = old_decl.d_member.get(mkey)
+            new_digest = new_decl.d_member.get(mkey)
+            if old_digest == new_digest:
+                continue
+            if old_digest == None: op = OP_ADDED
+            elif new_digest == None: op = OP_REMOVED
+            else: op = OP_CHANGED
+            lst_change.append(Change(
+                op, new_decl.kind, new_decl.name, mkey[0], mkey[1]))
+
+    for change in lst_change:
+        set_flow = _affected_flows(old_tree.wandle_model, change)
+        set_flow.update(_affected_flows(new_tree.wandle_model, change))
+        change.lst_flow = sorted(set_flow)
+
+    lst_change.sort(key=lambda c: c.get_label())
+    return lst_change
@@ -0,0 +1,319 @@
+#
+# Formats Wandle source, working directly from the text.
+#
+# This does not parse or build the model. It makes one pass over the
+# source, keeps comments and notes, and normalises indentation (four spaces
+# per block), spacing around operators, one statement per line, and runs of
+# blank lines.
+#
+# Most lines hold exactly one statement. Those go through a fast path that
+# normalises the whole line with string methods. Anything else (several
+# statements on a line, a statement split over lines, notes, generic types
+# in a parameter list) drops into a token-at-a-time path until the next
+# line boundary.
+#
+
+import re
+
+
+INDENT = '    '
+MAX_BLANK = 2
+
+TOKEN_RE = re.compile(r'''
+      (?P<comment>\#[^\n]*)
+    | (?P<newline>\n)
+    | (?P<space>[ \t\r\f\v]+)
+    | (?P<op><<)
+    | (?P<punct>[{}();.=!,])
+    | (?P<word>[A-Za-z0-9_]+(?:[/,][A-Za-z0-9_]+)*)
+    | (?P<other>.)
+''', re.VERBOSE)
+NOTE_OPEN_RE = re.compile(r'[ \t]*\{')
+
+# Statements end with these. Line breaks go after them.
+SET_TERMINATOR = set([';', '!', '{', '}'])
+# No space goes before these.
+SET_TIGHT_BEFORE = set([';', ',', ')', '.', '!', '(', ':'])
+# No space goes after these.
+SET_TIGHT_AFTER = set(['(', '.', ':'])
+
+# Fast path. These run on a line that has already had its whitespace
+# collapsed to single spaces.
+RE_EQ = re.compile(r' ?= ?')
+RE_SEND = re.compile(r' ?<< ?')
+RE_COMMA = re.compile(r' ?, ?')
+RE_TIGHT_BEFORE = re.compile(r' (?=[;,).!(:])')
+RE_TIGHT_AFTER = re.compile(r'(?<=[(.:]) ')
+
+
+def _split_word(word, b_in_paren):
+    '''
+    The word pattern will swallow 'k,V' in 'put(K k,V v)'. Inside a
+    parameter list, commas separate pairs, except within a type string such
+    as Map/String,Person. An effect list (io,net) splits the same way, and
+    b_in_paren is set for it too. Elsewhere (generic and inheritance lists,
+    alias types) commas stay in the token. Returns a list of tokens.
+    '''
+    if ',' not in word or not b_in_paren:
+        return [word]
+    lst_part = word.split(',')
+    lst_tok = []
+    for (idx, part) in enumerate(lst_part):
+        if '/' in part:
+            lst_tok.append(','.join(lst_part[idx:]))
+            return lst_tok
+        lst_tok.append(part)
+        if idx < len(lst_part) - 1:
+            lst_tok.append(',')
+    return lst_tok
+
+def _tidy_note_line(line):
+    if '#' in line:
+        (code, comment) = line.split('#', 1)
+        code = ' '.join(code.split())
+        if code:
+            return code + ' #' + comment.rstrip()
+        return '#' + comment.rstrip()
+    return ' '.join(line.split())
+
+
+class Formatter:
+
+    def __init__(self):
+        # List<str>. Finished output lines.
+        self.lst_line = []
+        # Pieces of the line we are building. Empty when between lines.
+        self.sb = []
+        self.prev = None
+        self.depth = 0
+        self.depth_paren = 0
+        # Set from the word effect to the end of the statement. Effect
+        # lists are spaced after commas, as parameter lists are.
+        self.b_effect = False
+        # Newlines seen since the last token.
+        self.count_newline = 0
+        # Set when the last output line is code that a trailing comment
+        # could follow.
+        self.b_trailing_ok = False
+
+    def _indent(self):
+        return INDENT * self.depth
+
+    def _blank_lines_before(self, b_close=False):
+        '''
+        Called as we start a new line. Carries blank lines across from the
+        source, up to MAX_BLANK. We drop them at the top of a block, at the
+        bottom of a block, and at the top of the file.
+        '''
+        count_blank = min(self.count_newline - 1, MAX_BLANK)
+        if count_blank <= 0 or not self.lst_line or b_close:
+            return
+        if self.lst_line[-1].endswith('{'):
+            return
+        for i in range(count_blank):
+            self.lst_line.append('')
+
+    def _flush(self):
+        if self.sb:
+            self.lst_line.append(''.join(self.sb).rstrip())
+            self.b_trailing_ok = True
+        self.sb = []
+        self.prev = None
+        self.b_effect = False
+
+    def comment(self, txt):
+        if self.count_newline == 0 and (self.sb or self.b_trailing_ok):
+            # Trailing comment on a line of code.
+            if self.sb:
+                self._flush()
+            self.lst_line[-1] = self.lst_line[-1] + ' ' + txt
+        else:
+            self._flush()
+            self._blank_lines_before()
+            self.lst_line.append(self._indent() + txt)
+        self.b_trailing_ok = False
+        self.count_newline = 0
+
+    def token(self, tok):
+        if tok == '}':
+            self._flush()
+            self.depth = max(0, self.depth - 1)
+            self._blank_lines_before(b_close=True)
+            self.lst_line.append(self._indent() + '}')
+            self.b_trailing_ok = True
+            self.count_newline = 0
+            return
+
+        if tok == '(':
+            self.depth_paren += 1
+        elif tok == ')':
+            self.depth_paren = max(0, self.depth_paren - 1)
+
+        if not self.sb:
+            self._blank_lines_before()
+            self.sb.append(self._indent())
+        elif tok in SET_TIGHT_BEFORE or self.prev in SET_TIGHT_AFTER:
+            pass
+        elif self.prev == ',' and self.depth_paren == 0 and not self.b_effect:
+            # Generic and inheritance lists stay tight, as in Map K,V.
+            pass
+        else:
+            self.sb.append(' ')
+        self.sb.append(tok)
+        self.prev = tok
+        self.count_newline = 0
+        if tok == 'effect':
+            self.b_effect = True
+
+        if tok in SET_TERMINATOR:
+            self._flush()
+            self.depth_paren = 0
+            if tok == '{':
+                self.depth += 1
+
+    def note(self, lst_content_line, b_one_line):
+        '''
+        Writes a note block. lst_content_line holds the text of each line
+        between the braces, already tidied.
+        '''
+        lst_content_line = [l for l in lst_content_line if l]
+        self.token('note')
+        self.sb.append(' {')
+        if b_one_line or not lst_content_line:
+            if lst_content_line:
+                self.sb.append(' ')
+                self.sb.append(' '.join(lst_content_line))
+            self.sb.append(' }')
+            self._flush()
+        else:
+            self._flush()
+            for content_line in lst_content_line:
+                self.lst_line.append(self._indent() + INDENT + content_line)
+            self.lst_line.append(self._indent() + '}')
+            self.b_trailing_ok = True
+        self.count_newline = 0
+
+    def fast_line(self, line):
+        '''
+        Formats a whole source line in one go, if it is a simple one.
+        Returns False, having done nothing, if it is not.
+        '''
+        if self.sb:
+            # We are part way through a statement.
+            return False
+
+        (code, sep, comment) = line.partition('#')
+        s = ' '.join(code.split())
+        if not s:
+            if sep:
+                self.comment('#' + comment.rstrip())
+            self.count_newline += 1
+            return True
+
+        last = s[-1]
+        if last not in SET_TERMINATOR:
+            return False
+        count = s.count(';') + s.count('!') + s.count('{') + s.count('}')
+        if count != 1 or 'note' in s:
+            return False
+        b_paren = '(' in s
+        if b_paren and '/' in s:
+            return False
+
+        if s == '}':
+            self.token('}')
+        else:
+            if '=' in s:
+                s = RE_EQ.sub(' = ', s)
+            if '<' in s:
+                s = RE_SEND.sub(' << ', s)
+            if ',' in s:
+                if b_paren:
+                    s = RE_COMMA.sub(', ', s)
+                else:
+                    s = RE_COMMA.sub(',', s)
+            s = RE_TIGHT_BEFORE.sub('', s)
+            if b_paren:
+                s = RE_TIGHT_AFTER.sub('', s)
+            if last == '{':
+                s = s[:-1].rstrip() + ' {'
+
+            self._blank_lines_before()
+            self.lst_line.append(self._indent() + s)
+            self.b_trailing_ok = True
+            if last == '{':
+                self.depth += 1
+
+        if sep:
+            self.lst_line[-1] = self.lst_line[-1] + ' #' + comment.rstrip()
+            self.b_trailing_ok = False
+        self.count_newline = 1
+        return True
+
+    def token_pass(self, wandle_src, pos):
+        '''
+        Works through tokens from pos, until we reach a line boundary with
+        no statement in progress. Returns the position after that newline.
+        '''
+        end = len(wandle_src)
+        while pos < end:
+            m = TOKEN_RE.match(wandle_src, pos)
+            kind = m.lastgroup
+            txt = m.group()
+            pos = m.end()
+
+            if kind == 'space':
+                continue
+            elif kind == 'newline':
+                self.count_newline += 1
+                if not self.sb:
+                    return pos
+            elif kind == 'comment':
+                self.comment(txt)
+            elif kind == 'word' and txt == 'note':
+                # A note is the word note, then a brace. Its content is free
+                # text up to the closing brace.
+                m_open = NOTE_OPEN_RE.match(wandle_src, pos)
+                if m_open == None:
+                    self.token(txt)
+                    continue
+                idx_close = wandle_src.find('}', m_open.end())
+                if idx_close == -1:
+                    idx_close = end
+                content = wandle_src[m_open.end():idx_close]
+                self.note(
+                    lst_content_line=[_tidy_note_line(l)
+                        for l in content.split('\n')],
+                    b_one_line='\n' not in content)
+                pos = idx_close + 1
+            elif kind == 'word':
+                for tok in _split_word(txt,
+                        self.depth_paren > 0 or self.b_effect):
+                    self.token(tok)
+            else:
+                self.token(txt)
+        return pos
+
+    def result(self):
+        self._flush()
+        while self.lst_line and self.lst_line[-1] == '':
+            self.lst_line.pop()
+        return '\n'.join(self.lst_line) + '\n'
+
+
+def wandle_fmt(wandle_src):
+    '''
+    Returns the formatted source.
+    '''
+    formatter = Formatter()
+    pos = 0
+    end = len(wandle_src)
+    while pos < end:
+        idx_nl = wandle_src.find('\n', pos)
+        if idx_nl == -1:
+            idx_nl = end
+        if formatter.fast_line(wandle_src[pos:idx_nl]):
+            pos = idx_nl + 1
+        else:
+            pos = formatter.token_pass(wandle_src, pos)
+    return formatter.result()
@@ -0,0 +1,257 @@
+#
+# Call graph and type-use graph of a built model, as CSR adjacency arrays.
+#
+# Nodes are flows, methods, classes and singles. There are two edge sets:
+#
+#   call    function -> function it calls
+#
+#   use     function -> class of its params, return and local vars
+#           function -> single it touches
+#           method   -> class, single or generic that owns it
+#           class    -> class of each of its fields
+#           class    -> generic and type arguments it was derived from
+#
+# Each is held as (indptr, indices), in the layout of scipy.sparse.csr_matrix,
+# so the neighbours of node i are indices[indptr[i]:indptr[i+1]]. The
+# analyses below work on whole frontiers of nodes at a time, with numpy.
+#
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+KIND_FLOW = 0
+KIND_METHOD = 1
+KIND_CLASS = 2
+KIND_SINGLE = 3
+LST_KIND_NAME = ['flow', 'method', 'class', 'single']
+
+
+def _require_numpy():
+    if np == None:
+        raise Exception("This needs numpy. pip install numpy")
+
+def csr_from_edges(n, arr_src, arr_dst):
+    '''
+    Builds (indptr, indices) from parallel arrays of edges. Duplicate edges
+    are dropped, and each row's neighbours are sorted.
+    '''
+    if arr_src.size:
+        arr_key = np.unique(arr_src.astype(np.int64) * n + arr_dst)
+        arr_src = arr_key // n
+        arr_dst = arr_key % n
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(arr_src, minlength=n), out=indptr[1:])
+    indices = arr_dst.astype(np.int32)
+    return (indptr, indices)
+
+def csr_neighbours(indptr, indices, arr_node):
+    '''
+    Concatenated neighbours of every node in arr_node, in one gather.
+    '''
+    arr_start = indptr[arr_node]
+    arr_len = indptr[arr_node + 1] - arr_start
+    total = int(arr_len.sum())
+    if total == 0:
+        return np.zeros(0, dtype=indices.dtype)
+    # For each output slot, the offset into indices. We shift a running
+    # counter by the start of each row.
+    arr_base = np.repeat(arr_start - (np.cumsum(arr_len) - arr_len), arr_len)
+    return indices[arr_base + np.arange(total)]
+
+
+class WandleGraph:
+
+    def __init__(self):
+        # List<str>
+        self.lst_name = []
+        # str vs int
+        self.d_node = {}
+        # np.int8 per node. One of the KIND_ constants.
+        self.arr_kind = None
+
+        self.call_indptr = None
+        self.call_indices = None
+        self.use_indptr = None
+        self.use_indices = None
+
+    def __repr__(self):
+        return '<WandleGraph nodes:%s call:%s use:%s>'%(
+            len(self.lst_name),
+            len(self.call_indices),
+            len(self.use_indices))
+
+    def size(self):
+        return len(self.lst_name)
+
+    def get_node(self, name):
+        return self.d_node[name]
+
+    def get_name(self, idx):
+        return self.lst_name[idx]
+
+    def nodes_of_kind(self, kind):
+        return np.flatnonzero(self.arr_kind == kind)
+
+    def combined(self):
+        '''
+        Returns (indptr, indices) of the call and use edges together.
+        '''
+        n = self.size()
+        arr_src = np.concatenate([
+            np.repeat(np.arange(n), np.diff(self.call_indptr)),
+            np.repeat(np.arange(n), np.diff(self.use_indptr))])
+        arr_dst = np.concatenate([self.call_indices, self.use_indices])
+        return csr_from_edges(n, arr_src, arr_dst)
+
+    def reachable(self, lst_name, b_calls_only=False):
+        '''
+        Boolean mask of the nodes that are reachable from the named nodes.
+        By default we follow calls and uses, so that classes and singles
+        are reached through the functions that use them.
+        '''
+        if b_calls_only:
+            (indptr, indices) = (self.call_indptr, self.call_indices)
+        else:
+            (indptr, indices) = self.combined()
+
+        arr_reached = np.zeros(self.size(), dtype=bool)
+        arr_frontier = np.array(
+            [self.d_node[name] for name in lst_name], dtype=np.int64)
+        arr_reached[arr_frontier] = True
+        while arr_frontier.size:
+            arr_next = csr_neighbours(indptr, indices, arr_frontier)
+            arr_next = np.unique(arr_next[~arr_reached[arr_next]])
+            arr_reached[arr_next] = True
+            arr_frontier = arr_next.astype(np.int64)
+        return arr_reached
+
+    def fan_out(self):
+        return np.diff(self.call_indptr)
+
+    def fan_in(self):
+        return np.bincount(self.call_indices, minlength=self.size())
+
+    def unreachable(self, lst_flow_name=None):
+        '''
+        Methods, classes and singles that cannot be reached from the given
+        flows (default: every flow). Returns {kind name: List<str>}.
+        '''
+        if lst_flow_name == None:
+            lst_flow_name = [self.lst_name[i]
+                for i in self.nodes_of_kind(KIND_FLOW)]
+        arr_reached = self.reachable(lst_flow_name)
+
+        d = {}
+        for kind in (KIND_METHOD, KIND_CLASS, KIND_SINGLE):
+            arr_idx = np.flatnonzero((self.arr_kind == kind) & ~arr_reached)
+            d[LST_KIND_NAME[kind]] = [self.lst_name[i] for i in arr_idx]
+        return d
+
+    def as_npz(self, path):
+        np.savez(
+            path,
+            names=np.array(self.lst_name, dtype=object),
+            kind=self.arr_kind,
+            call_indptr=self.call_indptr,
+            call_indices=self.call_indices,
+            use_indptr=self.use_indptr,
+            use_indices=self.use_indices)
+
+
+def wandle_graph_build(wandle_model):
+    _require_numpy()
+    wandle_model.check_all()
+
+    graph = WandleGraph()
+    lst_kind = []
+    def add_node(name, kind):
+        if name in graph.d_node:
+            return graph.d_node[name]
+        idx = len(graph.lst_name)
+        graph.lst_name.append(name)
+        graph.d_node[name] = idx
+        lst_kind.append(kind)
+        return idx
+
+    # Classes. Singles are known by their own name, rather than the name of
+    # their one-off class.
+    d_class_node = {}
+    for (cname, wandle_class) in wandle_model.d_specific.items():
+        if cname == 'Void' or wandle_class.b_placeholder:
+            continue
+        if cname.startswith('Single|'):
+            continue
+        d_class_node[cname] = add_node(cname, KIND_CLASS)
+    for (sname, wandle_single) in wandle_model.d_single.items():
+        d_class_node[wandle_single.wandle_class.name] = add_node(
+            sname, KIND_SINGLE)
+    for gname in wandle_model.d_generic.keys():
+        d_class_node.setdefault(gname, add_node(gname, KIND_CLASS))
+
+    d_function = wandle_model.get_functions()
+    for (qname, wandle_function) in d_function.items():
+        if wandle_function.is_flow():
+            add_node(qname, KIND_FLOW)
+        else:
+            add_node(qname, KIND_METHOD)
+
+    lst_call_src = []
+    lst_call_dst = []
+    lst_use_src = []
+    lst_use_dst = []
+    def add_use(idx, cstring):
+        if cstring in d_class_node:
+            lst_use_src.append(idx)
+            lst_use_dst.append(d_class_node[cstring])
+
+    for (qname, wandle_function) in d_function.items():
+        idx = graph.d_node[qname]
+        if not wandle_function.is_flow():
+            owner = wandle_function.compile_container
+            if owner.wtype == 'WandleSingle':
+                add_use(idx, owner.wandle_class.name)
+            else:
+                add_use(idx, owner.name)
+        add_use(idx, wandle_function.rtype.name)
+        for param in wandle_function.lst_param:
+            add_use(idx, param.wandle_class.name)
+        for statement in wandle_function.lst_statement:
+            if statement.wandle_function != None:
+                lst_call_src.append(idx)
+                lst_call_dst.append(graph.d_node[
+                    statement.wandle_function.get_qualified_name()])
+            elif statement.wandle_class != None:
+                add_use(idx, statement.wandle_class.name)
+    for (sname, lst_wandle_function) in wandle_model.wandle_index.d_single_use.items():
+        for wandle_function in lst_wandle_function:
+            lst_use_src.append(graph.d_node[
+                wandle_function.get_qualified_name()])
+            lst_use_dst.append(graph.d_node[sname])
+    for (cname, wandle_class) in wandle_model.d_specific.items():
+        if cname not in d_class_node:
+            continue
+        idx = d_class_node[cname]
+        for wandle_object in wandle_class.d_object.values():
+            add_use(idx, wandle_object.get_type())
+        if '/' in cname:
+            # A class derived from a generic uses the generic, and each of
+            # the types it was given.
+            (gname, csep) = cname.split('/', 1)
+            add_use(idx, gname)
+            for tname in csep.split(','):
+                add_use(idx, tname)
+
+    n = graph.size()
+    graph.arr_kind = np.array(lst_kind, dtype=np.int8)
+    (graph.call_indptr, graph.call_indices) = csr_from_edges(
+        n,
+        np.array(lst_call_src, dtype=np.int64),
+        np.array(lst_call_dst, dtype=np.int64))
+    (graph.use_indptr, graph.use_indices) = csr_from_edges(
+        n,
+        np.array(lst_use_src, dtype=np.int64),
+        np.array(lst_use_dst, dtype=np.int64))
+    return graph
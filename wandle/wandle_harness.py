@@ -0,0 +1,488 @@
+#
+# Generates an asyncio load driver for a package written by pygen.
+#
+# The driver is one module, loadtest, that goes into the package next to
+# the modules pygen wrote. For each flow it has a copy of the flow body,
+# generated in the same way as in the flows module, but with a timer around
+# every call. So it measures each flow along the statements the design
+# gives it, and each statement on its own, while the calls go to the
+# package's own classes.
+#
+# Flows arrive at a given rate each (open loop, with exponential gaps), or,
+# with no rates, a fixed number of workers run them back to back (closed
+# loop). --concurrency caps the flows in flight. Latency is taken from
+# arrival, so time spent waiting for a slot counts. Histograms have log
+# buckets, about 9% wide.
+#
+# Any method can be replaced at run time. install_fakes() puts in a fake
+# that sleeps for the method's cost and returns a new object of its return
+# type, and register() puts in a real implementation, one method at a time.
+# A sync fake blocks the event loop for its cost, as the real thing would.
+#
+# Run it with python -m PACKAGE.loadtest --help.
+#
+
+from .wandle_lint import statement_txt
+from .wandle_pygen import PyGen
+from .wandle_pygen import PyModule
+
+import os
+
+
+HARNESS_MODULE = 'loadtest'
+
+# Driver functions are called flow_NAME, to keep clear of the runtime.
+DRIVER_PREFIX = 'flow_'
+
+# The part of the driver that does not depend on the model.
+RUNTIME = '''
+# --------------------------------------------------------
+#   histograms
+# --------------------------------------------------------
+# Buckets grow by a factor of 2 ** (1 / 8), from 1us.
+BUCKETS_PER_DOUBLING = 8
+
+
+class Histogram:
+
+    def __init__(self):
+        # bucket index vs count
+        self.d_bucket = {}
+        self.count = 0
+        self.total_s = 0.0
+        self.max_s = 0.0
+
+    def record(self, s):
+        us = max(s * 1e6, 1.0)
+        idx = int(math.log2(us) * BUCKETS_PER_DOUBLING)
+        self.d_bucket[idx] = self.d_bucket.get(idx, 0) + 1
+        self.count += 1
+        self.total_s += s
+        self.max_s = max(self.max_s, s)
+
+    def percentile_ms(self, p):
+        \'\'\'
+        Top of the bucket that holds the p-th percentile, in ms.
+        \'\'\'
+        if self.count == 0:
+            return None
+        rank = p / 100.0 * self.count
+        seen = 0
+        for idx in sorted(self.d_bucket.keys()):
+            seen += self.d_bucket[idx]
+            if seen >= rank:
+                top_us = 2 ** ((idx + 1) / BUCKETS_PER_DOUBLING)
+                return min(top_us / 1000.0, self.max_s * 1000.0)
+        return self.max_s * 1000.0
+
+    def as_dict(self, duration_s):
+        mean_ms = None
+        if self.count:
+            mean_ms = self.total_s * 1000.0 / self.count
+        return {
+            'count': self.count,
+            'throughput_per_s': self.count / duration_s,
+            'mean_ms': mean_ms,
+            'p50_ms': self.percentile_ms(50),
+            'p95_ms': self.percentile_ms(95),
+            'p99_ms': self.percentile_ms(99),
+            'max_ms': self.max_s * 1000.0,
+        }
+
+
+class Recorder:
+
+    def __init__(self):
+        # flow name vs Histogram
+        self.d_flow = {}
+        # flow name vs count
+        self.d_error = {}
+        # flow name vs the first error, as text
+        self.d_error_txt = {}
+        # index into LST_STATEMENT vs Histogram
+        self.d_statement = {}
+
+    def start(self):
+        return time.perf_counter()
+
+    def stop(self, key, t):
+        if key not in self.d_statement:
+            self.d_statement[key] = Histogram()
+        self.d_statement[key].record(time.perf_counter() - t)
+
+    async def timed(self, key, awaitable):
+        t = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.stop(key, t)
+
+    def flow(self, flow_name):
+        if flow_name not in self.d_flow:
+            self.d_flow[flow_name] = Histogram()
+        return self.d_flow[flow_name]
+
+    def report(self, duration_s):
+        d_flow = {}
+        for flow_name in D_FLOW.keys():
+            d = self.flow(flow_name).as_dict(duration_s)
+            d['errors'] = self.d_error.get(flow_name, 0)
+            d['first_error'] = self.d_error_txt.get(flow_name)
+            d_flow[flow_name] = d
+        lst_statement = []
+        for key in sorted(self.d_statement.keys()):
+            (flow_name, txt) = LST_STATEMENT[key]
+            d = self.d_statement[key].as_dict(duration_s)
+            d['flow'] = flow_name
+            d['statement'] = txt
+            lst_statement.append(d)
+        return {
+            'duration_s': duration_s,
+            'flows': d_flow,
+            'statements': lst_statement,
+        }
+
+
+# The drivers time their statements against this.
+_REC = Recorder()
+
+
+# --------------------------------------------------------
+#   implementations
+# --------------------------------------------------------
+# Qualified name vs what was there before register().
+d_saved = {}
+
+def _owner(name):
+    if name not in D_METHOD:
+        raise Exception("No method %s"%(name))
+    (module, attr, mname, b_async, cost_ms, ret) = D_METHOD[name]
+    return (getattr(importlib.import_module('.' + module, __package__), attr),
+        mname)
+
+def _new(ret):
+    if ret is None:
+        return None
+    (module, attr, b_new) = ret
+    obj = getattr(importlib.import_module('.' + module, __package__), attr)
+    if b_new:
+        return obj()
+    return obj
+
+def register(name, fn):
+    \'\'\'
+    Puts fn in place of the method called name, as in Db.get. fn takes
+    self first, as a method would.
+    \'\'\'
+    (cls, mname) = _owner(name)
+    if name not in d_saved:
+        d_saved[name] = cls.__dict__.get(mname)
+    setattr(cls, mname, fn)
+
+def unregister_all():
+    for (name, fn) in d_saved.items():
+        (cls, mname) = _owner(name)
+        if fn is None:
+            delattr(cls, mname)
+        else:
+            setattr(cls, mname, fn)
+    d_saved.clear()
+
+def fake(name, scale=1.0):
+    \'\'\'
+    A stand-in for the method called name. It takes the method's cost,
+    times scale, and returns a new object of its return type.
+    \'\'\'
+    (module, attr, mname, b_async, cost_ms, ret) = D_METHOD[name]
+    delay_s = (cost_ms or 0.0) * scale / 1000.0
+    if b_async:
+        async def fn(self, *args):
+            if delay_s:
+                await asyncio.sleep(delay_s)
+            return _new(ret)
+    else:
+        def fn(self, *args):
+            if delay_s:
+                time.sleep(delay_s)
+            return _new(ret)
+    return fn
+
+def install_fakes(lst_name=None, scale=1.0):
+    \'\'\'
+    Fakes the methods in lst_name, or all of them.
+    \'\'\'
+    if lst_name is None:
+        lst_name = list(D_METHOD.keys())
+    for name in lst_name:
+        register(name, fake(name, scale))
+
+
+# --------------------------------------------------------
+#   run
+# --------------------------------------------------------
+async def _one(flow_name, sem, t_arrive):
+    async with sem:
+        try:
+            await D_FLOW[flow_name]()
+        except Exception as e:
+            _REC.d_error[flow_name] = _REC.d_error.get(flow_name, 0) + 1
+            _REC.d_error_txt.setdefault(flow_name, repr(e))
+            return
+    _REC.flow(flow_name).record(time.perf_counter() - t_arrive)
+
+async def _arrivals(flow_name, rate, sem, duration_s, rnd, set_task):
+    t_start = time.perf_counter()
+    t_next = 0.0
+    while True:
+        t_next += rnd.expovariate(rate)
+        if t_next >= duration_s:
+            return
+        await asyncio.sleep(max(0.0, t_start + t_next - time.perf_counter()))
+        task = asyncio.ensure_future(_one(flow_name, sem, time.perf_counter()))
+        set_task.add(task)
+        task.add_done_callback(set_task.discard)
+
+async def _worker(lst_flow, idx, sem, t_end):
+    while time.perf_counter() < t_end:
+        flow_name = lst_flow[idx % len(lst_flow)]
+        idx += 1
+        await _one(flow_name, sem, time.perf_counter())
+
+async def run(d_rate=None, concurrency=100, duration_s=10.0, lst_flow=None,
+        seed=None):
+    \'\'\'
+    Runs the flows for duration_s, and returns the report. d_rate is flow
+    name vs arrivals per second. Without it, concurrency workers run the
+    flows in lst_flow, or all of them, back to back.
+    \'\'\'
+    global _REC
+    _REC = Recorder()
+    rnd = random.Random(seed)
+    sem = asyncio.Semaphore(concurrency)
+    t_start = time.perf_counter()
+    if d_rate:
+        set_task = set()
+        await asyncio.gather(*[
+            _arrivals(flow_name, rate, sem, duration_s, rnd, set_task)
+            for (flow_name, rate) in d_rate.items()])
+        if set_task:
+            await asyncio.gather(*list(set_task))
+    else:
+        if lst_flow is None:
+            lst_flow = list(D_FLOW.keys())
+        t_end = t_start + duration_s
+        await asyncio.gather(*[
+            _worker(lst_flow, idx, sem, t_end) for idx in range(concurrency)])
+    return _REC.report(time.perf_counter() - t_start)
+
+def _ms(value):
+    if value is None:
+        return '-'
+    return '%.3f'%(value)
+
+def print_report(report):
+    print('%-40s %8s %6s %9s %9s %9s %9s %9s'%(
+        'flow', 'count', 'errors', 'per s', 'mean ms', 'p50 ms', 'p99 ms',
+        'max ms'))
+    for (flow_name, d) in report['flows'].items():
+        print('%-40s %8d %6d %9.1f %9s %9s %9s %9s'%(
+            flow_name, d['count'], d['errors'], d['throughput_per_s'],
+            _ms(d['mean_ms']), _ms(d['p50_ms']), _ms(d['p99_ms']),
+            _ms(d['max_ms'])))
+    for (flow_name, d) in report['flows'].items():
+        if d['first_error'] is not None:
+            print('%s: first error, %s'%(flow_name, d['first_error']))
+    print('')
+    print('%-40s %8s %9s %9s %9s %9s  %s'%(
+        'flow', 'count', 'per s', 'mean ms', 'p50 ms', 'p99 ms', 'statement'))
+    for d in report['statements']:
+        print('%-40s %8d %9.1f %9s %9s %9s  %s'%(
+            d['flow'], d['count'], d['throughput_per_s'], _ms(d['mean_ms']),
+            _ms(d['p50_ms']), _ms(d['p99_ms']), d['statement']))
+
+def main(lst_arg=None):
+    parser = argparse.ArgumentParser(prog=__name__)
+    parser.add_argument('--rate', dest='lst_rate', action='append',
+        metavar='[FLOW=]PER_S', default=None,
+        help='Open loop arrivals per second. A rate with no flow applies '
+            'to all flows. Without any, workers run the flows back to back.')
+    parser.add_argument('--flow', dest='lst_flow', action='append',
+        metavar='FLOW', default=None,
+        help='Flow to run. Repeat for more. Default is all flows.')
+    parser.add_argument('--concurrency', type=int, default=100,
+        help='Most flows in flight at once, and the number of workers.')
+    parser.add_argument('--duration', type=float, default=10.0,
+        help='Seconds to run for.')
+    parser.add_argument('--fake', dest='lst_fake', action='append',
+        metavar='METHOD', default=None,
+        help='Fake this method, as in Db.get. Give * to fake them all.')
+    parser.add_argument('--fake-scale', type=float, default=1.0,
+        help='Multiplies the cost that fakes sleep for.')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--json', default=None,
+        help='Write the report here as JSON.')
+    ns_args = parser.parse_args(lst_arg)
+
+    lst_flow = ns_args.lst_flow
+    if lst_flow is None:
+        lst_flow = list(D_FLOW.keys())
+    for flow_name in lst_flow:
+        if flow_name not in D_FLOW:
+            parser.error('No flow %s'%(flow_name))
+    d_rate = {}
+    for s in ns_args.lst_rate or []:
+        (flow_name, sep, value) = s.rpartition('=')
+        if sep:
+            d_rate[flow_name] = float(value)
+        else:
+            for name in lst_flow:
+                d_rate.setdefault(name, float(value))
+    if ns_args.lst_fake is not None:
+        lst_fake = ns_args.lst_fake
+        if '*' in lst_fake:
+            lst_fake = None
+        for name in lst_fake or []:
+            if name not in D_METHOD:
+                parser.error('No method %s'%(name))
+        install_fakes(lst_fake, ns_args.fake_scale)
+
+    report = asyncio.run(run(
+        d_rate=d_rate,
+        concurrency=ns_args.concurrency,
+        duration_s=ns_args.duration,
+        lst_flow=lst_flow,
+        seed=ns_args.seed))
+    print_report(report)
+    if ns_args.json is not None:
+        f_ptr = open(ns_args.json, 'w')
+        json.dump(report, f_ptr, indent=1)
+        f_ptr.close()
+'''
+
+
+class HarnessGen:
+
+    def __init__(self, wandle_model):
+        self.wandle_model = wandle_model
+        self.py_gen = PyGen(wandle_model)
+        self.py_gen.timer = '_REC'
+        self.py_gen.fn_timer_key = self.__timer_key
+        # (flow name, statement text), indexed by timer key.
+        self.lst_statement = []
+
+    def __timer_key(self, wandle_function, idx):
+        statement = wandle_function.lst_statement[idx]
+        self.lst_statement.append(
+            (wandle_function.name, statement_txt(statement)))
+        return len(self.lst_statement) - 1
+
+    def __owners(self):
+        '''
+        Yields (qualified owner name, attribute in its module, owner,
+        container) for each class, generic and single in the package.
+        '''
+        wandle_model = self.wandle_model
+        for name in self.py_gen.d_module.keys():
+            if name in wandle_model.d_single:
+                wandle_single = wandle_model.d_single[name]
+                yield (name, '_%s'%(name), wandle_single,
+                    wandle_single.wandle_class)
+            elif name in wandle_model.d_generic:
+                wandle_generic = wandle_model.d_generic[name]
+                yield (name, name, wandle_generic, wandle_generic)
+            else:
+                wandle_class = wandle_model.d_specific[name]
+                yield (name, name, wandle_class, wandle_class)
+
+    def __ret(self, wandle_function):
+        cstring = wandle_function.rtype.name
+        gname = cstring.split('/', 1)[0]
+        if gname not in self.py_gen.d_module:
+            return None
+        module = self.py_gen.d_module[gname]
+        if gname in self.wandle_model.d_single:
+            return (module, gname, False)
+        return (module, gname, True)
+
+    def module(self):
+        self.wandle_model.check_all()
+        py_module = PyModule(HARNESS_MODULE)
+        py_module.header = 'Generated by wandle. Load driver for the flows.'
+        py_module.set_std_import.update([
+            'argparse', 'asyncio', 'importlib', 'json', 'math', 'random',
+            'sys', 'time'])
+
+        lst_driver = []
+        for wandle_flow in self.wandle_model.d_flow.values():
+            driver = PyModule(HARNESS_MODULE)
+            self.py_gen.function(
+                driver, 0, wandle_flow,
+                b_method=False,
+                fn_name=DRIVER_PREFIX + wandle_flow.name)
+            lst_driver.append(driver)
+            py_module.set_import.update(driver.set_import)
+
+        py_module.add(0, '# Timer key vs (flow, statement).')
+        py_module.add(0, 'LST_STATEMENT = [')
+        for (flow_name, txt) in self.lst_statement:
+            py_module.add(1, '(%r, %r),'%(flow_name, txt))
+        py_module.add(0, ']')
+        py_module.add(0, '')
+        for line in [
+                '# Qualified name vs (module, attribute, method, async,',
+                '# cost ms, return). return is (module, attribute, make',
+                '# a new one) or None.']:
+            py_module.add(0, line)
+        py_module.add(0, 'D_METHOD = {')
+        for (owner_name, attr, owner, container) in self.__owners():
+            for dd in (container.d_fab_async, container.d_fab_sync):
+                for wandle_function in dd.values():
+                    if wandle_function.compile_container is not owner:
+                        continue
+                    py_module.add(1, '%r: (%r, %r, %r, %r, %r, %r),'%(
+                        '%s.%s'%(owner_name, wandle_function.name),
+                        self.py_gen.d_module[owner_name],
+                        attr,
+                        wandle_function.name,
+                        wandle_function.b_is_async,
+                        wandle_function.cost_ms,
+                        self.__ret(wandle_function)))
+        py_module.add(0, '}')
+        for line in RUNTIME.split('\n'):
+            py_module.lst_line.append(line)
+
+        py_module.add(0, '')
+        py_module.add(0, '# ' + '-' * 56)
+        py_module.add(0, '#   flows')
+        py_module.add(0, '# ' + '-' * 56)
+        for driver in lst_driver:
+            py_module.lst_line.extend(driver.lst_line)
+            py_module.add(0, '')
+        py_module.add(0, '')
+        py_module.add(0, 'D_FLOW = {')
+        for wandle_flow in self.wandle_model.d_flow.values():
+            py_module.add(1, '%r: %s%s,'%(
+                wandle_flow.name, DRIVER_PREFIX, wandle_flow.name))
+        py_module.add(0, '}')
+        py_module.add(0, '')
+        py_module.add(0, '')
+        py_module.add(0, "if __name__ == '__main__':")
+        py_module.add(1, 'main(sys.argv[1:])')
+        return py_module
+
+
+def harness_write(wandle_model, package_dir):
+    '''
+    Writes the load driver into package_dir, which should hold a package
+    from pygen. Returns the path written.
+    '''
+    if not os.path.isdir(package_dir):
+        raise Exception("No package at %s. Run pygen first."%(package_dir))
+    py_module = HarnessGen(wandle_model).module()
+    path = os.path.join(package_dir, py_module.name + '.py')
+    f_ptr = open(path, 'w')
+    for line in py_module.lines():
+        f_ptr.write(line)
+        f_ptr.write('\n')
+    f_ptr.close()
+    return path
@@ -0,0 +1,510 @@
+#
+# Exports a built model as JSON, and loads it back.
+#
+# The format is JSON Lines: one record (a JSON object) per line. The schema
+# is in doc/json_export.txt. Records come in the order the loader needs
+# them: declarations, then members, then generic instantiations, then
+# bodies. The exporter writes each record as it goes, and the loader acts
+# on each record as it reads it, so neither holds the whole document.
+#
+# Loading does not parse any Wandle source. It replays the same steps as the
+# build (stub names, add members, derive classes from generics, inherit),
+# and then attaches the bodies as already-checked statements. The result is
+# a normal WandleModel. Queries, diffs and graphs work on it.
+#
+
+from .arpeggio_parse import LineTable
+from .wandle_model import CostDist
+from .wandle_model import Param
+from .wandle_model import Statement
+from .wandle_model import USE_FIELD
+from .wandle_model import WandleFunction
+from .wandle_model import WandleModel
+from .wandle_model import build_class_inheritance_hierarchy
+
+import json
+
+
+FORMAT_NAME = 'wandle'
+FORMAT_VERSION = 1
+
+REC_HEADER = 'header'
+REC_CLASS = 'class'
+REC_GENERIC = 'generic'
+REC_SINGLE = 'single'
+REC_ALIAS = 'alias'
+REC_FLOW = 'flow'
+REC_FIELD = 'field'
+REC_METHOD = 'method'
+REC_INSTANCE = 'instance'
+REC_BODY = 'body'
+
+OWNER_CLASS = 'class'
+OWNER_GENERIC = 'generic'
+OWNER_SINGLE = 'single'
+
+# Records belong to stages. The loader finishes each stage when it sees the
+# first record from a later one.
+STAGE_DECL = 0
+STAGE_MEMBER = 1
+STAGE_INSTANCE = 2
+STAGE_BODY = 3
+
+D_REC_STAGE = {
+    REC_HEADER: STAGE_DECL,
+    REC_CLASS: STAGE_DECL,
+    REC_GENERIC: STAGE_DECL,
+    REC_SINGLE: STAGE_DECL,
+    REC_ALIAS: STAGE_DECL,
+    REC_FLOW: STAGE_DECL,
+    REC_FIELD: STAGE_MEMBER,
+    REC_METHOD: STAGE_MEMBER,
+    REC_INSTANCE: STAGE_INSTANCE,
+    REC_BODY: STAGE_BODY,
+}
+
+
+# --------------------------------------------------------
+#   export
+# --------------------------------------------------------
+class JsonExporter:
+
+    def __init__(self, f_out, wandle_model, wandle_src=None):
+        self.f_out = f_out
+        self.wandle_model = wandle_model
+        self.line_table = None
+        if wandle_src != None:
+            self.line_table = LineTable(wandle_src)
+
+        # id(WandleFunction) vs the reference we write for it.
+        self.d_function_ref = {}
+
+    def write(self, d):
+        self.f_out.write(json.dumps(d, separators=(',', ':')))
+        self.f_out.write('\n')
+
+    def pos(self, position):
+        if position == None:
+            return None
+        d = {'offset': position}
+        if self.line_table != None:
+            (d['line'], d['col']) = self.line_table.linecol(position)
+        return d
+
+    def function_ref(self, wandle_function):
+        return self.d_function_ref[id(wandle_function)]
+
+    def __prep_function_refs(self):
+        # A method is referred to by a class that has it, and its name.
+        # Inherited methods are the same object in parent and child, so
+        # either will do on the way back in. Copies on classes derived from
+        # a generic are referred to by the derived class.
+        wandle_model = self.wandle_model
+        for (name, wandle_function) in wandle_model.d_flow.items():
+            self.d_function_ref[id(wandle_function)] = {'flow': name}
+        for (cname, wandle_class) in wandle_model.d_specific.items():
+            for d in (wandle_class.d_fab_sync, wandle_class.d_fab_async):
+                for (name, wandle_function) in d.items():
+                    if id(wandle_function) not in self.d_function_ref:
+                        self.d_function_ref[id(wandle_function)] = {
+                            'class': cname, 'name': name}
+        for (gname, wandle_generic) in wandle_model.d_generic.items():
+            for d in (wandle_generic.d_fab_sync, wandle_generic.d_fab_async):
+                for (name, wandle_function) in d.items():
+                    if id(wandle_function) not in self.d_function_ref:
+                        self.d_function_ref[id(wandle_function)] = {
+                            'generic': gname, 'name': name}
+
+    def __lst_declared_class(self):
+        lst = []
+        for (cname, wandle_class) in self.wandle_model.d_specific.items():
+            if cname == 'Void' or wandle_class.b_placeholder:
+                continue
+            if cname.startswith('Single|') or '/' in cname:
+                continue
+            lst.append(wandle_class)
+        return lst
+
+    def __write_members(self, owner_kind, owner_name, owner, wandle_class):
+        # Only what the owner declares. Inherited members are written
+        # against the class that declares them.
+        if owner_kind == OWNER_CLASS:
+            d_object = wandle_class.get_declared_objects()
+        else:
+            d_object = wandle_class.d_object
+        for (name, wandle_object) in d_object.items():
+            self.write({
+                'record': REC_FIELD,
+                'owner_kind': owner_kind,
+                'owner': owner_name,
+                'name': name,
+                'type': wandle_object.get_type(),
+                'ready': wandle_object.is_ready(),
+                'pos': self.pos(wandle_object.position),
+            })
+        for d in (wandle_class.d_fab_sync, wandle_class.d_fab_async):
+            for (name, wandle_function) in d.items():
+                if wandle_function.compile_container is not owner:
+                    continue
+                self.write({
+                    'record': REC_METHOD,
+                    'owner_kind': owner_kind,
+                    'owner': owner_name,
+                    'name': name,
+                    'async': wandle_function.is_async(),
+                    'rtype': wandle_function.rtype.name,
+                    'cost_ms': wandle_function.cost_ms,
+                    'cost': self.cost_as_dict(wandle_function.cost_dist),
+                    'effects': list(wandle_function.lst_effect),
+                    'params': [
+                        {
+                            'name': param.name,
+                            'type': param.wandle_class.name,
+                            'pos': self.pos(param.position),
+                        }
+                        for param in wandle_function.lst_param],
+                    'pos': self.pos(wandle_function.position),
+                })
+
+    def cost_as_dict(self, cost_dist):
+        if cost_dist == None:
+            return None
+        d = {'kind': cost_dist.kind}
+        if cost_dist.value_ms != None:
+            d['value_ms'] = cost_dist.value_ms
+        if cost_dist.sigma != None:
+            d['sigma'] = cost_dist.sigma
+        if cost_dist.lst_bin != None:
+            d['bins'] = [list(b) for b in cost_dist.lst_bin]
+        return d
+
+    def statement_as_dict(self, statement):
+        lhs = statement.lhs_dotref
+        if lhs != None and type(lhs) != str:
+            lhs = list(lhs)
+        rhs = statement.rhs_dotref
+        if rhs != None:
+            rhs = list(rhs)
+        d = {
+            'stype': statement.stype,
+            'type': None,
+            'lhs': lhs,
+            'rhs': rhs,
+            'args': [list(p) for p in statement.lst_rhs_param],
+            'txt': statement.txt,
+            'callee': None,
+            'pos': self.pos(statement.position),
+        }
+        if statement.wandle_class != None:
+            d['type'] = statement.wandle_class.name
+        if statement.wandle_function != None:
+            d['callee'] = self.function_ref(statement.wandle_function)
+        return d
+
+    def export(self):
+        wandle_model = self.wandle_model
+        wandle_model.check_all()
+        self.__prep_function_refs()
+
+        self.write({
+            'record': REC_HEADER,
+            'format': FORMAT_NAME,
+            'version': FORMAT_VERSION,
+        })
+
+        # Declarations
+        lst_class = self.__lst_declared_class()
+        for wandle_class in lst_class:
+            self.write({
+                'record': REC_CLASS,
+                'name': wandle_class.name,
+                'inherits': list(wandle_class.lst_inherits_from),
+                'layout': wandle_class.layout,
+                'pos': self.pos(wandle_class.position),
+            })
+        for wandle_generic in wandle_model.d_generic.values():
+            self.write({
+                'record': REC_GENERIC,
+                'name': wandle_generic.name,
+                'template_types': list(wandle_generic.lst_template_type),
+                'layout': wandle_generic.layout,
+                'pos': self.pos(wandle_generic.position),
+            })
+        for wandle_single in wandle_model.d_single.values():
+            self.write({
+                'record': REC_SINGLE,
+                'name': wandle_single.name,
+                'pos': self.pos(wandle_single.position),
+            })
+        for (name, tstring) in wandle_model.d_alias.items():
+            self.write({
+                'record': REC_ALIAS,
+                'name': name,
+                'type': tstring,
+                'pos': self.pos(wandle_model.d_alias_position.get(name)),
+            })
+        for wandle_function in wandle_model.d_flow.values():
+            self.write({
+                'record': REC_FLOW,
+                'name': wandle_function.name,
+                'budget_ms': wandle_function.budget_ms,
+                'pos': self.pos(wandle_function.position),
+            })
+
+        # Members
+        for wandle_class in lst_class:
+            self.__write_members(
+                owner_kind=OWNER_CLASS,
+                owner_name=wandle_class.name,
+                owner=wandle_class,
+                wandle_class=wandle_class)
+        for wandle_generic in wandle_model.d_generic.values():
+            self.__write_members(
+                owner_kind=OWNER_GENERIC,
+                owner_name=wandle_generic.name,
+                owner=wandle_generic,
+                wandle_class=wandle_generic)
+        for wandle_single in wandle_model.d_single.values():
+            self.__write_members(
+                owner_kind=OWNER_SINGLE,
+                owner_name=wandle_single.name,
+                owner=wandle_single,
+                wandle_class=wandle_single.wandle_class)
+
+        # Generic instantiations
+        for (cname, wandle_class) in wandle_model.d_specific.items():
+            if '/' not in cname:
+                continue
+            (gname, s_args) = cname.split('/', 1)
+            self.write({
+                'record': REC_INSTANCE,
+                'name': cname,
+                'generic': gname,
+                'args': s_args.split(','),
+            })
+
+        # Bodies, in source order
+        for wandle_function in wandle_model.lst_function_body:
+            self.write({
+                'record': REC_BODY,
+                'function': self.function_ref(wandle_function),
+                'statements': [
+                    self.statement_as_dict(statement)
+                    for statement in wandle_function.lst_statement],
+                'return': wandle_function.return_dotref,
+            })
+
+def json_export(f_out, wandle_model, wandle_src=None):
+    '''
+    Writes the model to f_out, one record per line. If wandle_src is given,
+    positions also carry a line and column.
+    '''
+    JsonExporter(
+        f_out=f_out,
+        wandle_model=wandle_model,
+        wandle_src=wandle_src).export()
+
+
+# --------------------------------------------------------
+#   load
+# --------------------------------------------------------
+class JsonLoader:
+
+    def __init__(self, wandle_model):
+        self.wandle_model = wandle_model
+        self.stage = STAGE_DECL
+        self.b_header = False
+
+    def __offset(self, pos):
+        if pos == None:
+            return None
+        return pos['offset']
+
+    def __get_class(self, cstring):
+        wandle_class = self.wandle_model.get_class(cstring=cstring)
+        if wandle_class == None:
+            raise Exception("Unknown type %s."%(cstring))
+        return wandle_class
+
+    def __get_owner(self, d):
+        wandle_model = self.wandle_model
+        owner_kind = d['owner_kind']
+        if owner_kind == OWNER_CLASS:
+            return wandle_model.d_specific[d['owner']]
+        elif owner_kind == OWNER_GENERIC:
+            return wandle_model.d_generic[d['owner']]
+        elif owner_kind == OWNER_SINGLE:
+            return wandle_model.d_single[d['owner']]
+        raise Exception("Unknown owner_kind %s."%(owner_kind))
+
+    def __get_function(self, ref):
+        wandle_model = self.wandle_model
+        if 'flow' in ref:
+            return wandle_model.d_flow[ref['flow']]
+        if 'class' in ref:
+            owner = wandle_model.get_class(cstring=ref['class'])
+        else:
+            owner = wandle_model.d_generic[ref['generic']]
+        name = ref['name']
+        if name in owner.d_fab_sync:
+            return owner.d_fab_sync[name]
+        return owner.d_fab_async[name]
+
+    def __advance(self, stage):
+        '''
+        Runs the build steps that sit between the stage we were in and
+        the one we are moving to.
+        '''
+        wandle_model = self.wandle_model
+        while self.stage < stage:
+            if self.stage == STAGE_DECL:
+                wandle_model.validate_alias_entries()
+            elif self.stage == STAGE_INSTANCE:
+                wandle_model.populate_specific_classes_derived_from_generics()
+                build_class_inheritance_hierarchy(wandle_model)
+            self.stage += 1
+
+    def load_record(self, d):
+        rec = d['record']
+        if rec not in D_REC_STAGE:
+            raise Exception("Unknown record %s."%(rec))
+        if rec != REC_HEADER and not self.b_header:
+            raise Exception("Missing header record.")
+        stage = D_REC_STAGE[rec]
+        if stage < self.stage:
+            raise Exception("Record %s is out of order."%(rec))
+        self.__advance(stage)
+
+        wandle_model = self.wandle_model
+        if rec == REC_HEADER:
+            if d['format'] != FORMAT_NAME:
+                raise Exception("Not a wandle export (%s)."%(d['format']))
+            if d['version'] != FORMAT_VERSION:
+                raise Exception("Unsupported version %s."%(d['version']))
+            self.b_header = True
+        elif rec == REC_CLASS:
+            wandle_model.stub_specific(
+                name=d['name'],
+                position=self.__offset(d['pos']))
+            wandle_class = wandle_model.d_specific[d['name']]
+            for cname in d['inherits']:
+                wandle_class.add_inherits_from(cname)
+            if d.get('layout') != None:
+                wandle_class.set_layout(d['layout'])
+        elif rec == REC_GENERIC:
+            for name in d['template_types']:
+                wandle_model.stub_specific(name=name, b_placeholder=True)
+            wandle_model.stub_generic(
+                name=d['name'],
+                lst_template_type=list(d['template_types']),
+                position=self.__offset(d['pos']))
+            if d.get('layout') != None:
+                wandle_model.d_generic[d['name']].set_layout(d['layout'])
+        elif rec == REC_SINGLE:
+            wandle_model.stub_single(
+                name=d['name'],
+                position=self.__offset(d['pos']))
+        elif rec == REC_ALIAS:
+            wandle_model.set_alias(
+                name=d['name'],
+                tstring=d['type'],
+                position=self.__offset(d['pos']))
+        elif rec == REC_FLOW:
+            wandle_model.stub_flow(
+                name=d['name'],
+                position=self.__offset(d['pos']),
+                budget_ms=d.get('budget_ms'))
+        elif rec == REC_FIELD:
+            owner = self.__get_owner(d)
+            wandle_class = self.__get_class(d['type'])
+            wandle_object = wandle_class.as_wandle_object()
+            wandle_object.position = self.__offset(d['pos'])
+            if d['ready']:
+                wandle_object.mark_ready()
+            owner.set_object(
+                name=d['name'],
+                wandle_object=wandle_object)
+            wandle_model.wandle_index.add_type_use(
+                cstring=wandle_class.name,
+                kind=USE_FIELD,
+                where='%s.%s'%(owner.name, d['name']),
+                position=wandle_object.position)
+        elif rec == REC_METHOD:
+            owner = self.__get_owner(d)
+            lst_param = []
+            for d_param in d['params']:
+                param = Param(
+                    wandle_class=self.__get_class(d_param['type']),
+                    name=d_param['name'])
+                param.position = self.__offset(d_param['pos'])
+                lst_param.append(param)
+            wandle_function = WandleFunction(
+                compile_container=owner,
+                b_is_async=d['async'],
+                rtype=self.__get_class(d['rtype']),
+                name=d['name'],
+                lst_param=lst_param)
+            wandle_function.position = self.__offset(d['pos'])
+            d_cost = d.get('cost')
+            if d_cost != None:
+                lst_bin = None
+                if 'bins' in d_cost:
+                    lst_bin = [tuple(b) for b in d_cost['bins']]
+                wandle_function.set_cost(CostDist(
+                    kind=d_cost['kind'],
+                    value_ms=d_cost.get('value_ms'),
+                    sigma=d_cost.get('sigma'),
+                    lst_bin=lst_bin))
+            wandle_function.set_effects(d.get('effects', []))
+            wandle_model.wandle_index.add_signature(wandle_function)
+            if d['async']:
+                owner.set_fab_async(
+                    name=d['name'],
+                    wandle_function=wandle_function)
+            else:
+                owner.set_fab_sync(
+                    name=d['name'],
+                    wandle_function=wandle_function)
+        elif rec == REC_INSTANCE:
+            self.__get_class(d['name'])
+        elif rec == REC_BODY:
+            lst_statement = []
+            for d_statement in d['statements']:
+                statement = Statement(d_statement['stype'])
+                if d_statement['type'] != None:
+                    statement.wandle_class = self.__get_class(
+                        d_statement['type'])
+                statement.lhs_dotref = d_statement['lhs']
+                statement.rhs_dotref = d_statement['rhs']
+                statement.lst_rhs_param = d_statement['args']
+                statement.txt = d_statement['txt']
+                statement.position = self.__offset(d_statement['pos'])
+                if d_statement['callee'] != None:
+                    statement.wandle_function = self.__get_function(
+                        d_statement['callee'])
+                lst_statement.append(statement)
+            wandle_function = self.__get_function(d['function'])
+            wandle_model.add_checked_body(
+                wandle_function=wandle_function,
+                lst_statement=lst_statement)
+            wandle_function.return_dotref = d.get('return')
+
+    def finish(self):
+        if not self.b_header:
+            raise Exception("Missing header record.")
+        self.__advance(STAGE_BODY)
+        return self.wandle_model
+
+def json_load(f_in, b_print_diagnostic=True):
+    '''
+    Reads an export written by json_export, and returns a WandleModel. The
+    model's bodies are already checked.
+    '''
+    json_loader = JsonLoader(
+        wandle_model=WandleModel(
+            b_print_diagnostic=b_print_diagnostic))
+    for line in f_in:
+        if not line.strip():
+            continue
+        json_loader.load_record(json.loads(line))
+    return json_loader.finish()
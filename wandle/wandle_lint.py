@@ -0,0 +1,365 @@
+#
+# Lints over checked models. Each lint returns a list of Finding, and does
+# not change the model.
+#
+# serialized_async
+#
+#     An async send (<<) that waits behind sync calls it does not depend on.
+#     Sends cost the sender nothing, so the earliest a send can go is
+#     straight after the last statement it depends on (see DataFlow). Any
+#     sync call between there and the send only holds it up. We work out
+#     how late the send starts, and how much sooner the body would be done
+#     if it were moved up, using the static costs (see function_latency).
+#     A var declaration the send depends on costs nothing, and can move up
+#     with it, so it does not hold the send back.
+#
+# loop_blocking
+#
+#     Blocking work on the event loop. Flows and async methods run on the
+#     loop, and so does every sync method they call, and every sync method
+#     those call in turn. A sync method with an effect (io, net or cpu)
+#     blocks the loop for as long as it runs. An async method can await its
+#     io and net, but cpu work blocks the loop wherever it is. We follow
+#     the sync calls from every flow and async method, breadth first, and
+#     report the shortest chain to each blocking method that is reached,
+#     with the cost of that work. Async sends are not followed, since their
+#     callee is a root of its own. Recursion is skipped.
+#
+
+from .wandle_model import EFFECT_CPU
+from .wandle_model import STYPE_ASYNC_LHS_RHS
+from .wandle_model import STYPE_SYNC_VAR_NUL
+from .wandle_model import STYPE_SYNC_VAR_VAL
+from .wandle_model import function_latency
+
+
+LINT_LOOP_BLOCKING = 'loop_blocking'
+LINT_SERIALIZED_ASYNC = 'serialized_async'
+
+
+class Finding:
+
+    def __init__(self, lint, wandle_function, statement, message):
+        self.lint = lint
+        self.wandle_function = wandle_function
+        self.statement = statement
+        self.message = message
+        # Estimated time saved, in ms, where the lint can tell.
+        self.saved_ms = 0.0
+
+    def __repr__(self):
+        return '<Finding %s %s>'%(self.lint, self.message)
+
+    def get_position(self):
+        if self.statement != None and self.statement.position != None:
+            return self.statement.position
+        return self.wandle_function.position
+
+    def as_dict(self):
+        return {
+            'lint': self.lint,
+            'function': self.wandle_function.get_qualified_name(),
+            'message': self.message,
+            'saved_ms': self.saved_ms,
+        }
+
+
+def statement_txt(statement):
+    if statement.stype == STYPE_SYNC_VAR_NUL:
+        return '%s %s;'%(statement.wandle_class.name, statement.lhs_dotref)
+    if statement.stype == STYPE_SYNC_VAR_VAL:
+        return '%s %s!'%(statement.wandle_class.name, statement.lhs_dotref)
+    if statement.wandle_function == None:
+        return '%s = %s;'%(
+            '.'.join(statement.lhs_dotref), '.'.join(statement.rhs_dotref))
+    op = '='
+    if statement.stype == STYPE_ASYNC_LHS_RHS:
+        op = '<<'
+    return '%s %s %s(%s);'%(
+        '.'.join(statement.lhs_dotref),
+        op,
+        '.'.join(statement.rhs_dotref),
+        ', '.join(['.'.join(p) for p in statement.lst_rhs_param]))
+
+def is_declaration(statement):
+    return statement.stype in (STYPE_SYNC_VAR_NUL, STYPE_SYNC_VAR_VAL)
+
+def hoist_split(dataflow, lst_pred):
+    '''
+    Follows lst_pred back through declarations. Returns (anchor, lst_hoist),
+    where anchor is the index of the last statement reached that is not a
+    declaration, or None, and lst_hoist has the indexes of the declarations
+    passed through, in source order.
+    '''
+    lst_statement = dataflow.lst_statement
+    anchor = None
+    set_hoist = set()
+    lst_todo = list(lst_pred)
+    while lst_todo:
+        pred = lst_todo.pop()
+        if not is_declaration(lst_statement[pred]):
+            if anchor == None or pred > anchor:
+                anchor = pred
+            continue
+        if pred in set_hoist:
+            continue
+        set_hoist.add(pred)
+        lst_todo.extend(dataflow.get_preds(pred))
+    return (anchor, sorted(set_hoist))
+
+def lint_serialized_async_function(wandle_function, d_memo):
+    '''
+    Findings for one body. d_memo is as for function_latency.
+    '''
+    dataflow = wandle_function.get_dataflow()
+    lst_statement = dataflow.lst_statement
+
+    # Sequential timeline of the body as written. t_start and t_end are when
+    # each statement starts and returns, and lst_done is when the work it
+    # started has finished.
+    t = wandle_function.cost_ms or 0.0
+    t_own = t
+    lst_start = []
+    lst_end = []
+    lst_sub_done = []
+    for statement in lst_statement:
+        lst_start.append(t)
+        callee = statement.wandle_function
+        sub_ret = 0.0
+        sub_done = 0.0
+        if callee != None:
+            latency = function_latency(
+                wandle_function=callee,
+                d_memo=d_memo)
+            sub_ret = latency.ret_ms
+            sub_done = latency.done_ms
+        if statement.stype != STYPE_ASYNC_LHS_RHS:
+            t += sub_ret
+        lst_end.append(t)
+        lst_sub_done.append(sub_done)
+    lst_done = [lst_start[i] + lst_sub_done[i] for i in range(len(lst_statement))]
+    done_ms = max([t_own] + lst_done)
+
+    # A var declaration costs nothing, and can move up with the send that
+    # uses it. So it is ready as soon as its own preds are, wherever it was
+    # written. Everything else is ready where it returns.
+    lst_ready = []
+    for (idx, statement) in enumerate(lst_statement):
+        if is_declaration(statement):
+            lst_ready.append(max([t_own] + [
+                lst_ready[pred] for pred in dataflow.get_preds(idx)]))
+        else:
+            lst_ready.append(lst_end[idx])
+
+    lst_finding = []
+    for (idx, statement) in enumerate(lst_statement):
+        if statement.stype != STYPE_ASYNC_LHS_RHS:
+            continue
+        lst_pred = dataflow.get_preds(idx)
+        earliest = t_own
+        for pred in lst_pred:
+            earliest = max(earliest, lst_ready[pred])
+        late_ms = lst_start[idx] - earliest
+        if late_ms <= 0:
+            continue
+
+        # The send goes after the last statement it depends on that is not
+        # a declaration. Declarations it depends on that come after the
+        # first blocking call move up with it.
+        (anchor, lst_decl) = hoist_split(dataflow, lst_pred)
+        first = 0
+        if anchor != None:
+            first = anchor + 1
+        lst_blocking = []
+        first_blocking = idx
+        for j in range(first, idx):
+            other = lst_statement[j]
+            if other.wandle_function == None:
+                continue
+            if other.stype == STYPE_ASYNC_LHS_RHS:
+                continue
+            if lst_end[j] > lst_start[j]:
+                lst_blocking.append(other.wandle_function.get_qualified_name())
+                first_blocking = min(first_blocking, j)
+
+        lst_done_new = list(lst_done)
+        lst_done_new[idx] = earliest + lst_sub_done[idx]
+        saved_ms = done_ms - max([t_own] + lst_done_new)
+
+        lst_stay = [j for j in lst_decl if j < first_blocking]
+        if anchor != None:
+            lst_stay.append(anchor)
+        lst_move = [j for j in lst_decl if j > first_blocking]
+        if lst_stay:
+            s_where = "straight after '%s'"%(
+                statement_txt(lst_statement[max(lst_stay)]))
+        else:
+            s_where = 'first'
+        s_move = ''
+        if lst_move:
+            s_move = ' Move %s up with it.'%(', '.join([
+                "'%s'"%(statement_txt(lst_statement[j]))
+                for j in lst_move]))
+        finding = Finding(
+            lint=LINT_SERIALIZED_ASYNC,
+            wandle_function=wandle_function,
+            statement=statement,
+            message=' '.join([
+                "Async send '%s' waits %gms behind %s,"%(
+                    statement_txt(statement),
+                    late_ms,
+                    ', '.join(lst_blocking)),
+                "which it does not depend on.",
+                "It could go %s.%s"%(s_where, s_move),
+                "Saves %gms."%(saved_ms),
+            ]))
+        finding.saved_ms = saved_ms
+        lst_finding.append(finding)
+    return lst_finding
+
+def lint_serialized_async(wandle_model):
+    '''
+    Runs lint_serialized_async_function over every body in the model.
+    Findings that save the most come first.
+    '''
+    wandle_model.check_all()
+    d_memo = {}
+    lst_finding = []
+    for wandle_function in wandle_model.get_functions().values():
+        if not wandle_function.has_body():
+            continue
+        lst_finding.extend(lint_serialized_async_function(
+            wandle_function=wandle_function,
+            d_memo=d_memo))
+    lst_finding.sort(key=lambda f: -f.saved_ms)
+    return lst_finding
+
+
+def blocking_effects(wandle_function):
+    '''
+    The effects of wandle_function that hold up the event loop it runs on.
+    '''
+    if wandle_function.is_async():
+        return [e for e in wandle_function.lst_effect if e == EFFECT_CPU]
+    return list(wandle_function.lst_effect)
+
+def _sync_calls(wandle_function, d_memo):
+    '''
+    The sync calls in the body of wandle_function, as a list of (statement,
+    callee), in source order. d_memo is id(WandleFunction) vs that list.
+    '''
+    key = id(wandle_function)
+    if key not in d_memo:
+        d_memo[key] = [
+            (statement, statement.wandle_function)
+            for statement in wandle_function.lst_statement
+            if statement.wandle_function != None
+            and statement.stype != STYPE_ASYNC_LHS_RHS]
+    return d_memo[key]
+
+def _sync_chains(wandle_function, d_memo):
+    '''
+    The shortest chain of sync calls from the body of wandle_function to
+    each method with blocking effects that it reaches, as a list of
+    (statement, chain). statement is the call in this body that starts the
+    chain, and chain is the tuple of functions called, from there on.
+
+    This is a breadth-first search, so each function is visited once, and
+    where there is more than one shortest chain, we take the one whose
+    calls come first in source order. Chains are in the order that their
+    blocking method was reached. d_memo is as for _sync_calls.
+    '''
+    # id(WandleFunction) vs (statement, chain), for each function reached.
+    d_reached = {id(wandle_function): (None, ())}
+    lst_chain = []
+    lst_queue = [wandle_function]
+    for caller in lst_queue:
+        (first_statement, chain) = d_reached[id(caller)]
+        for (statement, callee) in _sync_calls(caller, d_memo):
+            if id(callee) in d_reached:
+                continue
+            if first_statement == None:
+                entry = (statement, (callee,))
+            else:
+                entry = (first_statement, chain + (callee,))
+            d_reached[id(callee)] = entry
+            lst_queue.append(callee)
+            if blocking_effects(callee):
+                lst_chain.append(entry)
+    return lst_chain
+
+def lint_loop_blocking_function(wandle_function, d_memo):
+    '''
+    Findings for one flow or async method. d_memo is as for _sync_calls.
+    '''
+    qname = wandle_function.get_qualified_name()
+    lst_finding = []
+    lst_effect = blocking_effects(wandle_function)
+    if lst_effect:
+        finding = Finding(
+            lint=LINT_LOOP_BLOCKING,
+            wandle_function=wandle_function,
+            statement=None,
+            message=' '.join([
+                "Async %s (%s) runs on the event loop,"%(
+                    qname, ', '.join(lst_effect)),
+                "and blocks it for %gms a call."%(
+                    wandle_function.cost_ms or 0.0),
+            ]))
+        finding.saved_ms = wandle_function.cost_ms or 0.0
+        lst_finding.append(finding)
+
+    for (statement, chain) in _sync_chains(wandle_function, d_memo):
+        blocker = chain[-1]
+        blocked_ms = blocker.cost_ms or 0.0
+        finding = Finding(
+            lint=LINT_LOOP_BLOCKING,
+            wandle_function=wandle_function,
+            statement=statement,
+            message=' '.join([
+                "Sync %s (%s) runs on the event loop:"%(
+                    blocker.get_qualified_name(),
+                    ', '.join(blocking_effects(blocker))),
+                "%s."%(' -> '.join(
+                    [qname] + [f.get_qualified_name() for f in chain])),
+                "Blocks it for %gms a call."%(blocked_ms),
+            ]))
+        finding.saved_ms = blocked_ms
+        lst_finding.append(finding)
+    return lst_finding
+
+def lint_loop_blocking(wandle_model):
+    '''
+    Runs lint_loop_blocking_function over every flow and async method.
+    Findings that block the loop longest come first.
+    '''
+    wandle_model.check_all()
+    d_memo = {}
+    lst_finding = []
+    for wandle_function in wandle_model.get_functions().values():
+        if not (wandle_function.is_flow() or wandle_function.is_async()):
+            continue
+        lst_finding.extend(lint_loop_blocking_function(
+            wandle_function=wandle_function,
+            d_memo=d_memo))
+    lst_finding.sort(key=lambda f: -f.saved_ms)
+    return lst_finding
+
+
+D_LINT = {
+    LINT_LOOP_BLOCKING: lint_loop_blocking,
+    LINT_SERIALIZED_ASYNC: lint_serialized_async,
+}
+
+def lint_run(wandle_model, lst_lint=None):
+    '''
+    Runs the lints named in lst_lint, or all of them.
+    '''
+    if lst_lint == None:
+        lst_lint = sorted(D_LINT.keys())
+    lst_finding = []
+    for lint in lst_lint:
+        if lint not in D_LINT:
+            raise Exception("No lint called %s"%(lint))
+        lst_finding.extend(D_LINT[lint](wandle_model))
+    return lst_finding
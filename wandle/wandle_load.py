@@ -0,0 +1,184 @@
+#
+# Analytic load report. A quick answer before running a simulation.
+#
+# Given arrival rates per flow, we push rates down the call graph: each call
+# site passes on its caller's rate, so a method's rate is the sum over its
+# call sites. Rates from all the flows are pushed together, in one pass over
+# the functions in topological order. Recursive calls are skipped, as in
+# the static latency analysis.
+#
+# Resources are as in wandle_sim: each single, and with b_instances each
+# class. A call holds its resource for the function's return time
+# (function_latency ret_ms), which is its own mean cost plus its sync calls.
+# Each resource is then treated as an M/M/c queue. Offered load is
+# a = rate * mean hold time, in erlangs. Utilization is a / c. The chance
+# that a call has to wait is Erlang C, and the mean wait is
+#
+#     Wq = C(c, a) * S / (c - a)
+#
+# where S is the mean hold time. At or past a = c the queue grows without
+# bound. The hold time does not include waits on other resources, so nested
+# resources make this an underestimate.
+#
+
+from .wandle_model import function_latency
+from .wandle_sim import resource_name
+
+
+def erlang_c(servers, offered):
+    '''
+    Probability that an arrival has to wait, in an M/M/c queue with
+    servers servers and offered load in erlangs. Returns 1.0 when the
+    queue is saturated.
+    '''
+    if offered <= 0:
+        return 0.0
+    if offered >= servers:
+        return 1.0
+    # Erlang B by recurrence, which stays stable for large c.
+    b = 1.0
+    for k in range(1, servers + 1):
+        b = offered * b / (k + offered * b)
+    rho = offered / servers
+    return b / (1.0 - rho * (1.0 - b))
+
+def _is_resource(wandle_model, name, b_instances):
+    if name in wandle_model.d_single:
+        return True
+    return b_instances and name in wandle_model.d_specific
+
+def _topological_order(lst_root):
+    '''
+    Functions reachable from lst_root, callers before callees. Back edges
+    (recursion) are dropped. Returns (lst_function, set_back_edge), where
+    set_back_edge holds (id(caller), idx_statement).
+    '''
+    lst_post = []
+    set_back_edge = set()
+    # id vs 1 while on the stack, 2 when done.
+    d_state = {}
+    for root in lst_root:
+        if id(root) in d_state:
+            continue
+        d_state[id(root)] = 1
+        lst_todo = [(root, 0)]
+        while lst_todo:
+            (wandle_function, idx) = lst_todo.pop()
+            lst_statement = wandle_function.lst_statement
+            while idx < len(lst_statement):
+                callee = lst_statement[idx].wandle_function
+                if callee != None:
+                    state = d_state.get(id(callee))
+                    if state == 1:
+                        set_back_edge.add((id(wandle_function), idx))
+                    elif state == None:
+                        break
+                idx += 1
+            if idx < len(lst_statement):
+                lst_todo.append((wandle_function, idx + 1))
+                d_state[id(callee)] = 1
+                lst_todo.append((callee, 0))
+                continue
+            d_state[id(wandle_function)] = 2
+            lst_post.append(wandle_function)
+    lst_post.reverse()
+    return (lst_post, set_back_edge)
+
+
+def load_analyze(wandle_model, d_rate, d_servers=None, b_instances=False):
+    '''
+    d_rate is flow name vs arrivals per second. Returns a dict with
+    'methods', a list with the rate and demand of each function that is
+    called, and 'resources', a list of queueing figures for each resource
+    that is used. Both are ranked, busiest first.
+    '''
+    wandle_model.check_all()
+    if d_servers == None:
+        d_servers = {}
+
+    lst_root = []
+    for (flow_name, rate) in d_rate.items():
+        if flow_name not in wandle_model.d_flow:
+            raise Exception("No flow exists called %s"%(flow_name))
+        lst_root.append(wandle_model.d_flow[flow_name])
+    (lst_function, set_back_edge) = _topological_order(lst_root)
+
+    # id vs calls per second
+    d_fn_rate = {}
+    for (flow_name, rate) in d_rate.items():
+        key = id(wandle_model.d_flow[flow_name])
+        d_fn_rate[key] = d_fn_rate.get(key, 0.0) + rate
+    for wandle_function in lst_function:
+        rate = d_fn_rate.get(id(wandle_function), 0.0)
+        for (idx, statement) in enumerate(wandle_function.lst_statement):
+            callee = statement.wandle_function
+            if callee == None:
+                continue
+            if (id(wandle_function), idx) in set_back_edge:
+                continue
+            d_fn_rate[id(callee)] = d_fn_rate.get(id(callee), 0.0) + rate
+
+    d_memo = {}
+    lst_method = []
+    # name vs [rate, busy ms per second]
+    d_resource = {}
+    for wandle_function in lst_function:
+        if wandle_function.is_flow():
+            continue
+        rate = d_fn_rate.get(id(wandle_function), 0.0)
+        hold_ms = function_latency(
+            wandle_function=wandle_function,
+            d_memo=d_memo).ret_ms
+        cost_ms = wandle_function.cost_ms or 0.0
+        name = resource_name(wandle_function, b_instances)
+        lst_method.append({
+            'method': wandle_function.get_qualified_name(),
+            'resource': name,
+            'rate_per_s': rate,
+            'cost_ms': cost_ms,
+            # ms of the method's own work per second of wall time. 1000 is
+            # one core kept busy.
+            'demand_ms_per_s': rate * cost_ms,
+        })
+        if name != None:
+            entry = d_resource.setdefault(name, [0.0, 0.0])
+            entry[0] += rate
+            entry[1] += rate * hold_ms
+
+    lst_resource = []
+    for (name, (rate, busy_ms_per_s)) in d_resource.items():
+        servers = d_servers.get(name, 1)
+        offered = busy_ms_per_s / 1000.0
+        hold_ms = 0.0
+        if rate > 0:
+            hold_ms = busy_ms_per_s / rate
+        b_saturated = offered >= servers
+        p_wait = erlang_c(servers, offered)
+        wait_ms = None
+        if not b_saturated:
+            wait_ms = p_wait * hold_ms / (servers - offered)
+        saturation = None
+        if hold_ms > 0:
+            saturation = servers * 1000.0 / hold_ms
+        lst_resource.append({
+            'resource': name,
+            'servers': servers,
+            'rate_per_s': rate,
+            'hold_ms': hold_ms,
+            'offered_erlang': offered,
+            'utilization': offered / servers,
+            'p_wait': p_wait,
+            'mean_wait_ms': wait_ms,
+            'saturated': b_saturated,
+            'saturation_per_s': saturation,
+        })
+    for name in d_servers.keys():
+        if not _is_resource(wandle_model, name, b_instances):
+            raise Exception("No resource %s"%(name))
+
+    lst_method.sort(key=lambda d: -d['demand_ms_per_s'])
+    lst_resource.sort(key=lambda d: -d['utilization'])
+    return {
+        'methods': lst_method,
+        'resources': lst_resource,
+    }
@@ -4,7 +4,9 @@
 #
 
 import copy
+import math
 from pprint import pprint
+from types import MappingProxyType
 
 
 class SyntaxError(Exception):
@@ -13,6 +15,63 @@ class SyntaxError(Exception):
         self.message = message
         
 
+class BuildError(Exception):
+    # An error in the model source. position is a character offset into
+    # the source, where we know it.
+
+    def __init__(self, message, position=None):
+        Exception.__init__(self, message)
+        self.message = message
+        self.position = position
+
+def _node_text(node):
+    '''
+    The source text of a parse node, with its tokens spaced out.
+    '''
+    if isinstance(node, list):
+        return ' '.join([_node_text(sub) for sub in node])
+    return node.value
+
+def _at_node(fn, node):
+    '''
+    Calls fn(node). A plain Exception from it comes out as a BuildError at
+    node. Errors of other types are left alone.
+    '''
+    try:
+        fn(node)
+    except Exception as e:
+        if type(e) != Exception:
+            raise
+        raise BuildError(str(e), node.position)
+        
+
+# --------------------------------------------------------
+#   diagnostic
+# --------------------------------------------------------
+SEVERITY_ERROR = 'error'
+
+class Diagnostic:
+    # Something the compiler wants to tell the user. The model collects
+    # these rather than printing them, so that callers that embed wandle can
+    # decide what to do with them. position is a character offset into the
+    # source, where we know it.
+
+    def __init__(self, severity, message, position=None):
+        self.severity = severity
+        self.message = message
+        self.position = position
+
+    def __repr__(self):
+        return '<Diagnostic %s %s>'%(self.severity, self.message)
+
+    def as_dict(self):
+        return {
+            'severity': self.severity,
+            'message': self.message,
+            'position': self.position,
+        }
+
+
 # --------------------------------------------------------
 #   param
 # --------------------------------------------------------
@@ -23,6 +82,7 @@ class Param:
         self.name = name
 
         self.wtype = self.__class__.__name__
+        self.position = None
 
     def __repr__(self):
         return '%s %s'%(self.wandle_class.name, self.name)
@@ -31,6 +91,43 @@ class Param:
         return self.wandle_class.name
 
 
+# --------------------------------------------------------
+#   layout
+# --------------------------------------------------------
+# Wire layouts that a stub class can declare, vs struct format code. utf8
+# is a string with a length prefix, so it has no code of its own.
+LAYOUT_UTF8 = 'utf8'
+D_LAYOUT_CODE = {
+    'i8': 'b',
+    'i16': 'h',
+    'i32': 'i',
+    'i64': 'q',
+    'u8': 'B',
+    'u16': 'H',
+    'u32': 'I',
+    'u64': 'Q',
+    'f32': 'f',
+    'f64': 'd',
+    'bool': '?',
+    LAYOUT_UTF8: None,
+}
+
+# The layout a generic with one template type can declare. Its
+# instantiations are a length prefix followed by the items.
+LAYOUT_LIST = 'list'
+
+
+# --------------------------------------------------------
+#   effect
+# --------------------------------------------------------
+# Kinds of blocking work that a method can declare. See the loop_blocking
+# lint.
+EFFECT_CPU = 'cpu'
+EFFECT_IO = 'io'
+EFFECT_NET = 'net'
+LST_EFFECT = [EFFECT_CPU, EFFECT_IO, EFFECT_NET]
+
+
 # --------------------------------------------------------
 #   statement
 # --------------------------------------------------------
@@ -48,8 +145,20 @@ class Statement:
         self.wandle_class = None
         self.lhs_dotref = None
         self.rhs_dotref = None
+        # For calls, List<List<str>>. One dotref per param.
         self.lst_rhs_param = []
         self.txt = None
+        self.position = None
+
+        # For calls, this is the WandleFunction that the rhs resolved to.
+        self.wandle_function = None
+
+    def freeze(self):
+        if type(self.lhs_dotref) == list:
+            self.lhs_dotref = tuple(self.lhs_dotref)
+        if type(self.rhs_dotref) == list:
+            self.rhs_dotref = tuple(self.rhs_dotref)
+        self.lst_rhs_param = tuple([tuple(p) for p in self.lst_rhs_param])
 
     def as_code(self):
         sb = []
@@ -116,20 +225,20 @@ def resolve_dotref_async_rhs(lst_dotref, local_scope):
 
     # Synchronous search for early tokens.
     for (idx, mname) in enumerate(lst_dotref[:-1]):
-        prev_context = context
         context = context.get_sync(mname=mname)
         if context == None:
-            print(prev_context)
             raise Exception(
                 "[%s] Could not find %s."%(
                     '.'.join(lst_dotref), mname))
+        if context.wtype == 'WandleFunction':
+            raise Exception(
+                "[%s] %s is a method, and has no members."%(
+                    '.'.join(lst_dotref), mname))
 
     # Asynchronous search for the last token.
-    prev_context = context
     mname = lst_dotref[-1]
     context = context.get_async(mname=mname)
     if context == None:
-        print(prev_context)
         raise Exception(
             "[%s] Could not find %s."%(
                 '.'.join(lst_dotref), mname))
@@ -142,13 +251,15 @@ def resolve_dotref_sync_only(lst_dotref, local_scope):
     '''
     context = local_scope
     for (idx, mname) in enumerate(lst_dotref):
-        prev_context = context
         context = context.get_sync(mname=mname)
         if context == None:
-            print(prev_context)
             raise Exception(
                 "[%s] Could not find %s."%(
                     '.'.join(lst_dotref), mname))
+        if idx + 1 < len(lst_dotref) and context.wtype == 'WandleFunction':
+            raise Exception(
+                "[%s] %s is a method, and has no members."%(
+                    '.'.join(lst_dotref), mname))
     return context
 
 def populate_function(node, wandle_model, wandle_function):
@@ -169,7 +280,6 @@ def populate_function(node, wandle_model, wandle_function):
         wandle_model=wandle_model,
         compile_container=wandle_function.compile_container)
     for param in wandle_function.lst_param:
-        print(param)
         wandle_object = param.wandle_class.as_wandle_object()
         wandle_object.mark_ready()
         local_scope.set(
@@ -199,15 +309,18 @@ def populate_function(node, wandle_model, wandle_function):
 
                 if lhs_wandle_context.wtype != 'WandleObject':
                     raise Exception(
-                        "Invalid LHS. %s Can only assign to object."%(
-                            lhs_wandle_context))
+                        "Invalid LHS %s. Can only assign to a var."%(
+                            '.'.join(lhs_dotref)))
+                if rhs_wandle_context.wtype == 'WandleSingle':
+                    raise SyntaxError(
+                        "Member %s is not a var."%('.'.join(rhs_dotref)))
 
                 if lhs_wandle_context.get_type() != rhs_wandle_context.get_type():
                     msg = ' '.join([
                         "Inconsistent type in copy statement",
                         "%s = %s."%(lhs_dotref, rhs_dotref),
-                        "LHS is %s,"%(lhs_wandle_context.wandle_class),
-                        "RHS is %s."%(rhs_wandle_context.wandle_class),
+                        "LHS is %s,"%(lhs_wandle_context.get_type()),
+                        "RHS is %s."%(rhs_wandle_context.get_type()),
                     ])
                     raise SyntaxError(msg)
 
@@ -220,6 +333,7 @@ def populate_function(node, wandle_model, wandle_function):
                 statement.lhs_dotref = lhs_dotref
                 statement.rhs_dotref = rhs_dotref
 
+                statement.position = our_node.position
                 wandle_function.add_statement(statement)
             elif rule_name == '_cb_sync_from':
                 lhs_dotref = [n.value for n in our_node[0] if n != '.']
@@ -238,20 +352,19 @@ def populate_function(node, wandle_model, wandle_function):
                     pass
                 elif lhs_wandle_context.wtype != 'WandleObject':
                     raise Exception(
-                        "Invalid LHS. %s Can only assign to object."%(
-                            lhs_wandle_context))
+                        "Invalid LHS %s. Can only assign to a var."%(
+                            '.'.join(lhs_dotref)))
 
                 if lhs_wandle_context.get_type() != rhs_wandle_context.get_type():
                     msg = ' '.join([
                         "Inconsistent type in copy statement",
                         "%s = %s."%(lhs_dotref, rhs_dotref),
-                        "LHS is %s,"%(lhs_wandle_context),
-                        "RHS is %s."%(rhs_wandle_context),
+                        "LHS is %s,"%(lhs_wandle_context.get_type()),
+                        "RHS is %s."%(rhs_wandle_context.get_type()),
                     ])
                     raise SyntaxError(msg)
 
                 if rhs_wandle_context.wtype != 'WandleFunction':
-                    print("Syntax error, |%s|"%(our_node))
                     msg = "RHS is not a function/method. (It is %s)."%(
                         rhs_wandle_context.wtype)
                     raise SyntaxError(msg)
@@ -260,7 +373,6 @@ def populate_function(node, wandle_model, wandle_function):
 
                 # Confirm that we have the correct number of params.
                 if len(lst_param_node) != len(rhs_wandle_context.lst_param):
-                    print("Syntax error, |%s|"%(our_node))
                     msg = "Incorrect number of params."
                     raise SyntaxError(msg)
 
@@ -273,7 +385,6 @@ def populate_function(node, wandle_model, wandle_function):
                         local_scope=local_scope,
                         lst_dotref=lst_dotref)
                     if wandle_object == None:
-                        print("Syntax error, |%s|"%(our_node))
                         raise SyntaxError("There is no member |%s|."%(dotref))
                     elif wandle_object.wtype == 'WandleVoid':
                         pass
@@ -282,13 +393,11 @@ def populate_function(node, wandle_model, wandle_function):
                             raise Exception(
                                 "Var %s has not been set."%(dotref))
                     else:
-                        print("Syntax error, |%s|"%(our_node))
                         raise SyntaxError("Member %s is not a var."%(dotref))
 
                     ptype = wandle_object.get_type()
                     xtype = rhs_wandle_context.lst_param[idx].get_type()
                     if ptype != xtype:
-                        print("Syntax error, |%s|"%(our_node))
                         raise SyntaxError(
                             "Param mismatch. Expected type %s, got %s"%(
                                 xtype, ptype))
@@ -301,7 +410,12 @@ def populate_function(node, wandle_model, wandle_function):
                 statement.wandle_class = lhs_wandle_context.wandle_class
                 statement.lhs_dotref = lhs_dotref
                 statement.rhs_dotref = rhs_dotref
+                statement.wandle_function = rhs_wandle_context
+                statement.lst_rhs_param = [
+                    [n.value for n in param_node if n != '.']
+                    for param_node in lst_param_node]
 
+                statement.position = our_node.position
                 wandle_function.add_statement(statement)
             elif rule_name == '_cb_async_from':
                 lhs_dotref = [n.value for n in our_node[0] if n != '.']
@@ -316,17 +430,23 @@ def populate_function(node, wandle_model, wandle_function):
                     local_scope=local_scope,
                     lst_dotref=rhs_dotref)
 
+                if lhs_wandle_context.wtype == 'WandleVoid':
+                    pass
+                elif lhs_wandle_context.wtype != 'WandleObject':
+                    raise Exception(
+                        "Invalid LHS %s. Can only assign to a var."%(
+                            '.'.join(lhs_dotref)))
+
                 if lhs_wandle_context.get_type() != rhs_wandle_context.get_type():
                     msg = ' '.join([
                         "Inconsistent type in copy statement",
-                        "%s = %s."%(lhs_dotref, rhs_dotref),
-                        "LHS is %s,"%(lhs_wandle_context.wandle_class.name),
-                        "RHS is %s."%(rhs_wandle_context.wandle_class.name),
+                        "%s << %s."%(lhs_dotref, rhs_dotref),
+                        "LHS is %s,"%(lhs_wandle_context.get_type()),
+                        "RHS is %s."%(rhs_wandle_context.get_type()),
                     ])
                     raise SyntaxError(msg)
 
                 if rhs_wandle_context.wtype != 'WandleFunction':
-                    print("Syntax error, |%s|"%(our_node))
                     msg = "RHS is not a function/method. (It is %s)."%(
                         rhs_wandle_context.wtype)
                     raise SyntaxError(msg)
@@ -335,7 +455,6 @@ def populate_function(node, wandle_model, wandle_function):
 
                 # Confirm that we have the correct number of params.
                 if len(lst_param_node) != len(rhs_wandle_context.lst_param):
-                    print("Syntax error, |%s|"%(our_node))
                     msg = "Incorrect number of params."
                     raise SyntaxError(msg)
 
@@ -348,14 +467,12 @@ def populate_function(node, wandle_model, wandle_function):
                         local_scope=local_scope,
                         lst_dotref=lst_dotref)
                     if wandle_member == None:
-                        print("Syntax error, |%s|"%(our_node))
                         raise SyntaxError("There is no member |%s|."%(dotref))
                     elif wandle_member.wtype == 'WandleVoid':
                         pass
                     elif wandle_member.wtype == 'WandleObject':
                         pass
                     else:
-                        print("Syntax error, |%s|"%(our_node))
                         raise SyntaxError("Member %s is not a var."%(dotref))
 
                     # Confirm that the param var is set as part of the if/elif block above.
@@ -364,7 +481,6 @@ def populate_function(node, wandle_model, wandle_function):
                     ptype = wandle_member.get_type()
                     xtype = rhs_wandle_context.lst_param[idx].get_type()
                     if ptype != xtype:
-                        print("Syntax error, |%s|"%(our_node))
                         raise SyntaxError(
                             "Param mismatch. Expected type %s, got %s"%(
                                 xtype, ptype))
@@ -373,7 +489,12 @@ def populate_function(node, wandle_model, wandle_function):
                 statement.wandle_class = lhs_wandle_context.wandle_class
                 statement.lhs_dotref = lhs_dotref
                 statement.rhs_dotref = rhs_dotref
+                statement.wandle_function = rhs_wandle_context
+                statement.lst_rhs_param = [
+                    [n.value for n in param_node if n != '.']
+                    for param_node in lst_param_node]
 
+                statement.position = our_node.position
                 wandle_function.add_statement(statement)
             elif rule_name == '_cb_note':
                 sb = []
@@ -383,6 +504,7 @@ def populate_function(node, wandle_model, wandle_function):
 
                 statement = Statement(STYPE_NOTE_CONTENT)
                 statement.txt = txt
+                statement.position = our_node.position
                 wandle_function.add_statement(statement)
             elif rule_name == '_cb_var_stub':
                 cstring = our_node[0].value
@@ -400,12 +522,15 @@ def populate_function(node, wandle_model, wandle_function):
                 statement = Statement(STYPE_SYNC_VAR_NUL)
                 statement.wandle_class = wandle_class
                 statement.lhs_dotref = name
+                statement.position = our_node.position
                 wandle_function.add_statement(statement)
             elif rule_name == '_cb_var_ready':
                 cstring = our_node[0].value
                 name = our_node[1].value
 
                 wandle_class = local_scope.get_class(cstring=cstring)
+                if wandle_class == None:
+                    raise Exception("Class %s does not exist."%(cstring))
                 wandle_object = wandle_class.as_wandle_object()
                 wandle_object.mark_ready()
                 local_scope.set(
@@ -415,6 +540,7 @@ def populate_function(node, wandle_model, wandle_function):
                 statement = Statement(STYPE_SYNC_VAR_VAL)
                 statement.wandle_class = wandle_class
                 statement.lhs_dotref = name
+                statement.position = our_node.position
                 wandle_function.add_statement(statement)
             elif rule_name == '_cb_return':
                 # Type check the return against the scope we are in.
@@ -427,6 +553,9 @@ def populate_function(node, wandle_model, wandle_function):
                 rhs_wandle_context = resolve_dotref_sync_only(
                     lst_dotref=rhs_dotref,
                     local_scope=local_scope)
+                if rhs_wandle_context.wtype == 'WandleFunction':
+                    raise SyntaxError(
+                        "Member %s is not a var."%('.'.join(rhs_dotref)))
                 got_rtype_wandle_class = rhs_wandle_context.wandle_class
 
                 if sig_rtype_wandle_class != got_rtype_wandle_class:
@@ -434,21 +563,454 @@ def populate_function(node, wandle_model, wandle_function):
                         "Incorrect return type for method %s."%(
                             wandle_function.name))
                 b_valid_return = True
+                wandle_function.return_dotref = rhs_dotref
+            elif rule_name in ('_cb_var_sync_set', '_cb_var_async_set'):
+                raise SyntaxError(
+                    "A var cannot be declared and set in one statement.")
             else:
                 raise SyntaxError('rule_name %s is not handled'%(rule_name))
         except SyntaxError as e:
-            sb = []
-            for thing in our_node:
-                sb.append(thing.value)
-            print("[!] Syntax error in |%s|"%(' '.join(sb)))
-            print(e.message)
-            raise Exception("Syntax error. See log.")
+            raise BuildError(
+                "Syntax error in |%s|. %s"%(_node_text(our_node), e.message),
+                our_node.position)
+        except Exception as e:
+            if type(e) != Exception:
+                raise
+            raise BuildError(str(e), our_node.position)
 
     if not b_valid_return:
-        raise Exception(
+        raise BuildError(
             "Method %s must return %s"%(
                 wandle_function.name,
-                wandle_function.rtype.name))
+                wandle_function.rtype.name),
+            wandle_function.position)
+
+
+# --------------------------------------------------------
+#   latency
+# --------------------------------------------------------
+D_DURATION_UNIT_MS = {
+    'us': 0.001,
+    'ms': 1.0,
+    's': 1000.0,
+}
+
+def duration_as_ms(s):
+    '''
+    Converts a duration from the grammar, such as 2ms or 1.5s, to
+    milliseconds.
+    '''
+    for unit in ('us', 'ms', 's'):
+        if s.endswith(unit):
+            return float(s[:-len(unit)]) * D_DURATION_UNIT_MS[unit]
+    raise Exception("Invalid duration %s"%(s))
+
+DIST_CONST = 'const'
+DIST_EXPONENTIAL = 'exponential'
+DIST_HISTOGRAM = 'histogram'
+DIST_LOGNORMAL = 'lognormal'
+
+class CostDist:
+    # The distribution behind a method's cost.
+    #
+    # const          value_ms.
+    # exponential    value_ms is the mean.
+    # lognormal      value_ms is the median, and sigma is the shape.
+    # histogram      lst_bin is a list of (ms, weight). We draw one of the
+    #                values, in proportion to its weight.
+
+    def __init__(self, kind, value_ms=None, sigma=None, lst_bin=None):
+        self.kind = kind
+        self.value_ms = value_ms
+        self.sigma = sigma
+        self.lst_bin = lst_bin
+
+    def __repr__(self):
+        return '<CostDist %s>'%(self.as_code())
+
+    def mean_ms(self):
+        if self.kind in (DIST_CONST, DIST_EXPONENTIAL):
+            return self.value_ms
+        elif self.kind == DIST_LOGNORMAL:
+            return self.value_ms * math.exp(self.sigma * self.sigma / 2.0)
+        elif self.kind == DIST_HISTOGRAM:
+            total = sum([w for (ms, w) in self.lst_bin])
+            return sum([ms * w for (ms, w) in self.lst_bin]) / total
+        raise Exception("Unhandled distribution %s"%(self.kind))
+
+    def sample(self, rnd):
+        '''
+        One draw, in ms. rnd is a random.Random.
+        '''
+        if self.kind == DIST_CONST:
+            return self.value_ms
+        elif self.kind == DIST_EXPONENTIAL:
+            return rnd.expovariate(1.0 / self.value_ms)
+        elif self.kind == DIST_LOGNORMAL:
+            return rnd.lognormvariate(math.log(self.value_ms), self.sigma)
+        elif self.kind == DIST_HISTOGRAM:
+            return rnd.choices(
+                [ms for (ms, w) in self.lst_bin],
+                weights=[w for (ms, w) in self.lst_bin])[0]
+        raise Exception("Unhandled distribution %s"%(self.kind))
+
+    def as_code(self):
+        if self.kind == DIST_CONST:
+            return '%gms'%(self.value_ms)
+        elif self.kind == DIST_EXPONENTIAL:
+            return 'exponential(%gms)'%(self.value_ms)
+        elif self.kind == DIST_LOGNORMAL:
+            return 'lognormal(%gms, %g)'%(self.value_ms, self.sigma)
+        elif self.kind == DIST_HISTOGRAM:
+            return 'histogram(%s)'%(', '.join(
+                ['%gms:%g'%(ms, w) for (ms, w) in self.lst_bin]))
+        raise Exception("Unhandled distribution %s"%(self.kind))
+
+class Latency:
+    # Static latency of a function, worked out from cost annotations.
+    #
+    # ret_ms is the time until the function returns to its caller. done_ms
+    # is the time until everything it started has finished. That includes
+    # work behind async sends, which nobody waits for. lst_path is the chain
+    # of calls that decides done_ms, with async sends marked <<, and hops is
+    # the number of async sends along it.
+
+    def __init__(self, ret_ms, done_ms, hops, lst_path):
+        self.ret_ms = ret_ms
+        self.done_ms = done_ms
+        self.hops = hops
+        self.lst_path = lst_path
+
+    def __repr__(self):
+        return '<Latency ret:%gms done:%gms hops:%s>'%(
+            self.ret_ms, self.done_ms, self.hops)
+
+def function_latency(wandle_function, d_memo, lst_stack=None):
+    '''
+    Works out the Latency of a function from its own cost and its body.
+    Sync calls move our clock on by the callee's ret_ms. Async sends start
+    the callee at the current time, and we carry on without waiting. A
+    missing cost counts as zero.
+
+    d_memo is id(WandleFunction) vs Latency, and can be shared between
+    calls.
+    '''
+    key = id(wandle_function)
+    if key in d_memo:
+        return d_memo[key]
+    if lst_stack == None:
+        lst_stack = []
+    for entry in lst_stack:
+        if entry is wandle_function:
+            # Recursion. There is no sensible number for this, so we count
+            # the inner call as free.
+            return Latency(ret_ms=0.0, done_ms=0.0, hops=0, lst_path=[])
+    lst_stack.append(wandle_function)
+
+    qname = wandle_function.get_qualified_name()
+    t = 0.0
+    if wandle_function.cost_ms != None:
+        t = wandle_function.cost_ms
+    done_ms = t
+    hops = 0
+    lst_path = [qname]
+    for statement in wandle_function.lst_statement:
+        callee = statement.wandle_function
+        if callee == None:
+            continue
+        sub = function_latency(
+            wandle_function=callee,
+            d_memo=d_memo,
+            lst_stack=lst_stack)
+        sub_done_ms = t + sub.done_ms
+        if statement.stype == STYPE_ASYNC_LHS_RHS:
+            sub_hops = sub.hops + 1
+            sub_path = ['<< ' + sub.lst_path[0]] + sub.lst_path[1:]
+        else:
+            sub_hops = sub.hops
+            sub_path = sub.lst_path
+            t += sub.ret_ms
+        if sub_done_ms > done_ms or (sub_done_ms == done_ms and sub_hops > hops):
+            done_ms = sub_done_ms
+            hops = sub_hops
+            lst_path = [qname] + sub_path
+    lst_stack.pop()
+
+    latency = Latency(
+        ret_ms=t,
+        done_ms=done_ms,
+        hops=hops,
+        lst_path=lst_path)
+    d_memo[key] = latency
+    return latency
+
+
+# --------------------------------------------------------
+#   dataflow
+# --------------------------------------------------------
+DEP_TRUE = 'true'
+DEP_ANTI = 'anti'
+DEP_OUTPUT = 'output'
+
+def _paths_overlap(a, b):
+    '''
+    Dotrefs overlap when one is a prefix of the other. Writing to person
+    touches person.age, and the reverse.
+    '''
+    n = min(len(a), len(b))
+    return a[:n] == b[:n]
+
+def statement_defs_uses(statement, set_single=()):
+    '''
+    Returns (lst_def, lst_use) for a statement. Each is a list of dotrefs,
+    as tuples. A call reads its params and its receiver. It writes its lhs,
+    and a sync call may change its receiver too.
+
+    An async send does not change its receiver as the caller sees it, and
+    nor does a call on a single, whose state is not the body's to order.
+    set_single holds the names that are singles in this body.
+    '''
+    stype = statement.stype
+    if stype in (STYPE_SYNC_VAR_NUL, STYPE_SYNC_VAR_VAL):
+        return ([(statement.lhs_dotref,)], [])
+    if stype not in (STYPE_SYNC_LHS_RHS, STYPE_ASYNC_LHS_RHS):
+        return ([], [])
+
+    lst_def = []
+    lst_use = []
+    lhs = tuple(statement.lhs_dotref)
+    if lhs != ('void',):
+        lst_def.append(lhs)
+    if statement.wandle_function == None:
+        # A copy.
+        lst_use.append(tuple(statement.rhs_dotref))
+        return (lst_def, lst_use)
+    receiver = tuple(statement.rhs_dotref[:-1])
+    if receiver:
+        lst_use.append(receiver)
+        if stype == STYPE_SYNC_LHS_RHS and receiver[0] not in set_single:
+            lst_def.append(receiver)
+    for param in statement.lst_rhs_param:
+        lst_use.append(tuple(param))
+    return (lst_def, lst_use)
+
+class DataFlow:
+    # Def-use graph over the statements of one body. Bodies are straight
+    # line code, so a single pass finds, for each statement, the statements
+    # it must come after.
+    #
+    # lst_edge holds (src, dst, kind, dotref), where src and dst are indexes
+    # into lst_statement and src < dst. kind is DEP_TRUE where dst reads
+    # what src wrote, DEP_ANTI where dst writes what src read, and
+    # DEP_OUTPUT where both write it.
+
+    def __init__(self, wandle_function):
+        self.wandle_function = wandle_function
+        self.lst_statement = list(wandle_function.lst_statement)
+        self.lst_def = []
+        self.lst_use = []
+        self.lst_edge = []
+        # idx vs List<idx>, for both directions.
+        self.d_pred = {}
+        self.d_succ = {}
+
+        # Names that are singles here, rather than params or vars.
+        set_single = set()
+        if wandle_function.wandle_model != None:
+            set_single = set(wandle_function.wandle_model.d_single.keys())
+        set_single -= set([p.name for p in wandle_function.lst_param])
+        for statement in self.lst_statement:
+            if statement.stype in (STYPE_SYNC_VAR_NUL, STYPE_SYNC_VAR_VAL):
+                set_single.discard(statement.lhs_dotref)
+
+        # dotref vs idx of the last statement to write it.
+        d_last_def = {}
+        # dotref vs List<idx> of statements that read it since.
+        d_reads = {}
+        for (idx, statement) in enumerate(self.lst_statement):
+            (lst_def, lst_use) = statement_defs_uses(
+                statement=statement,
+                set_single=set_single)
+            self.lst_def.append(lst_def)
+            self.lst_use.append(lst_use)
+            for use in lst_use:
+                for (path, src) in d_last_def.items():
+                    if _paths_overlap(use, path):
+                        self.__add_edge(src, idx, DEP_TRUE, use)
+            for dfn in lst_def:
+                for (path, src) in d_last_def.items():
+                    if _paths_overlap(dfn, path):
+                        self.__add_edge(src, idx, DEP_OUTPUT, dfn)
+                for (path, lst_src) in d_reads.items():
+                    if _paths_overlap(dfn, path):
+                        for src in lst_src:
+                            self.__add_edge(src, idx, DEP_ANTI, dfn)
+            for use in lst_use:
+                d_reads.setdefault(use, []).append(idx)
+            for dfn in lst_def:
+                for path in [p for p in d_last_def if _paths_overlap(dfn, p)]:
+                    del d_last_def[path]
+                for path in [p for p in d_reads if _paths_overlap(dfn, p)]:
+                    del d_reads[path]
+                d_last_def[dfn] = idx
+
+    def __repr__(self):
+        return '<DataFlow %s statements:%s edges:%s>'%(
+            self.wandle_function.get_qualified_name(),
+            len(self.lst_statement),
+            len(self.lst_edge))
+
+    def __add_edge(self, src, dst, kind, dotref):
+        if src == dst:
+            return
+        self.lst_edge.append((src, dst, kind, dotref))
+        lst_pred = self.d_pred.setdefault(dst, [])
+        if src not in lst_pred:
+            lst_pred.append(src)
+            self.d_succ.setdefault(src, []).append(dst)
+
+    def get_preds(self, idx):
+        '''
+        Indexes of the statements that idx must come after.
+        '''
+        return self.d_pred.get(idx, [])
+
+    def get_def_use(self):
+        '''
+        The true dependencies only, as (def idx, use idx, dotref).
+        '''
+        return [(src, dst, dotref)
+            for (src, dst, kind, dotref) in self.lst_edge
+            if kind == DEP_TRUE]
+
+
+# --------------------------------------------------------
+#   index
+# --------------------------------------------------------
+USE_FIELD = 'field'
+USE_PARAM = 'param'
+USE_RETURN = 'return'
+USE_VAR = 'var'
+
+class WandleIndex:
+    # Reverse indexes over the model. These are filled in as the model is
+    # built, so that questions such as 'who calls Org.register_person?' are
+    # a dict lookup rather than a scan of every statement.
+    #
+    # Methods and flows are keyed by qualified name. See
+    # WandleFunction.get_qualified_name.
+
+    def __init__(self):
+        # str vs List<(WandleFunction, Statement)>. Keyed by callee.
+        self.d_call = {}
+        # str vs List<(str, str, int)>. Keyed by class name. Values are
+        # (kind, where, position), where kind is one of the USE_ constants.
+        self.d_type_use = {}
+        # str vs List<WandleFunction>. Keyed by single name. These are the
+        # functions that use the single directly.
+        self.d_single_use = {}
+        # str vs List<str>. Keyed by class, generic or single name. The
+        # qualified names of the methods it declares.
+        self.d_member = {}
+
+    def __add(self, d, key, value):
+        if key not in d:
+            d[key] = []
+        d[key].append(value)
+
+    def add_type_use(self, cstring, kind, where, position=None):
+        self.__add(self.d_type_use, cstring, (kind, where, position))
+
+    def add_signature(self, wandle_function):
+        qname = wandle_function.get_qualified_name()
+        if '.' in qname:
+            owner = qname.rsplit('.', 1)[0]
+            if qname not in self.d_member.get(owner, ()):
+                self.__add(self.d_member, owner, qname)
+        self.add_type_use(
+            cstring=wandle_function.rtype.name,
+            kind=USE_RETURN,
+            where=qname,
+            position=wandle_function.position)
+        for param in wandle_function.lst_param:
+            self.add_type_use(
+                cstring=param.wandle_class.name,
+                kind=USE_PARAM,
+                where='%s(%s)'%(qname, param.name),
+                position=param.position)
+
+    def add_statement(self, wandle_model, wandle_function, statement):
+        qname = wandle_function.get_qualified_name()
+        if statement.stype in (STYPE_SYNC_VAR_NUL, STYPE_SYNC_VAR_VAL):
+            self.add_type_use(
+                cstring=statement.wandle_class.name,
+                kind=USE_VAR,
+                where='%s %s'%(qname, statement.lhs_dotref),
+                position=statement.position)
+            return
+
+        if statement.wandle_function != None:
+            callee = statement.wandle_function
+            self.__add(
+                self.d_call,
+                callee.get_qualified_name(),
+                (wandle_function, statement))
+            if callee.compile_container.wtype == 'WandleSingle':
+                self.__add(
+                    self.d_single_use,
+                    callee.compile_container.name,
+                    wandle_function)
+        elif statement.rhs_dotref != None:
+            if statement.rhs_dotref[0] in wandle_model.d_single:
+                self.__add(
+                    self.d_single_use,
+                    statement.rhs_dotref[0],
+                    wandle_function)
+
+    def get_members(self, name):
+        '''
+        Qualified names of the methods that name declares.
+        '''
+        return self.d_member.get(name, ())
+
+    def get_callers(self, qname):
+        lst = []
+        set_seen = set()
+        for (wandle_function, statement) in self.d_call.get(qname, ()):
+            if id(wandle_function) in set_seen:
+                continue
+            set_seen.add(id(wandle_function))
+            lst.append(wandle_function)
+        return lst
+
+    def get_flows_reaching(self, lst_wandle_function):
+        '''
+        Walks up the caller index from the given functions, and returns the
+        flows that reach any of them.
+        '''
+        lst_flow = []
+        set_seen = set()
+        lst_todo = list(lst_wandle_function)
+        while lst_todo:
+            wandle_function = lst_todo.pop()
+            if id(wandle_function) in set_seen:
+                continue
+            set_seen.add(id(wandle_function))
+            if wandle_function.is_flow():
+                lst_flow.append(wandle_function)
+            lst_todo.extend(self.get_callers(
+                wandle_function.get_qualified_name()))
+        return sorted(lst_flow, key=lambda f: f.name)
+
+    def freeze(self):
+        self.d_call = MappingProxyType(
+            dict([(k, tuple(v)) for (k, v) in self.d_call.items()]))
+        self.d_type_use = MappingProxyType(
+            dict([(k, tuple(v)) for (k, v) in self.d_type_use.items()]))
+        self.d_single_use = MappingProxyType(
+            dict([(k, tuple(v)) for (k, v) in self.d_single_use.items()]))
+        self.d_member = MappingProxyType(
+            dict([(k, tuple(v)) for (k, v) in self.d_member.items()]))
 
 
 # --------------------------------------------------------
@@ -458,10 +1020,18 @@ class WandleModel:
     # The Model does very little, and exists as a container for the root
     # scope. This also serves as a global scope for Void void.
 
-    def __init__(self):
+    def __init__(self, b_print_diagnostic=True):
         self.parent_type_scope = None
         self.parent_runtime_scope = None
 
+        # Diagnostics are always collected. When b_print_diagnostic is set,
+        # they are also printed as they arrive, which is what the command
+        # line wants.
+        #
+        # List<Diagnostic>
+        self.lst_diagnostic = []
+        self.b_print_diagnostic = b_print_diagnostic
+
         self.wtype = self.__class__.__name__
 
         #
@@ -473,6 +1043,8 @@ class WandleModel:
         self.d_generic = {}
         # str vs str
         self.d_alias = {}
+        # str vs int. Source position of each alias.
+        self.d_alias_position = {}
 
         #
         # These vars relate to Membership.
@@ -491,6 +1063,20 @@ class WandleModel:
         # str vs List<WandleObject>
         self.d_register = {}
 
+        # Functions whose body has been parsed, but not necessarily checked.
+        # These are in source order. See WandleFunction.check_body.
+        #
+        # List<WandleFunction>
+        self.lst_function_body = []
+        # str vs List<WandleFunction>. The bodies that set a var, keyed by
+        # the last name of the var. See check_flow.
+        self.d_body_write = {}
+
+        # Set by freeze. See there.
+        self.b_frozen = False
+
+        self.wandle_index = WandleIndex()
+
         # Void void is automatically declared at the root level.
         self.__prep_void()
 
@@ -507,6 +1093,19 @@ class WandleModel:
             wandle_model=self)
         self.d_object['void'] = ob_void
 
+    def diagnostic(self, severity, message, position=None):
+        diagnostic = Diagnostic(
+            severity=severity,
+            message=message,
+            position=position)
+        self.lst_diagnostic.append(diagnostic)
+        if self.b_print_diagnostic:
+            print(message)
+
+    def __assert_mutable(self):
+        if self.b_frozen:
+            raise Exception("Model is frozen, and cannot be changed.")
+
     def __is_name_known(self, name):
         if name in self.d_specific: return True
         if name in self.d_generic: return True
@@ -515,7 +1114,8 @@ class WandleModel:
         if name in self.d_single: return True
         return False
 
-    def stub_specific(self, name, b_placeholder=False):
+    def stub_specific(self, name, b_placeholder=False, position=None):
+        self.__assert_mutable()
         if self.__is_name_known(name) and not b_placeholder:
             raise Exception("Duplicate name definition, %s"%(name))
 
@@ -523,9 +1123,11 @@ class WandleModel:
             wandle_model=self,
             name=name,
             b_placeholder=b_placeholder)
+        wandle_class.position = position
         self.d_specific[name] = wandle_class
 
-    def stub_generic(self, name, lst_template_type):
+    def stub_generic(self, name, lst_template_type, position=None):
+        self.__assert_mutable()
         if self.__is_name_known(name):
             raise Exception("Duplicate name definition, %s"%(name))
 
@@ -533,25 +1135,31 @@ class WandleModel:
             wandle_model=self,
             name=name,
             lst_template_type=lst_template_type)
+        wandle_generic.position = position
         self.d_generic[name] = wandle_generic
 
-    def set_alias(self, name, tstring):
+    def set_alias(self, name, tstring, position=None):
+        self.__assert_mutable()
         if '/' in name:
             raise Exception(
                 "Char / is not valid in an alias name. (%s)"%(
                     name))
         self.d_alias[name] = tstring
+        self.d_alias_position[name] = position
 
-    def stub_single(self, name):
+    def stub_single(self, name, position=None):
+        self.__assert_mutable()
         if self.__is_name_known(name):
             raise Exception("Duplicate name definition, %s"%(name))
 
         wandle_single = WandleSingle(
             wandle_model=self,
             name=name)
+        wandle_single.position = position
         self.d_single[name] = wandle_single
 
-    def stub_flow(self, name):
+    def stub_flow(self, name, position=None, budget_ms=None):
+        self.__assert_mutable()
         if self.__is_name_known(name):
             raise Exception("Duplicate name definition, %s"%(name))
 
@@ -565,6 +1173,8 @@ class WandleModel:
             rtype=rtype,
             name=name,
             lst_param=lst_param)
+        wandle_function.position = position
+        wandle_function.budget_ms = budget_ms
         self.d_flow[name] = wandle_function
 
     def validate_alias_entries(self):
@@ -576,6 +1186,7 @@ class WandleModel:
     def register_object(self, wandle_object):
         # The reason we do this is related to needing to retrospectively
         # update objects-derived-from-generics during the compile process.
+        self.__assert_mutable()
         type_name = wandle_object.get_type()
         if type_name not in self.d_register:
             self.d_register[type_name] = []
@@ -616,6 +1227,130 @@ class WandleModel:
                         name=name,
                         wandle_object=sub)
 
+    def add_function_body(self, wandle_function, node):
+        self.__assert_mutable()
+        wandle_function.set_body(
+            node=node,
+            wandle_model=self)
+        self.lst_function_body.append(wandle_function)
+
+        (set_write, _) = wandle_function.get_body_ready_names()
+        for name in set_write:
+            if name not in self.d_body_write:
+                self.d_body_write[name] = []
+            self.d_body_write[name].append(wandle_function)
+
+    def add_checked_body(self, wandle_function, lst_statement):
+        '''
+        For a body that was checked somewhere else, and comes to us as
+        statements rather than as a parse node. For example, a model read
+        back from an export.
+        '''
+        self.__assert_mutable()
+        wandle_function.wandle_model = self
+        wandle_function.b_has_body = True
+        self.lst_function_body.append(wandle_function)
+
+        for statement in lst_statement:
+            wandle_function.add_statement(statement)
+
+    def check_all(self):
+        '''
+        Type-check every function body, in source order.
+        '''
+        for wandle_function in self.lst_function_body:
+            wandle_function.check_body()
+
+    def check_flow(self, name):
+        '''
+        Type-check a single flow, the bodies of the methods that it
+        reaches, and the bodies that set fields those read. Returns the
+        list of functions that were checked.
+
+        We cannot resolve calls until a body has been checked, and the
+        checks are order-sensitive (a method that sets a field marks it
+        ready for later bodies). So we find the reachable bodies from the
+        parse tree first, and then check them in source order, the same as
+        a full build would.
+        '''
+        if name not in self.d_flow:
+            raise Exception("No flow exists called %s"%(name))
+
+        set_reached = set()
+        set_read = set()
+        lst_todo = [self.d_flow[name]]
+        while lst_todo:
+            wandle_function = lst_todo.pop()
+            if id(wandle_function) in set_reached:
+                continue
+            set_reached.add(id(wandle_function))
+            set_read.update(wandle_function.get_body_ready_names()[1])
+            for callee in wandle_function.get_body_callees():
+                if callee.has_body():
+                    lst_todo.append(callee)
+
+        # Fields are marked ready by whichever body sets them, and that need
+        # not be a body the flow reaches. So we also check the bodies that
+        # set a name the checked bodies read, and the ones that set what
+        # those read. We only know the field by its last name here.
+        lst_name = list(set_read)
+        while lst_name:
+            for wandle_function in self.d_body_write.get(lst_name.pop(), ()):
+                if id(wandle_function) in set_reached:
+                    continue
+                set_reached.add(id(wandle_function))
+                for name_more in wandle_function.get_body_ready_names()[1]:
+                    if name_more not in set_read:
+                        set_read.add(name_more)
+                        lst_name.append(name_more)
+
+        lst_checked = []
+        for wandle_function in self.lst_function_body:
+            if id(wandle_function) in set_reached:
+                wandle_function.check_body()
+                lst_checked.append(wandle_function)
+        return lst_checked
+
+    def get_flow_latency(self, name, d_memo=None):
+        if name not in self.d_flow:
+            raise Exception("No flow exists called %s"%(name))
+        if d_memo == None:
+            d_memo = {}
+        return function_latency(
+            wandle_function=self.d_flow[name],
+            d_memo=d_memo)
+
+    def check_budget(self, name, d_memo=None):
+        '''
+        Raises if the flow has a budget, and its critical path is longer.
+        '''
+        wandle_flow = self.d_flow[name]
+        if wandle_flow.budget_ms == None:
+            return
+        latency = self.get_flow_latency(
+            name=name,
+            d_memo=d_memo)
+        if latency.done_ms > wandle_flow.budget_ms:
+            raise BuildError(
+                "Flow %s takes %gms, over its budget of %gms. (%s)"%(
+                    name,
+                    latency.done_ms,
+                    wandle_flow.budget_ms,
+                    ' -> '.join(latency.lst_path)),
+                wandle_flow.position)
+
+    def check_budgets(self):
+        '''
+        Raises for the first flow that is over its budget. This is not part
+        of the build, so that the other tools still work on a model whose
+        flows are too slow.
+        '''
+        d_memo = {}
+        for name in self.d_flow.keys():
+            self.check_budget(
+                name=name,
+                d_memo=d_memo)
+
     def get_class(self, cstring):
         if cstring in self.d_alias:
             cstring = self.d_alias[cstring]
@@ -626,6 +1361,11 @@ class WandleModel:
             # The first time we encounter a specialised-generic, we type check
             # it, create a derived type, and store that derivation in
             # d_specific so it is ready for future lookups.
+            #
+            # A frozen model resolved its instantiations ahead of time, and
+            # does not create new ones on lookup.
+            if self.b_frozen:
+                return None
             gname = cstring.split('/')[0]
             if gname not in self.d_generic:
                 raise Exception("No generic exists for %s"%(gname))
@@ -665,6 +1405,132 @@ class WandleModel:
     def get_generic(self, name):
         return self.d_generic[name]
 
+    def get_functions(self):
+        '''
+        Every flow and method in the model, keyed by qualified name.
+
+        Classes derived from generics hold their own copies of the generic's
+        methods. Those share a qualified name with the generic's method, and
+        here we give the generic's. Inherited methods appear once, under the
+        class that declares them.
+        '''
+        d = {}
+        for (name, wandle_function) in self.d_flow.items():
+            d[name] = wandle_function
+        for wandle_generic in self.d_generic.values():
+            for dd in (wandle_generic.d_fab_sync, wandle_generic.d_fab_async):
+                for wandle_function in dd.values():
+                    d[wandle_function.get_qualified_name()] = wandle_function
+        for wandle_class in self.d_specific.values():
+            for dd in (wandle_class.d_fab_sync, wandle_class.d_fab_async):
+                for wandle_function in dd.values():
+                    qname = wandle_function.get_qualified_name()
+                    if qname not in d:
+                        d[qname] = wandle_function
+        return d
+
+    def has_function(self, qname):
+        '''
+        True if qname is a flow, or a method that a class, single or generic
+        declares.
+        '''
+        if qname in self.d_flow:
+            return True
+        owner = qname.rsplit('.', 1)[0]
+        return qname in self.wandle_index.get_members(owner)
+
+    def query_callers(self, qname):
+        '''
+        Functions (methods and flows) that call the method qname directly.
+        qname is qualified, for example Org.register_person.
+        '''
+        if not self.has_function(qname):
+            raise Exception("No method %s"%(qname))
+        self.check_all()
+        return self.wandle_index.get_callers(qname)
+
+    def query_flows_calling(self, qname):
+        '''
+        Flows that reach the method qname, directly or through other
+        methods.
+        '''
+        if not self.has_function(qname):
+            raise Exception("No method %s"%(qname))
+        self.check_all()
+        return self.wandle_index.get_flows_reaching(
+            self.wandle_index.get_callers(qname))
+
+    def query_type_users(self, cstring):
+        '''
+        Where a type is used. Returns a list of (kind, where, position).
+        Aliases are
+        resolved, so PersonMap and Map/String,Person give the same answer.
+        '''
+        self.check_all()
+        wandle_class = self.get_class(cstring=cstring)
+        if wandle_class == None:
+            raise Exception("No class %s"%(cstring))
+        return list(self.wandle_index.d_type_use.get(wandle_class.name, ()))
+
+    def query_single_flows(self, name):
+        '''
+        Flows that touch the single name, directly or through methods.
+        '''
+        self.check_all()
+        if name not in self.d_single:
+            raise Exception("No single %s"%(name))
+        return self.wandle_index.get_flows_reaching(
+            self.wandle_index.d_single_use.get(name, ()))
+
+    def freeze(self):
+        '''
+        Turns the model into an immutable snapshot, and returns it.
+
+        Every function body is checked, and so every generic instantiation
+        that the model mentions has been created in d_specific. After that,
+        containers are replaced with read-only views (MappingProxyType,
+        tuple, frozenset) all the way down. Nothing inserts on lookup, so
+        many threads can query the model at the same time without locks.
+        '''
+        if self.b_frozen:
+            return self
+
+        self.check_all()
+        self.validate_alias_entries()
+
+        set_done = set()
+        for wandle_class in self.d_specific.values():
+            wandle_class.freeze(set_done=set_done)
+        for wandle_generic in self.d_generic.values():
+            wandle_generic.freeze(set_done=set_done)
+        for wandle_single in self.d_single.values():
+            wandle_single.wandle_object.freeze(set_done=set_done)
+        for wandle_function in self.d_flow.values():
+            wandle_function.freeze(set_done=set_done)
+        for lst in self.d_register.values():
+            for wandle_object in lst:
+                wandle_object.freeze(set_done=set_done)
+
+        self.d_specific = MappingProxyType(self.d_specific)
+        self.d_generic = MappingProxyType(self.d_generic)
+        self.d_alias = MappingProxyType(self.d_alias)
+        self.d_alias_position = MappingProxyType(self.d_alias_position)
+        self.d_flow = MappingProxyType(self.d_flow)
+        self.d_object = MappingProxyType(self.d_object)
+        self.d_single = MappingProxyType(self.d_single)
+        self.d_register = MappingProxyType(
+            dict([(k, tuple(v)) for (k, v) in self.d_register.items()]))
+        self.lst_function_body = tuple(self.lst_function_body)
+        self.d_body_write = MappingProxyType(
+            dict([(k, tuple(v)) for (k, v) in self.d_body_write.items()]))
+        self.wandle_index.freeze()
+
+        self.b_frozen = True
+        return self
+
+    def is_frozen(self):
+        return self.b_frozen
+
     def as_wandle_object(self, b_ready=True):
         '''
         WandleModel can masquerage as a WandleObject. There is a kind of
@@ -711,6 +1577,9 @@ class WandleClass:
         self.compile_container = wandle_model
         self.wtype = self.__class__.__name__
 
+        # Character offset of the declaration in the source, where known.
+        self.position = None
+
         # List<str>
         self.lst_inherits_from = []
         # Set<str>
@@ -722,6 +1591,9 @@ class WandleClass:
         # str vs WandleObject
         self.d_object = {}
 
+        # Wire layout, for stub classes that declare one. See D_LAYOUT_CODE.
+        self.layout = None
+
     def __repr__(self):
         return '<WandleClass %s>'%(self.name)
 
@@ -734,6 +1606,12 @@ class WandleClass:
     def add_inherits_from(self, cname):
         self.lst_inherits_from.append(cname)
 
+    def set_layout(self, layout):
+        if layout not in D_LAYOUT_CODE:
+            raise Exception("Class %s cannot have layout %s."%(
+                self.name, layout))
+        self.layout = layout
+
     def set_fab_async(self, name, wandle_function):
         self.d_fab_async[name] = wandle_function
         self.set_name.add(name)
@@ -749,6 +1627,21 @@ class WandleClass:
     def get_class(self, cstring):
         return self.wandle_model.get_class(cstring=cstring)
 
+    def get_declared_objects(self):
+        '''
+        Fields this class declares itself, as name vs WandleObject. Once the
+        hierarchy is built, d_object also holds the fields we inherit.
+        '''
+        d_inherited = {}
+        for parent_name in self.lst_inherits_from:
+            parent = self.wandle_model.d_specific[parent_name]
+            for (name, wandle_object) in parent.d_object.items():
+                d_inherited[name] = wandle_object
+        return dict([
+            (name, wandle_object)
+            for (name, wandle_object) in self.d_object.items()
+            if d_inherited.get(name) is not wandle_object])
+
     def get_async(self, mname):
         if mname in self.d_fab_async:
             return self.d_fab_async[mname]
@@ -765,6 +1658,24 @@ class WandleClass:
         else:
             return self.compile_container.get_sync(mname=mname)
 
+    def freeze(self, set_done):
+        if id(self) in set_done:
+            return
+        set_done.add(id(self))
+
+        for wandle_function in self.d_fab_async.values():
+            wandle_function.freeze(set_done=set_done)
+        for wandle_function in self.d_fab_sync.values():
+            wandle_function.freeze(set_done=set_done)
+        for wandle_object in self.d_object.values():
+            wandle_object.freeze(set_done=set_done)
+
+        self.lst_inherits_from = tuple(self.lst_inherits_from)
+        self.set_name = frozenset(self.set_name)
+        self.d_fab_async = MappingProxyType(self.d_fab_async)
+        self.d_fab_sync = MappingProxyType(self.d_fab_sync)
+        self.d_object = MappingProxyType(self.d_object)
+
     def as_wandle_object(self, b_ready=False):
         wandle_object = WandleObject(
             compile_container=self,
@@ -828,6 +1739,7 @@ class WandleGeneric:
         self.lst_template_type = lst_template_type
 
         self.wtype = self.__class__.__name__
+        self.position = None
 
         self.set_name = set()
 
@@ -838,6 +1750,9 @@ class WandleGeneric:
         # str vs WandleObject
         self.d_object = {}
 
+        # LAYOUT_LIST, or None.
+        self.layout = None
+
     def __repr__(self):
         return '<WandleGeneric %s>'%(self.name)
 
@@ -847,6 +1762,16 @@ class WandleGeneric:
         if name in self.d_object: return True
         return False
 
+    def set_layout(self, layout):
+        if layout != LAYOUT_LIST:
+            raise Exception("Generic %s cannot have layout %s."%(
+                self.name, layout))
+        if len(self.lst_template_type) != 1:
+            raise Exception(
+                "Generic %s has layout list, so needs one template type."%(
+                    self.name))
+        self.layout = layout
+
     def add_template_type(self, name):
         if name in self.lst_template_type:
             raise Exception("Cannot have duplicate template type names.")
@@ -907,6 +1832,24 @@ class WandleGeneric:
     def get_class(self, cstring):
         return self.wandle_model.get_class(cstring=cstring)
 
+    def freeze(self, set_done):
+        if id(self) in set_done:
+            return
+        set_done.add(id(self))
+
+        for wandle_function in self.d_fab_async.values():
+            wandle_function.freeze(set_done=set_done)
+        for wandle_function in self.d_fab_sync.values():
+            wandle_function.freeze(set_done=set_done)
+        for wandle_object in self.d_object.values():
+            wandle_object.freeze(set_done=set_done)
+
+        self.lst_template_type = tuple(self.lst_template_type)
+        self.set_name = frozenset(self.set_name)
+        self.d_fab_async = MappingProxyType(self.d_fab_async)
+        self.d_fab_sync = MappingProxyType(self.d_fab_sync)
+        self.d_object = MappingProxyType(self.d_object)
+
     def as_code(self, name):
         sb = []
 
@@ -942,20 +1885,197 @@ class WandleFunction:
         self.lst_param = lst_param
 
         self.wtype = self.__class__.__name__
-
-        self.lst_statement = []
+        self.position = None
+
+        # From cost and budget in the grammar, in milliseconds. None where
+        # they were not given. Only flows have a budget. Where the cost is a
+        # distribution, cost_ms is its mean, and cost_dist has the detail.
+        self.cost_ms = None
+        self.cost_dist = None
+        self.budget_ms = None
+
+        # List<str>, from LST_EFFECT. Sorted, without repeats.
+        self.lst_effect = []
+
+        # List<str>. What the body returns, if it has a return statement.
+        self.return_dotref = None
+
+        # Bodies are checked lazily. The model holds on to the parse node,
+        # and we run populate_function the first time something asks for
+        # lst_statement.
+        self.node_body = None
+        self.wandle_model = None
+        self.b_has_body = False
+        self.b_checked = True
+        self._lst_statement = []
 
     def __repr__(self):
         return '<WandleFunction %s %s>'%(self.rtype.name, self.name)
 
+    @property
+    def lst_statement(self):
+        self.check_body()
+        return self._lst_statement
+
+    def set_body(self, node, wandle_model):
+        self.node_body = node
+        self.wandle_model = wandle_model
+        self.b_has_body = True
+        self.b_checked = False
+
+    def has_body(self):
+        return self.b_has_body
+
+    def check_body(self):
+        if self.b_checked:
+            return
+
+        # If this raises, we leave b_checked unset so that the error is
+        # raised again on the next request.
+        self._lst_statement = []
+        populate_function(
+            node=self.node_body,
+            wandle_model=self.wandle_model,
+            wandle_function=self)
+        self.b_checked = True
+
+    def get_body_callees(self):
+        '''
+        The functions called from the body. Each call is resolved through
+        the type of its receiver, the same way populate_function does, but
+        without checking the body. Calls that do not resolve are left out,
+        and checking the body will report them.
+        '''
+        lst_callee = []
+        if self.node_body == None:
+            # Bodies that came in already checked (see add_checked_body)
+            # have no parse tree, but they do have their statements.
+            for statement in self._lst_statement:
+                if statement.wandle_function != None:
+                    lst_callee.append(statement.wandle_function)
+            return lst_callee
+
+        local_scope = LocalScope(
+            wandle_model=self.wandle_model,
+            compile_container=self.compile_container)
+        for param in self.lst_param:
+            local_scope.set(
+                name=param.name,
+                wandle_object=param.wandle_class.as_wandle_object())
+        for our_node in self.node_body[1:-1]:
+            rule_name = our_node.rule_name
+            if rule_name in ('_cb_sync_from', '_cb_async_from'):
+                call = our_node[1]
+            elif rule_name in ('_cb_var_sync_set', '_cb_var_async_set'):
+                call = our_node[2]
+            else:
+                call = None
+
+            if call != None:
+                rhs_dotref = [n.value for n in call[1] if n != '.']
+                try:
+                    if call.rule_name == '_cb_async_call':
+                        callee = resolve_dotref_async_rhs(
+                            lst_dotref=rhs_dotref,
+                            local_scope=local_scope)
+                    else:
+                        callee = resolve_dotref_sync_only(
+                            lst_dotref=rhs_dotref,
+                            local_scope=local_scope)
+                except Exception:
+                    callee = None
+                if callee != None and callee.wtype == 'WandleFunction':
+                    lst_callee.append(callee)
+
+            if rule_name in ('_cb_var_stub', '_cb_var_ready',
+                    '_cb_var_sync_set', '_cb_var_async_set'):
+                wandle_class = local_scope.get_class(
+                    cstring=our_node[0].value)
+                if wandle_class != None:
+                    local_scope.set(
+                        name=our_node[1].value,
+                        wandle_object=wandle_class.as_wandle_object())
+        return lst_callee
+
+    def get_body_ready_names(self):
+        '''
+        Returns (set_write, set_read), read from the parse tree. set_write
+        has the last name of each var the body sets, and so marks ready.
+        set_read has the last name of each var the body passes to a sync
+        call, which must be ready.
+        '''
+        set_write = set()
+        set_read = set()
+        if self.node_body == None:
+            return (set_write, set_read)
+        for our_node in self.node_body[1:-1]:
+            if our_node.rule_name not in ('_cb_sync_copy', '_cb_sync_from'):
+                continue
+            set_write.add([n.value for n in our_node[0] if n != '.'][-1])
+            if our_node.rule_name == '_cb_sync_from':
+                for param_node in our_node[1][2][1:-1]:
+                    if param_node == ',':
+                        continue
+                    set_read.add(
+                        [n.value for n in param_node if n != '.'][-1])
+        return (set_write, set_read)
+
     def get_type(self):
         return self.rtype.name
 
+    def set_cost(self, cost_dist):
+        self.cost_dist = cost_dist
+        if cost_dist == None:
+            self.cost_ms = None
+        else:
+            self.cost_ms = cost_dist.mean_ms()
+
+    def set_effects(self, lst_effect):
+        for effect in lst_effect:
+            if effect not in LST_EFFECT:
+                raise Exception("Method %s cannot have effect %s."%(
+                    self.name, effect))
+        self.lst_effect = sorted(set(lst_effect))
+
     def is_async(self):
         return self.b_is_async
 
+    def freeze(self, set_done):
+        if id(self) in set_done:
+            return
+        set_done.add(id(self))
+
+        self.check_body()
+        self.lst_param = tuple(self.lst_param)
+        self.lst_effect = tuple(self.lst_effect)
+        for statement in self._lst_statement:
+            statement.freeze()
+        self._lst_statement = tuple(self._lst_statement)
+
     def add_statement(self, statement):
-        self.lst_statement.append(statement)
+        self._lst_statement.append(statement)
+        self.wandle_model.wandle_index.add_statement(
+            wandle_model=self.wandle_model,
+            wandle_function=self,
+            statement=statement)
+
+    def is_flow(self):
+        return self.compile_container.wtype == 'WandleModel'
+
+    def get_dataflow(self):
+        '''
+        The def-use graph of the body. See DataFlow.
+        '''
+        return DataFlow(self)
+
+    def get_qualified_name(self):
+        '''
+        Flows are known by their name. Methods are Owner.name, where the
+        owner is the class, single or generic that declared the method.
+        '''
+        if self.is_flow():
+            return self.name
+        return '%s.%s'%(self.compile_container.name, self.name)
 
     def generic_to_specific(self, d_tt):
         '''
@@ -988,6 +2108,8 @@ class WandleFunction:
             rtype=rtype,
             name=self.name,
             lst_param=lst_param)
+        wandle_function.set_cost(self.cost_dist)
+        wandle_function.set_effects(self.lst_effect)
         return wandle_function
 
     def as_code(self, name, b_flow):
@@ -1011,6 +2133,7 @@ class WandleObject:
         self.wandle_class = wandle_class
 
         self.wtype = self.__class__.__name__
+        self.position = None
 
         self.b_ready = False
         self.d_fab_async = {}
@@ -1054,6 +2177,22 @@ class WandleObject:
     def set_object(self, name, wandle_object):
         self.d_object[name] = wandle_object
 
+    def freeze(self, set_done):
+        if id(self) in set_done:
+            return
+        set_done.add(id(self))
+
+        for wandle_function in self.d_fab_async.values():
+            wandle_function.freeze(set_done=set_done)
+        for wandle_function in self.d_fab_sync.values():
+            wandle_function.freeze(set_done=set_done)
+        for wandle_object in self.d_object.values():
+            wandle_object.freeze(set_done=set_done)
+
+        self.d_fab_async = MappingProxyType(self.d_fab_async)
+        self.d_fab_sync = MappingProxyType(self.d_fab_sync)
+        self.d_object = MappingProxyType(self.d_object)
+
     def generic_to_specific(self, d_tt):
         '''
         Creates a clone instance of WandleFunction, with the generic
@@ -1098,6 +2237,7 @@ class WandleSingle:
         self.name = name
 
         self.wtype = self.__class__.__name__
+        self.position = None
 
         name = 'Single|%s'%(name)
         self.wandle_model.stub_specific(name)
@@ -1173,6 +2313,9 @@ class WandleVoid:
     def mark_ready(self):
         pass
 
+    def freeze(self, set_done):
+        pass
+
     def as_code(self, name):
         return '\n'.join([
             "# Void is built-in."])
@@ -1181,8 +2324,143 @@ class WandleVoid:
 # --------------------------------------------------------
 #   api
 # --------------------------------------------------------
-def wandle_model_build(parse_tree):
-    wandle_model = WandleModel()
+def _find_child(node, rule_name):
+    for sub in node:
+        if sub.rule_name == rule_name:
+            return sub
+    return None
+
+def effects_from_node(node_effect):
+    return [sub.value for sub in node_effect if sub.rule_name == '_effect_kind']
+
+def cost_dist_from_node(node_cost):
+    node = node_cost[1]
+    rule_name = node.rule_name
+    if rule_name == '_duration':
+        return CostDist(
+            kind=DIST_CONST,
+            value_ms=duration_as_ms(node.value))
+    elif rule_name == '_dist_exponential':
+        return CostDist(
+            kind=DIST_EXPONENTIAL,
+            value_ms=duration_as_ms(node[2].value))
+    elif rule_name == '_dist_lognormal':
+        return CostDist(
+            kind=DIST_LOGNORMAL,
+            value_ms=duration_as_ms(node[2].value),
+            sigma=float(node[4].value))
+    elif rule_name == '_dist_histogram':
+        lst_bin = []
+        for sub in node:
+            if sub.rule_name != '_hist_bin':
+                continue
+            lst_bin.append((duration_as_ms(sub[0].value), float(sub[2].value)))
+        if sum([w for (ms, w) in lst_bin]) <= 0:
+            raise Exception("Histogram weights must add up to more than zero.")
+        return CostDist(
+            kind=DIST_HISTOGRAM,
+            lst_bin=lst_bin)
+    raise Exception("rule_name %s not handled."%(rule_name))
+
+def build_class_inheritance_hierarchy(wandle_model):
+    d_depend_on = {} # key depends on lst of values
+    d_needed_by = {} # key is depended on by lst of values
+    lst_cname_nodep = []
+    set_cname_done = set()
+
+    d_specific = wandle_model.d_specific
+
+    # Populate d_depend_on
+    for (cname, wclass) in d_specific.items():
+        d_depend_on[cname] = [cstring for cstring in wclass.lst_inherits_from]
+
+    # Populate d_needed_by
+    for (cname, wclass) in d_specific.items():
+        d_needed_by[cname] = []
+    for (cname, wclass) in d_specific.items():
+        for cstring in wclass.lst_inherits_from:
+            d_needed_by[cstring].append(cname)
+
+    # Populate lst_cname_nodep
+    for (cname, wclass) in d_specific.items():
+        if not wclass.lst_inherits_from:
+            lst_cname_nodep.append(cname)
+
+    # Progressively process items from lst_cname_nodep into
+    # lst_cname_done.
+    while True:
+        if len(lst_cname_nodep) == 0:
+            break
+
+        for child_cname in lst_cname_nodep:
+            child_wcs = d_specific[child_cname]
+            for parent_cname in d_depend_on[child_cname]:
+                parent_wcs = d_specific[parent_cname]
+                for (mname, wandle_function) in parent_wcs.d_fab_async.items():
+                    if mname not in child_wcs.set_name:
+                        child_wcs.set_fab_async(
+                            name=mname,
+                            wandle_function=wandle_function)
+                for (mname, wandle_function) in parent_wcs.d_fab_sync.items():
+                    if mname not in child_wcs.set_name:
+                        child_wcs.set_fab_sync(
+                            name=mname,
+                            wandle_function=wandle_function)
+                for (mname, wandle_object) in parent_wcs.d_object.items():
+                    if mname not in child_wcs.set_name:
+                        child_wcs.set_object(
+                            name=mname,
+                            wandle_object=wandle_object)
+
+        for cname in lst_cname_nodep:
+            set_cname_done.add(cname)
+
+        # Prepare lst_cname_nodep ahead of the next loop
+        lst_old = lst_cname_nodep
+        lst_cname_nodep = []
+        for done_cname in lst_old:
+            for candidate_cname in d_needed_by[done_cname]:
+                b_ok = True
+                for other_cname in d_depend_on[candidate_cname]:
+                    if other_cname not in set_cname_done:
+                        b_ok = False
+                        break
+                if b_ok:
+                    lst_cname_nodep.append(candidate_cname)
+
+    if len(set_cname_done) != len(d_specific):
+        raise Exception(
+            "Did not process enough entries. %s/%s"%(
+                len(set_cname_done), len(d_specific)))
+
+def wandle_model_build(parse_tree, b_lazy=False, b_print_diagnostic=True):
+    '''
+    When b_lazy is set, function bodies are held on to but not type-checked.
+    They get checked the first time something asks for their statements.
+    Otherwise, every body is checked before we return.
+    '''
+    for (pass_name, wandle_model) in wandle_model_build_passes(
+            parse_tree=parse_tree,
+            b_lazy=b_lazy,
+            b_print_diagnostic=b_print_diagnostic):
+        pass
+    return wandle_model
+
+def wandle_model_build_passes(parse_tree, b_lazy=False, b_print_diagnostic=True,
+        wandle_model=None):
+    '''
+    Generator that builds the model one pass at a time. After each pass it
+    yields (pass_name, wandle_model). This lets a caller do other work, or
+    stop, in between passes. The model is only complete once the generator
+    is exhausted.
+
+    Callers that want to hold on to the model before the first pass is done
+    (for example, to read diagnostics after an exception) can pass in an
+    empty WandleModel.
+    '''
+    if wandle_model == None:
+        wandle_model = WandleModel(
+            b_print_diagnostic=b_print_diagnostic)
 
     #
     # :: First Pass
@@ -1197,7 +2475,12 @@ def wandle_model_build(parse_tree):
                 name = node[0][1].value
 
                 wandle_model.stub_specific(
-                    name=name)
+                    name=name,
+                    position=node[0][1].position)
+                node_layout = _find_child(node[0], '_layout')
+                if node_layout != None:
+                    wandle_model.d_specific[name].set_layout(
+                        node_layout[1].value)
             elif rule_name == '_generic_gram':
                 node = node[0]
 
@@ -1215,27 +2498,46 @@ def wandle_model_build(parse_tree):
 
                 wandle_model.stub_generic(
                     name=name,
-                    lst_template_type=lst_template_type)
+                    lst_template_type=lst_template_type,
+                    position=node[1].position)
+                node_layout = _find_child(node, '_layout')
+                if node_layout != None:
+                    wandle_model.d_generic[name].set_layout(
+                        node_layout[1].value)
             elif rule_name == '_single_gram':
                 node = node[0]
                 name = node[1].value
 
                 wandle_model.stub_single(
-                    name=name)
+                    name=name,
+                    position=node[1].position)
             elif rule_name == '_alias_gram':
                 tstring = node[1].value
                 name = node[3].value
 
-                wandle_model.set_alias(name=name, tstring=tstring)
+                wandle_model.set_alias(
+                    name=name,
+                    tstring=tstring,
+                    position=node[3].position)
             elif rule_name == '_flow_gram':
                 name = node[0][1].value
 
-                wandle_model.stub_flow(name=name)
+                budget_ms = None
+                node_budget = _find_child(node[0], '_budget')
+                if node_budget != None:
+                    budget_ms = duration_as_ms(node_budget[1].value)
+
+                wandle_model.stub_flow(
+                    name=name,
+                    position=node[0][1].position,
+                    budget_ms=budget_ms)
             elif rule_name == 'EOF':
                 continue
             else:
                 raise Exception("Unhandled, %s"%(rule_name))
-    first_pass(parse_tree)
+    for node in parse_tree:
+        _at_node(lambda n: first_pass([n]), node)
+    yield ('first_pass', wandle_model)
 
     #
     # :: Intermission: Type-check the alias entries
@@ -1244,6 +2546,7 @@ def wandle_model_build(parse_tree):
     # types for 'List' and 'Effect'.
     #
     wandle_model.validate_alias_entries()
+    yield ('validate_alias_entries', wandle_model)
 
     #
     # :: Second Pass
@@ -1256,7 +2559,7 @@ def wandle_model_build(parse_tree):
         rule_name = node.rule_name
         if rule_name == '_grammar':
             for sub in node:
-                recurs(sub)
+                _at_node(recurs, sub)
         #
         elif rule_name == '_alias_gram':
             return
@@ -1301,7 +2604,7 @@ def wandle_model_build(parse_tree):
             return
         elif rule_name == '_generic_impl':
             name = node[1].value
-            sub = node[3]
+            sub = node[-1]
 
             wandle_generic = wandle_model.get_generic(name=name)
             context_stack.append(wandle_generic)
@@ -1333,7 +2636,9 @@ def wandle_model_build(parse_tree):
 
             rtype = wandle_model.get_class(cstring=cstring)
             if rtype == None:
-                raise Exception("Invalid return type %s. (%s)"%(cstring, node))
+                raise BuildError(
+                    "Invalid return type %s."%(cstring),
+                    node[1].position)
 
             lst_param = []
             for (idx, sig_pair) in enumerate(method_sig[1:-1]):
@@ -1349,11 +2654,13 @@ def wandle_model_build(parse_tree):
                 wandle_class = wandle_model.get_class(
                     cstring=param_cstring)
                 if wandle_class == None:
-                    raise Exception(
-                        "Wandle class %s does not exist."%(param_cstring))
+                    raise BuildError(
+                        "Class %s does not exist."%(param_cstring),
+                        sig_pair[0].position)
                 param = Param(
                     wandle_class=wandle_class,
                     name=param_name)
+                param.position = sig_pair[1].position
                 lst_param.append(param)
 
             compile_container = wandle_context
@@ -1363,6 +2670,14 @@ def wandle_model_build(parse_tree):
                 rtype=rtype,
                 name=name,
                 lst_param=lst_param)
+            wandle_function.position = node[2].position
+            node_cost = _find_child(node, '_cost')
+            if node_cost != None:
+                wandle_function.set_cost(cost_dist_from_node(node_cost))
+            node_effect = _find_child(node, '_effect')
+            if node_effect != None:
+                wandle_function.set_effects(effects_from_node(node_effect))
+            wandle_model.wandle_index.add_signature(wandle_function)
             wandle_context.set_fab_async(
                 name=name,
                 wandle_function=wandle_function)
@@ -1375,7 +2690,9 @@ def wandle_model_build(parse_tree):
 
             rtype = wandle_model.get_class(cstring=cstring)
             if rtype == None:
-                raise Exception("Invalid return type %s. (%s)"%(cstring, node))
+                raise BuildError(
+                    "Invalid return type %s."%(cstring),
+                    node[1].position)
 
             lst_param = []
             for (idx, sig_pair) in enumerate(method_sig[1:-1]):
@@ -1388,10 +2705,13 @@ def wandle_model_build(parse_tree):
                 wandle_class = wandle_model.get_class(
                     cstring=param_cstring)
                 if wandle_class == None:
-                    raise Exception("Could not match %s"%(param_cstring))
+                    raise BuildError(
+                        "Class %s does not exist."%(param_cstring),
+                        sig_pair[0].position)
                 param = Param(
                     wandle_class=wandle_class,
                     name=param_name)
+                param.position = sig_pair[1].position
                 lst_param.append(param)
 
             compile_container = wandle_context
@@ -1401,6 +2721,14 @@ def wandle_model_build(parse_tree):
                 rtype=rtype,
                 name=name,
                 lst_param=lst_param)
+            wandle_function.position = node[2].position
+            node_cost = _find_child(node, '_cost')
+            if node_cost != None:
+                wandle_function.set_cost(cost_dist_from_node(node_cost))
+            node_effect = _find_child(node, '_effect')
+            if node_effect != None:
+                wandle_function.set_effects(effects_from_node(node_effect))
+            wandle_model.wandle_index.add_signature(wandle_function)
 
             wandle_context = context_stack[-1]
             wandle_context.set_fab_sync(
@@ -1411,7 +2739,12 @@ def wandle_model_build(parse_tree):
             name = node[1].value
 
             wandle_class = wandle_model.get_class(cstring=cstring)
+            if wandle_class == None:
+                raise BuildError(
+                    "Class %s does not exist."%(cstring),
+                    node[0].position)
             wandle_object = wandle_class.as_wandle_object()
+            wandle_object.position = node[1].position
             if rule_name == '_cgs_var_ready':
                 wandle_object.mark_ready()
 
@@ -1419,6 +2752,11 @@ def wandle_model_build(parse_tree):
             wandle_context.set_object(
                 name=name,
                 wandle_object=wandle_object)
+            wandle_model.wandle_index.add_type_use(
+                cstring=wandle_class.name,
+                kind=USE_FIELD,
+                where='%s.%s'%(wandle_context.name, name),
+                position=node[1].position)
         elif rule_name == '_flow_gram':
             pass
         elif rule_name == 'EOF':
@@ -1426,6 +2764,7 @@ def wandle_model_build(parse_tree):
         else:
             raise Exception("rule_name |%s| not handled."%(rule_name))
     recurs(parse_tree)
+    yield ('second_pass', wandle_model)
 
     #
     # :: Intermission: update the contents of generic-derived classes.
@@ -1433,6 +2772,7 @@ def wandle_model_build(parse_tree):
     # This is so they can pick up the contents that we processed above
     #
     wandle_model.populate_specific_classes_derived_from_generics()
+    yield ('populate_specific_classes_derived_from_generics', wandle_model)
 
     #
     # :: Intermission: build an inheritance hierarchy
@@ -1443,82 +2783,15 @@ def wandle_model_build(parse_tree):
     # This implementation is inefficient from a Big-O perspective. Revisit if
     # we bottleneck.
     #
-    def build_class_inheritance_hierarchy():
-        d_depend_on = {} # key depends on lst of values
-        d_needed_by = {} # key is depended on by lst of values
-        lst_cname_nodep = []
-        set_cname_done = set()
-
-        d_specific = wandle_model.d_specific
-
-        # Populate d_depend_on
-        for (cname, wclass) in d_specific.items():
-            d_depend_on[cname] = [cstring for cstring in wclass.lst_inherits_from]
-
-        # Populate d_needed_by
-        for (cname, wclass) in d_specific.items():
-            d_needed_by[cname] = []
-        for (cname, wclass) in d_specific.items():
-            for cstring in wclass.lst_inherits_from:
-                d_needed_by[cstring].append(cname)
-
-        # Populate lst_cname_nodep
-        for (cname, wclass) in d_specific.items():
-            if not wclass.lst_inherits_from:
-                lst_cname_nodep.append(cname)
-
-        # Progressively process items from lst_cname_nodep into
-        # lst_cname_done.
-        while True:
-            if len(lst_cname_nodep) == 0:
-                break
-
-            for child_cname in lst_cname_nodep:
-                child_wcs = d_specific[child_cname]
-                for parent_cname in d_depend_on[child_cname]:
-                    parent_wcs = d_specific[parent_cname]
-                    for (mname, wandle_function) in parent_wcs.d_fab_async.items():
-                        if mname not in child_wcs.set_name:
-                            child_wcs.set_fab_async(
-                                name=mname,
-                                wandle_function=wandle_function)
-                    for (mname, wandle_function) in parent_wcs.d_fab_sync.items():
-                        if mname not in child_wcs.set_name:
-                            child_wcs.set_fab_sync(
-                                name=mname,
-                                wandle_function=wandle_function)
-                    for (mname, wandle_object) in parent_wcs.d_object.items():
-                        if mname not in child_wcs.set_name:
-                            child_wcs.set_object(
-                                name=mname,
-                                wandle_object=wandle_object)
-
-            for cname in lst_cname_nodep:
-                set_cname_done.add(cname)
-
-            # Prepare lst_cname_nodep ahead of the next loop
-            lst_old = lst_cname_nodep
-            lst_cname_nodep = []
-            for done_cname in lst_old:
-                for candidate_cname in d_needed_by[done_cname]:
-                    b_ok = True
-                    for other_cname in d_depend_on[candidate_cname]:
-                        if other_cname not in set_cname_done:
-                            b_ok = False
-                            break
-                    if b_ok:
-                        lst_cname_nodep.append(candidate_cname)
-
-        if len(set_cname_done) != len(d_specific):
-            raise Exception(
-                "Did not process enough entries. %s/%s"%(
-                    len(set_cname_done), len(d_class_specific)))
-    build_class_inheritance_hierarchy()
+    build_class_inheritance_hierarchy(wandle_model)
+    yield ('build_class_inheritance_hierarchy', wandle_model)
 
     #
     # :: Third Pass
     #
-    # Harvest source code blocks into Functions and Statements.
+    # Harvest source code blocks into Functions and Statements. We attach
+    # each code block to its function here. Type-checking happens in
+    # check_body.
     #
     stack = [wandle_model]
     def recurs(node):
@@ -1526,7 +2799,7 @@ def wandle_model_build(parse_tree):
         if rule_name == '_grammar':
             # This is the top-level block.
             for sub in node:
-                recurs(sub)
+                _at_node(recurs, sub)
         elif rule_name == '_alias_gram':
             pass
         elif rule_name == '_class_gram':
@@ -1558,7 +2831,7 @@ def wandle_model_build(parse_tree):
             pass
         elif rule_name == '_generic_impl':
             fname = node[1].value
-            sub = node[3]
+            sub = node[-1]
 
             wandle_generic = stack[-1].d_generic[fname]
             stack.append(wandle_generic)
@@ -1588,6 +2861,11 @@ def wandle_model_build(parse_tree):
             sub = node[-1]
 
             wandle_container = stack[-1]
+            if wandle_container.wtype == 'WandleGeneric':
+                raise BuildError(
+                    "Method %s of generic %s cannot have a body."%(
+                        mname, wandle_container.name),
+                    node[2].position)
             member = wandle_container.get_async(mname)
             stack.append(member)
             recurs(sub)
@@ -1597,6 +2875,11 @@ def wandle_model_build(parse_tree):
             sub = node[-1]
 
             wandle_container = stack[-1]
+            if wandle_container.wtype == 'WandleGeneric':
+                raise BuildError(
+                    "Method %s of generic %s cannot have a body."%(
+                        mname, wandle_container.name),
+                    node[2].position)
             member = wandle_container.get_sync(mname)
             stack.append(member)
             recurs(sub)
@@ -1605,7 +2888,7 @@ def wandle_model_build(parse_tree):
             pass
         elif rule_name == '_flow_impl':
             flow_name = node[1].value
-            sub = node[2]
+            sub = node[-1]
 
             wandle_flow = wandle_model.d_flow[flow_name]
             stack.append(wandle_flow)
@@ -1613,14 +2896,16 @@ def wandle_model_build(parse_tree):
             stack.pop()
         elif rule_name == '_cb_grammar':
             wandle_function = stack[-1]
-            populate_function(
-                node=node,
-                wandle_model=wandle_model,
-                wandle_function=wandle_function)
+            wandle_model.add_function_body(
+                wandle_function=wandle_function,
+                node=node)
         elif rule_name == 'EOF':
             pass
         else:
             raise Exception("rule_name %s not handled."%(rule_name))
     recurs(parse_tree)
+    yield ('third_pass', wandle_model)
 
-    return wandle_model
+    if not b_lazy:
+        wandle_model.check_all()
+        yield ('check_all', wandle_model)
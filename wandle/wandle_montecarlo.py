@@ -0,0 +1,255 @@
+#
+# Monte Carlo simulation of flow latency, from cost distributions.
+#
+# Each method's cost (see CostDist) is sampled many times at once, as a
+# numpy array, and the arrays are combined in the same way as the static
+# analysis in function_latency: a sync call adds the callee's return time to
+# the caller's clock, and an async send starts the callee at the current
+# time without the caller waiting. A flow is done when the last of the work
+# it started has finished. That gives an array of flow latencies, and we
+# report its percentiles.
+#
+# A method's body is evaluated once per flow, and then reused at each of the
+# places it is called from. Reuse rolls the sample arrays by a random
+# offset, so that two calls to the same method get unrelated draws. The
+# result for a method is dropped as soon as its last caller has used it.
+# Samples are worked in chunks, so memory stays flat however many samples
+# are asked for.
+#
+# Drawing from numpy's generators is the expensive part. So, for each chunk
+# we draw one pool each of standard normal, standard exponential and uniform
+# values, and every cost is a transform of a pool rolled by a random
+# offset. The arithmetic is in float32, which is plenty for milliseconds
+# and about twice as fast.
+#
+
+from .wandle_model import DIST_CONST
+from .wandle_model import DIST_EXPONENTIAL
+from .wandle_model import DIST_HISTOGRAM
+from .wandle_model import DIST_LOGNORMAL
+from .wandle_model import STYPE_ASYNC_LHS_RHS
+
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+CHUNK_SIZE = 65536
+LST_PERCENTILE = [50.0, 95.0, 99.0, 99.9]
+
+
+def _require_numpy():
+    if np == None:
+        raise Exception("This needs numpy. pip install numpy")
+
+def percentile_label(p):
+    return 'p%s'%(('%g'%(p)))
+
+
+class MonteCarlo:
+
+    def __init__(self, wandle_model, rng):
+        self.wandle_model = wandle_model
+        self.rng = rng
+
+        # Pools for the current chunk. See refill.
+        self.arr_normal = None
+        self.arr_exponential = None
+        self.arr_uniform = None
+        # id(CostDist) vs (arr_ms, arr_cdf), for histograms.
+        self.d_histogram = {}
+
+        # id(WandleFunction) vs number of call sites still to be served
+        # from d_memo.
+        self.d_use = {}
+        # id(WandleFunction) vs (arr_ret, arr_done)
+        self.d_memo = {}
+        self.lst_stack = []
+
+    def refill(self, n):
+        rng = self.rng
+        self.arr_normal = rng.standard_normal(n, dtype=np.float32)
+        self.arr_exponential = rng.standard_exponential(n, dtype=np.float32)
+        self.arr_uniform = rng.random(n, dtype=np.float32)
+
+    def __pool(self, arr):
+        '''
+        A rotated copy of one of the pools. Callers scale it in place, so
+        it must never be the pool itself.
+        '''
+        n = arr.size
+        if n < 2:
+            return arr.copy()
+        return np.roll(arr, int(self.rng.integers(1, n)))
+
+    def cost_sample(self, cost_dist, n):
+        '''
+        Returns n draws from cost_dist, in ms.
+        '''
+        kind = cost_dist.kind
+        if kind == DIST_CONST:
+            return np.full(n, cost_dist.value_ms, dtype=np.float32)
+        elif kind == DIST_EXPONENTIAL:
+            arr = self.__pool(self.arr_exponential)
+            arr *= np.float32(cost_dist.value_ms)
+            return arr
+        elif kind == DIST_LOGNORMAL:
+            arr = self.__pool(self.arr_normal)
+            arr *= np.float32(cost_dist.sigma)
+            arr += np.float32(math.log(cost_dist.value_ms))
+            return np.exp(arr, out=arr)
+        elif kind == DIST_HISTOGRAM:
+            key = id(cost_dist)
+            if key not in self.d_histogram:
+                arr_ms = np.array(
+                    [ms for (ms, w) in cost_dist.lst_bin], dtype=np.float32)
+                arr_cdf = np.cumsum([w for (ms, w) in cost_dist.lst_bin])
+                arr_cdf = (arr_cdf / arr_cdf[-1]).astype(np.float32)
+                self.d_histogram[key] = (arr_ms, arr_cdf)
+            (arr_ms, arr_cdf) = self.d_histogram[key]
+            arr_idx = np.searchsorted(arr_cdf, self.__pool(self.arr_uniform),
+                side='right')
+            return arr_ms[np.minimum(arr_idx, arr_ms.size - 1)]
+        raise Exception("Unhandled distribution %s"%(kind))
+
+    def __count_uses(self, wandle_flow):
+        self.d_use = {}
+        set_seen = set()
+        lst_todo = [wandle_flow]
+        while lst_todo:
+            wandle_function = lst_todo.pop()
+            if id(wandle_function) in set_seen:
+                continue
+            set_seen.add(id(wandle_function))
+            for statement in wandle_function.lst_statement:
+                callee = statement.wandle_function
+                if callee == None or not callee.has_body():
+                    continue
+                key = id(callee)
+                self.d_use[key] = self.d_use.get(key, 0) + 1
+                lst_todo.append(callee)
+
+    def __draw(self, wandle_function, n):
+        '''
+        Returns (arr_ret, arr_done) for one call site, or None if the call
+        costs nothing.
+        '''
+        if not wandle_function.has_body():
+            if wandle_function.cost_dist == None:
+                return None
+            arr = self.cost_sample(wandle_function.cost_dist, n)
+            return (arr, arr)
+
+        key = id(wandle_function)
+        if key in self.d_memo:
+            (arr_ret, arr_done) = self.d_memo[key]
+            self.d_use[key] -= 1
+            if self.d_use[key] <= 0:
+                del self.d_memo[key]
+            if arr_ret is None:
+                return None
+            shift = int(self.rng.integers(1, n)) if n > 1 else 0
+            return (np.roll(arr_ret, shift), np.roll(arr_done, shift))
+
+        for entry in self.lst_stack:
+            if entry is wandle_function:
+                # Recursion. As with the static analysis, the inner call is
+                # free.
+                return None
+
+        result = self.__evaluate(wandle_function, n)
+        self.d_use[key] = self.d_use.get(key, 1) - 1
+        if self.d_use[key] > 0:
+            if result == None:
+                self.d_memo[key] = (None, None)
+            else:
+                self.d_memo[key] = result
+        return result
+
+    def __evaluate(self, wandle_function, n):
+        self.lst_stack.append(wandle_function)
+        if wandle_function.cost_dist == None:
+            arr_t = np.zeros(n, dtype=np.float32)
+        else:
+            arr_t = self.cost_sample(wandle_function.cost_dist, n)
+        arr_done = arr_t.copy()
+        b_any = wandle_function.cost_dist != None
+        for statement in wandle_function.lst_statement:
+            callee = statement.wandle_function
+            if callee == None:
+                continue
+            sub = self.__draw(callee, n)
+            if sub == None:
+                continue
+            b_any = True
+            (sub_ret, sub_done) = sub
+            np.maximum(arr_done, arr_t + sub_done, out=arr_done)
+            if statement.stype != STYPE_ASYNC_LHS_RHS:
+                arr_t = arr_t + sub_ret
+        self.lst_stack.pop()
+        if not b_any:
+            return None
+        return (arr_t, arr_done)
+
+    def run_flow(self, flow_name, n_samples, b_return=False):
+        '''
+        Returns a dict with the mean and percentiles of the flow's latency,
+        in ms. By default that is the time until everything the flow
+        started is done. With b_return, it is the time until the flow's own
+        statements finish, not counting the async work it sent off.
+        '''
+        wandle_flow = self.wandle_model.d_flow[flow_name]
+        self.__count_uses(wandle_flow)
+
+        lst_chunk = []
+        remaining = n_samples
+        while remaining > 0:
+            n = min(CHUNK_SIZE, remaining)
+            remaining -= n
+            self.d_memo = {}
+            self.refill(n)
+            d_use = dict(self.d_use)
+            result = self.__evaluate(wandle_flow, n)
+            self.d_use = d_use
+            if result == None:
+                lst_chunk.append(np.zeros(n, dtype=np.float32))
+            elif b_return:
+                lst_chunk.append(result[0])
+            else:
+                lst_chunk.append(result[1])
+        arr = np.concatenate(lst_chunk)
+
+        d = {
+            'flow': flow_name,
+            'samples': n_samples,
+            'mean_ms': float(arr.mean(dtype=np.float64)),
+        }
+        arr_p = np.percentile(arr, LST_PERCENTILE)
+        for (p, value) in zip(LST_PERCENTILE, arr_p):
+            d[percentile_label(p)] = float(value)
+        return d
+
+
+def montecarlo_run(wandle_model, n_samples=1000000, lst_flow_name=None,
+        seed=None, b_return=False):
+    '''
+    Simulates each flow n_samples times. Returns a list of dicts, one per
+    flow, in flow order. See MonteCarlo.run_flow.
+    '''
+    _require_numpy()
+    wandle_model.check_all()
+    if lst_flow_name == None:
+        lst_flow_name = list(wandle_model.d_flow.keys())
+
+    monte_carlo = MonteCarlo(
+        wandle_model=wandle_model,
+        rng=np.random.default_rng(seed))
+    return [
+        monte_carlo.run_flow(
+            flow_name=flow_name,
+            n_samples=n_samples,
+            b_return=b_return)
+        for flow_name in lst_flow_name]
@@ -0,0 +1,396 @@
+#
+# Generates compact Python data classes from the fields of a model.
+#
+# Every class, single and generic instantiation gets one class, all in one
+# module. Each has __slots__, so instances carry no per-instance dict.
+# Inheritance is flattened: a class holds its parents' fields, parents
+# first, and then its own. The generated classes do not inherit from each
+# other, as slotted bases with fields of their own cannot be mixed freely.
+#
+# Instantiations are named after the generic and its type arguments, so
+# Map/String,Person becomes Map_String_Person. A single becomes a class,
+# _Name, and one instance of it under the single's name.
+#
+# Some stub classes stand for Python values (see D_PY_PRIMITIVE, and the
+# layouts that stub classes declare) and get no class of their own. With
+# b_struct, a class whose fields are all primitive with a struct code (see
+# D_STRUCT_CODE) becomes a record over a buffer, packed with the struct
+# module. Each such class also gets an array class, which keeps n records
+# in one bytearray, and hands out records that view into it.
+#
+
+from .wandle_model import D_LAYOUT_CODE
+from .wandle_model import LAYOUT_UTF8
+from .wandle_pygen import INDENT
+from .wandle_pygen import py_name
+
+import re
+import struct
+
+
+# Stub class name vs the Python type that stands for it.
+D_PY_PRIMITIVE = {
+    'Bool': 'bool',
+    'Byte': 'int',
+    'Char': 'str',
+    'Float': 'float',
+    'Int': 'int',
+    'String': 'str',
+}
+
+# Stub class name vs struct format code, for struct-backed records.
+D_STRUCT_CODE = {
+    'Bool': '?',
+    'Byte': 'B',
+    'Float': 'd',
+    'Int': 'q',
+}
+
+RE_NOT_IDENT = re.compile(r'[^0-9A-Za-z_]')
+
+
+def layout_py_type(layout):
+    '''
+    The Python type for values of a wire layout. See D_LAYOUT_CODE.
+    '''
+    if layout == LAYOUT_UTF8:
+        return 'str'
+    if layout == 'bool':
+        return 'bool'
+    if layout.startswith('f'):
+        return 'float'
+    return 'int'
+
+
+def data_name(cstring):
+    '''
+    Map/String,Person becomes Map_String_Person.
+    '''
+    return py_name(RE_NOT_IDENT.sub('_', cstring))
+
+def flat_fields(wandle_model, wandle_class):
+    '''
+    List of (name, WandleObject) for all the fields of wandle_class,
+    inherited ones first, in declaration order.
+    '''
+    lst_field = []
+    set_seen = set()
+    lst_todo = [(wandle_class, False)]
+    while lst_todo:
+        (cls, b_expanded) = lst_todo.pop()
+        if not b_expanded:
+            lst_todo.append((cls, True))
+            for parent_name in reversed(cls.lst_inherits_from):
+                lst_todo.append((wandle_model.d_specific[parent_name], False))
+            continue
+        for (name, wandle_object) in cls.get_declared_objects().items():
+            if name in set_seen:
+                continue
+            set_seen.add(name)
+            lst_field.append((name, wandle_object))
+    return lst_field
+
+
+class PyData:
+
+    def __init__(self, wandle_model, b_struct=False, d_primitive=None,
+            d_struct_code=None):
+        self.wandle_model = wandle_model
+        self.b_struct = b_struct
+        self.d_primitive = dict(D_PY_PRIMITIVE)
+        self.d_struct_code = dict(D_STRUCT_CODE)
+        # Layouts declared in the model come ahead of the defaults, and
+        # the caller's ahead of both.
+        for (name, wandle_class) in wandle_model.d_specific.items():
+            if wandle_class.layout == None:
+                continue
+            self.d_primitive[name] = layout_py_type(wandle_class.layout)
+            code = D_LAYOUT_CODE[wandle_class.layout]
+            if code == None:
+                self.d_struct_code.pop(name, None)
+            else:
+                self.d_struct_code[name] = code
+        self.d_primitive.update(d_primitive or {})
+        self.d_struct_code.update(d_struct_code or {})
+
+        self.lst_line = []
+
+        # Struct format vs the name of a module-level struct for it.
+        self.d_code_struct = {}
+        # Modules that the generated module imports.
+        self.set_import = set()
+
+        # Class name, or cstring for instantiations, vs generated name.
+        self.d_name = {}
+        self.set_taken = set()
+        for name in self.class_names():
+            self.d_name[name] = self.__claim(data_name(name))
+        for name in wandle_model.d_single.keys():
+            self.d_name['Single|%s'%(name)] = self.__claim('_%s'%(name))
+            self.set_taken.add(name)
+
+    def __claim(self, s):
+        candidate = s
+        idx = 2
+        while candidate in self.set_taken:
+            candidate = '%s%s'%(s, idx)
+            idx += 1
+        self.set_taken.add(candidate)
+        return candidate
+
+    def class_names(self):
+        lst_name = []
+        for (name, wandle_class) in self.wandle_model.d_specific.items():
+            if wandle_class.b_placeholder:
+                continue
+            if name == 'Void' or name.startswith('Single|'):
+                continue
+            if name in self.d_primitive:
+                continue
+            lst_name.append(name)
+        return lst_name
+
+    def add(self, depth, line):
+        if line:
+            self.lst_line.append(INDENT * depth + line)
+        else:
+            self.lst_line.append('')
+
+    def signature(self, depth, name, lst_param):
+        line = 'def %s(%s):'%(name, ', '.join(lst_param))
+        if len(INDENT * depth + line) < 80:
+            self.add(depth, line)
+            return
+        self.add(depth, 'def %s('%(name))
+        for param in lst_param[:-1]:
+            self.add(depth + 2, param + ',')
+        self.add(depth + 2, lst_param[-1] + '):')
+
+    def py_type(self, cstring):
+        if cstring in self.d_primitive:
+            return self.d_primitive[cstring]
+        if cstring in self.d_name:
+            return self.d_name[cstring]
+        return 'object'
+
+    def struct_codes(self, lst_field):
+        '''
+        Struct codes for lst_field, or None if any field has no code.
+        '''
+        if not lst_field:
+            return None
+        lst_code = []
+        for (name, tstring) in lst_field:
+            code = self.d_struct_code.get(tstring)
+            if code == None:
+                return None
+            lst_code.append(code)
+        return lst_code
+
+    def code_struct(self, code):
+        if code not in self.d_code_struct:
+            self.d_code_struct[code] = '_S%s'%(len(self.d_code_struct))
+        return self.d_code_struct[code]
+
+    # --------------------------------------------------------
+    #   classes
+    # --------------------------------------------------------
+    def slotted_class(self, name, lst_field):
+        lst_py = [py_name(f) for (f, tstring) in lst_field]
+        self.add(0, 'class %s:'%(name))
+        if not lst_field:
+            self.add(1, '__slots__ = ()')
+            return
+        if len(lst_py) == 1:
+            self.add(1, "__slots__ = ('%s',)"%(lst_py[0]))
+        else:
+            self.add(1, '__slots__ = (%s)'%(
+                ', '.join(["'%s'"%(s) for s in lst_py])))
+        self.add(0, '')
+        lst_param = []
+        for (idx, (f, tstring)) in enumerate(lst_field):
+            lst_param.append('%s: %s = None'%(
+                lst_py[idx], self.py_type(tstring)))
+        self.signature(1, '__init__', ['self'] + lst_param)
+        for s in lst_py:
+            self.add(2, 'self.%s = %s'%(s, s))
+        self.add(0, '')
+        self.add(1, 'def __repr__(self):')
+        self.add(2, "return '%s(%s)'%(type(self).__name__, ', '.join(")
+        self.add(3, "'%s=%r'%(s, getattr(self, s)) for s in self.__slots__))")
+        self.add(0, '')
+        self.add(1, 'def __eq__(self, other):')
+        self.add(2, 'if type(other) is not type(self):')
+        self.add(3, 'return NotImplemented')
+        self.add(2, 'return all(')
+        self.add(3, 'getattr(self, s) == getattr(other, s)')
+        self.add(3, 'for s in self.__slots__)')
+
+    def struct_class(self, name, lst_field, lst_code):
+        lst_py = [py_name(f) for (f, tstring) in lst_field]
+        self.add(0, 'class %s:'%(name))
+        self.add(1, "__slots__ = ('_buf', '_off')")
+        self.add(1, "_struct = struct.Struct('<%s')"%(''.join(lst_code)))
+        self.add(1, 'size = _struct.size')
+        self.add(0, '')
+        lst_param = []
+        for (idx, (f, tstring)) in enumerate(lst_field):
+            lst_param.append('%s: %s = 0'%(
+                lst_py[idx], self.py_type(tstring)))
+        self.signature(1, '__init__', ['self'] + lst_param + [
+            '_buf=None', '_off=0'])
+        self.add(2, 'if _buf is None:')
+        self.add(3, '_buf = bytearray(self.size)')
+        self.add(3, 'self._struct.pack_into(_buf, 0, %s)'%(', '.join(lst_py)))
+        self.add(2, 'self._buf = _buf')
+        self.add(2, 'self._off = _off')
+        self.add(0, '')
+        self.add(1, 'def __repr__(self):')
+        self.add(2, "return '%s(%s)'%%self.astuple()"%(
+            name,
+            ', '.join(['%s=%%r'%(s) for s in lst_py])))
+        self.add(0, '')
+        self.add(1, 'def __eq__(self, other):')
+        self.add(2, 'if type(other) is not type(self):')
+        self.add(3, 'return NotImplemented')
+        self.add(2, 'return self.astuple() == other.astuple()')
+        self.add(0, '')
+        self.add(1, 'def astuple(self):')
+        self.add(2, 'return self._struct.unpack_from(self._buf, self._off)')
+        offset = 0
+        for (idx, s) in enumerate(lst_py):
+            code = lst_code[idx]
+            s_struct = self.code_struct(code)
+            if offset:
+                s_off = 'self._off + %s'%(offset)
+            else:
+                s_off = 'self._off'
+            self.add(0, '')
+            self.add(1, '@property')
+            self.add(1, 'def %s(self):'%(s))
+            self.add(2, 'return %s.unpack_from(self._buf, %s)[0]'%(
+                s_struct, s_off))
+            self.add(0, '')
+            self.add(1, '@%s.setter'%(s))
+            self.add(1, 'def %s(self, value):'%(s))
+            self.add(2, '%s.pack_into(self._buf, %s, value)'%(s_struct, s_off))
+            offset += struct.calcsize('<%s'%(code))
+
+        array_name = self.__claim('%sArray'%(name))
+        self.add(0, '')
+        self.add(0, '')
+        self.add(0, 'class %s:'%(array_name))
+        self.add(1, "'''")
+        self.add(1, 'n %s records in one buffer.'%(name))
+        self.add(1, "'''")
+        self.add(1, "__slots__ = ('_buf', '_n')")
+        self.add(0, '')
+        self.add(1, 'def __init__(self, n):')
+        self.add(2, 'self._buf = bytearray(n * %s.size)'%(name))
+        self.add(2, 'self._n = n')
+        self.add(0, '')
+        self.add(1, 'def __len__(self):')
+        self.add(2, 'return self._n')
+        self.add(0, '')
+        self.add(1, 'def __getitem__(self, idx):')
+        self.add(2, 'if idx < 0:')
+        self.add(3, 'idx += self._n')
+        self.add(2, 'if not 0 <= idx < self._n:')
+        self.add(3, 'raise IndexError(idx)')
+        self.add(2, 'return %s(_buf=self._buf, _off=idx * %s.size)'%(
+            name, name))
+        self.add(0, '')
+        self.add(1, 'def __iter__(self):')
+        self.add(2, 'for idx in range(self._n):')
+        self.add(3, 'yield self[idx]')
+
+    def field_types(self, cstring, lst_field):
+        '''
+        lst_field as (name, type string). Fields of an instantiation still
+        have the generic's template types in the model, so we substitute
+        the type arguments here.
+        '''
+        d_tt = {}
+        if '/' in cstring:
+            (gname, s_args) = cstring.split('/', 1)
+            wandle_generic = self.wandle_model.d_generic[gname]
+            d_tt = dict(zip(
+                wandle_generic.lst_template_type,
+                s_args.split(',')))
+        lst = []
+        for (name, wandle_object) in lst_field:
+            tstring = wandle_object.get_type()
+            lst.append((name, d_tt.get(tstring, tstring)))
+        return lst
+
+    def declaration(self, name, lst_field):
+        lst_code = None
+        if self.b_struct:
+            lst_code = self.struct_codes(lst_field)
+        if lst_code != None:
+            self.struct_class(name, lst_field, lst_code)
+        else:
+            self.slotted_class(name, lst_field)
+
+    def generate(self):
+        for cstring in self.class_names():
+            wandle_class = self.wandle_model.d_specific[cstring]
+            self.declaration(
+                self.d_name[cstring],
+                self.field_types(
+                    cstring,
+                    flat_fields(self.wandle_model, wandle_class)))
+            self.add(0, '')
+            self.add(0, '')
+        for (name, wandle_single) in self.wandle_model.d_single.items():
+            wandle_class = wandle_single.wandle_class
+            class_name = self.d_name[wandle_class.name]
+            self.declaration(
+                class_name,
+                self.field_types(
+                    wandle_class.name,
+                    list(wandle_class.d_object.items())))
+            self.add(0, '')
+            self.add(0, '')
+            self.add(0, '%s = %s()'%(name, class_name))
+            self.add(0, '')
+            self.add(0, '')
+
+    def lines(self):
+        self.wandle_model.check_all()
+        self.lst_line = []
+        self.generate()
+
+        yield '#'
+        yield '# Generated by wandle.'
+        yield '#'
+        yield ''
+        yield 'from __future__ import annotations'
+        if self.d_code_struct:
+            self.set_import.add('struct')
+        if self.set_import:
+            yield ''
+            for name in sorted(self.set_import):
+                yield 'import %s'%(name)
+        if self.d_code_struct:
+            yield ''
+            for (code, s_struct) in self.d_code_struct.items():
+                yield "%s = struct.Struct('<%s')"%(s_struct, code)
+        yield ''
+        yield ''
+        # Drop the blank lines after the last declaration.
+        while self.lst_line and self.lst_line[-1] == '':
+            self.lst_line.pop()
+        for line in self.lst_line:
+            yield line
+
+
+def pydata_write(f_out, wandle_model, b_struct=False, d_primitive=None,
+        d_struct_code=None):
+    py_data = PyData(
+        wandle_model=wandle_model,
+        b_struct=b_struct,
+        d_primitive=d_primitive,
+        d_struct_code=d_struct_code)
+    for line in py_data.lines():
+        f_out.write(line + '\n')
@@ -0,0 +1,499 @@
+#
+# Generates Python asyncio skeletons from a model.
+#
+# Each declaration group becomes one module in a package: one per class,
+# generic and single, and a flows module for the flows. Flows and async
+# methods become async defs. Sync methods become plain methods. A single
+# becomes a class, and one instance of it under the single's name.
+#
+# Every async send (<<) is awaited. Sends that do not depend on each other
+# (see DataFlow) are awaited together with asyncio.gather, rather than one
+# after another. A group stays open across notes, var declarations and
+# copies that do not touch it, so those can come out ahead of the await.
+# It closes at the next sync call, or at anything that depends on a send in
+# the group.
+#
+# Functions import the modules they use inside their own bodies, as in
+# _person.Person(). Models have cycles and long chains between classes, and
+# importing at the top of each module would follow them all on the first
+# import. Only base classes are imported at the top. The underscore keeps
+# modules clear of local names. Output is in model order, so the same model
+# always gives the same files. Each module is written out as soon as it is
+# generated.
+#
+
+from .wandle_model import STYPE_ASYNC_LHS_RHS
+from .wandle_model import STYPE_NOTE_CONTENT
+from .wandle_model import STYPE_SYNC_LHS_RHS
+from .wandle_model import STYPE_SYNC_VAR_NUL
+from .wandle_model import STYPE_SYNC_VAR_VAL
+
+import builtins
+import keyword
+import os
+import re
+
+
+INDENT = '    '
+FLOWS_MODULE = 'flows'
+
+RE_CAMEL = re.compile(r'(?<=[a-z0-9])(?=[A-Z])')
+
+
+def py_name(name):
+    '''
+    A Wandle name, safe to use as a Python identifier.
+    '''
+    if keyword.iskeyword(name):
+        return name + '_'
+    return name
+
+def module_name(name):
+    '''
+    PixelGrid becomes pixel_grid. Names that would shadow a builtin or a
+    keyword get a trailing underscore.
+    '''
+    s = RE_CAMEL.sub('_', name).lower()
+    if keyword.iskeyword(s) or hasattr(builtins, s) or s == FLOWS_MODULE:
+        s = s + '_'
+    return s
+
+def py_type(cstring):
+    '''
+    Map/String,Person becomes Map[String, Person]. Void becomes None.
+    '''
+    if cstring == 'Void':
+        return 'None'
+    if '/' in cstring:
+        (gname, s_args) = cstring.split('/', 1)
+        return '%s[%s]'%(gname, ', '.join(s_args.split(',')))
+    return cstring
+
+
+class PyModule:
+    # The lines of one generated module, and the modules it imports.
+
+    def __init__(self, name):
+        self.name = name
+        self.header = 'Generated by wandle. Fill in the bodies.'
+        self.lst_line = []
+        self.set_import = set()
+        # Standard library modules.
+        self.set_std_import = set()
+        self.b_asyncio = False
+        self.b_typing = False
+
+    def add(self, depth, line):
+        if line:
+            self.lst_line.append(INDENT * depth + line)
+        else:
+            self.lst_line.append('')
+
+    def lines(self):
+        yield '#'
+        yield '# %s'%(self.header)
+        yield '#'
+        yield ''
+        yield 'from __future__ import annotations'
+        lst_import = [
+            'from . import %s as _%s'%(name, name)
+            for name in sorted(self.set_import)]
+        set_std_import = set(self.set_std_import)
+        if self.b_asyncio:
+            set_std_import.add('asyncio')
+        if self.b_typing:
+            set_std_import.add('typing')
+        for name in sorted(set_std_import):
+            lst_import.append('import %s'%(name))
+        if lst_import:
+            yield ''
+            for line in lst_import:
+                yield line
+        yield ''
+        yield ''
+        for line in self.lst_line:
+            yield line
+
+
+class PyGen:
+
+    def __init__(self, wandle_model):
+        self.wandle_model = wandle_model
+
+        # Modules that the function being generated imports. None while
+        # outside a function, when imports go at the top of the module.
+        self.set_fn_import = None
+
+        # With a timer, each call in a body is timed. timer is the name of
+        # an object with start(), stop(key, t) and an async timed(key,
+        # awaitable), and fn_timer_key(wandle_function, idx) gives the key
+        # for each statement.
+        self.timer = None
+        self.fn_timer_key = None
+
+        # Class, generic and single name vs module name.
+        self.d_module = {}
+        for name in self.__class_names():
+            self.__claim_module(name)
+        for name in wandle_model.d_generic.keys():
+            self.__claim_module(name)
+        for name in wandle_model.d_single.keys():
+            self.__claim_module(name)
+
+    def __claim_module(self, name):
+        s = module_name(name)
+        lst_taken = self.d_module.values()
+        candidate = s
+        idx = 2
+        while candidate in lst_taken:
+            candidate = '%s%s'%(s, idx)
+            idx += 1
+        self.d_module[name] = candidate
+
+    def __class_names(self):
+        lst_name = []
+        for (name, wandle_class) in self.wandle_model.d_specific.items():
+            if wandle_class.b_placeholder:
+                continue
+            if name == 'Void' or name.startswith('Single|') or '/' in name:
+                continue
+            lst_name.append(name)
+        return lst_name
+
+    def __ref_class(self, py_module, cstring):
+        '''
+        An expression for the class behind cstring, importing its module.
+        Returns None for a template type, which has no class at run time.
+        '''
+        gname = cstring.split('/', 1)[0]
+        if gname not in self.d_module:
+            return None
+        module = self.d_module[gname]
+        if module == py_module.name:
+            return gname
+        if self.set_fn_import != None:
+            self.set_fn_import.add(module)
+        else:
+            py_module.set_import.add(module)
+        return '_%s.%s'%(module, gname)
+
+    # --------------------------------------------------------
+    #   bodies
+    # --------------------------------------------------------
+    def __root(self, py_module, wandle_function, set_local, root):
+        if root == 'self' or root in set_local:
+            return py_name(root)
+        if root in self.wandle_model.d_single:
+            return self.__ref_class(py_module, root)
+        if not wandle_function.is_flow():
+            # A field or method of our own, named without self.
+            return 'self.%s'%(py_name(root))
+        return py_name(root)
+
+    def __dotref(self, py_module, wandle_function, set_local, dotref):
+        lst = list(dotref)
+        return '.'.join(
+            [self.__root(py_module, wandle_function, set_local, lst[0])]
+            + [py_name(n) for n in lst[1:]])
+
+    def __call_expr(self, py_module, wandle_function, set_local, statement):
+        '''
+        Returns (expr, b_awaitable) for a call statement.
+        '''
+        callee = statement.wandle_function
+        f = self.__dotref(py_module, wandle_function, set_local,
+            statement.rhs_dotref)
+        lst_arg = [
+            self.__dotref(py_module, wandle_function, set_local, p)
+            for p in statement.lst_rhs_param]
+        if statement.stype == STYPE_ASYNC_LHS_RHS and not callee.b_is_async:
+            # A send to a sync method. Run it off the event loop.
+            py_module.b_asyncio = True
+            return ('asyncio.to_thread(%s)'%(', '.join([f] + lst_arg)), True)
+        return ('%s(%s)'%(f, ', '.join(lst_arg)), callee.b_is_async)
+
+    def __lhs(self, py_module, wandle_function, set_local, statement):
+        if tuple(statement.lhs_dotref) == ('void',):
+            return None
+        return self.__dotref(py_module, wandle_function, set_local,
+            statement.lhs_dotref)
+
+    def __timed(self, wandle_function, idx, expr):
+        if self.timer == None:
+            return expr
+        return '%s.timed(%r, %s)'%(
+            self.timer, self.fn_timer_key(wandle_function, idx), expr)
+
+    def __flush(self, py_module, depth, lst_group):
+        if not lst_group:
+            return
+        if len(lst_group) == 1:
+            (lhs, expr) = lst_group[0]
+            if lhs == None:
+                py_module.add(depth, 'await %s'%(expr))
+            else:
+                py_module.add(depth, '%s = await %s'%(lhs, expr))
+        else:
+            py_module.b_asyncio = True
+            lst_lhs = [lhs if lhs != None else '_' for (lhs, expr) in lst_group]
+            py_module.add(depth, '(%s) = await asyncio.gather('%(
+                ', '.join(lst_lhs)))
+            for (lhs, expr) in lst_group:
+                py_module.add(depth + 1, '%s,'%(expr))
+            py_module.add(depth, ')')
+        del lst_group[:]
+
+    def body(self, py_module, depth, wandle_function):
+        set_local = set([p.name for p in wandle_function.lst_param])
+        dataflow = wandle_function.get_dataflow()
+
+        # Pending sends, as (lhs, expr), and their statement indexes.
+        lst_group = []
+        set_group_idx = set()
+        count_line = len(py_module.lst_line)
+        for (idx, statement) in enumerate(dataflow.lst_statement):
+            stype = statement.stype
+            b_depends = any([p in set_group_idx for p in dataflow.get_preds(idx)])
+            b_call = statement.wandle_function != None
+            if b_depends or (b_call and stype == STYPE_SYNC_LHS_RHS):
+                self.__flush(py_module, depth, lst_group)
+                set_group_idx = set()
+
+            if stype == STYPE_NOTE_CONTENT:
+                py_module.add(depth, '# %s'%(statement.txt))
+            elif stype == STYPE_SYNC_VAR_NUL:
+                set_local.add(statement.lhs_dotref)
+                py_module.add(depth, '%s: %s = None'%(
+                    py_name(statement.lhs_dotref),
+                    py_type(statement.wandle_class.name)))
+            elif stype == STYPE_SYNC_VAR_VAL:
+                set_local.add(statement.lhs_dotref)
+                cls = self.__ref_class(py_module, statement.wandle_class.name)
+                if cls == None:
+                    value = 'None'
+                else:
+                    value = '%s()'%(cls)
+                py_module.add(depth, '%s: %s = %s'%(
+                    py_name(statement.lhs_dotref),
+                    py_type(statement.wandle_class.name),
+                    value))
+            elif not b_call:
+                py_module.add(depth, '%s = %s'%(
+                    self.__lhs(py_module, wandle_function, set_local, statement),
+                    self.__dotref(py_module, wandle_function, set_local,
+                        statement.rhs_dotref)))
+            elif stype == STYPE_SYNC_LHS_RHS:
+                lhs = self.__lhs(py_module, wandle_function, set_local, statement)
+                (expr, b_await) = self.__call_expr(
+                    py_module, wandle_function, set_local, statement)
+                b_stop = False
+                if b_await:
+                    expr = 'await ' + self.__timed(wandle_function, idx, expr)
+                elif self.timer != None:
+                    py_module.add(depth, '_t = %s.start()'%(self.timer))
+                    b_stop = True
+                if lhs == None:
+                    py_module.add(depth, expr)
+                else:
+                    py_module.add(depth, '%s = %s'%(lhs, expr))
+                if b_stop:
+                    py_module.add(depth, '%s.stop(%r, _t)'%(
+                        self.timer, self.fn_timer_key(wandle_function, idx)))
+            elif stype == STYPE_ASYNC_LHS_RHS:
+                lhs = self.__lhs(py_module, wandle_function, set_local, statement)
+                (expr, b_await) = self.__call_expr(
+                    py_module, wandle_function, set_local, statement)
+                if b_await:
+                    expr = self.__timed(wandle_function, idx, expr)
+                if not b_await:
+                    # Nothing to wait for.
+                    self.__flush(py_module, depth, lst_group)
+                    set_group_idx = set()
+                    if lhs == None:
+                        py_module.add(depth, expr)
+                    else:
+                        py_module.add(depth, '%s = %s'%(lhs, expr))
+                else:
+                    lst_group.append((lhs, expr))
+                    set_group_idx.add(idx)
+        self.__flush(py_module, depth, lst_group)
+
+        if wandle_function.rtype.name != 'Void':
+            if wandle_function.return_dotref != None:
+                py_module.add(depth, 'return %s'%(self.__dotref(
+                    py_module, wandle_function, set_local,
+                    wandle_function.return_dotref)))
+            else:
+                py_module.add(depth, 'raise NotImplementedError()')
+        elif len(py_module.lst_line) == count_line:
+            py_module.add(depth, 'pass')
+
+    def function(self, py_module, depth, wandle_function, b_method=True,
+            fn_name=None):
+        lst_param = []
+        if b_method:
+            lst_param.append('self')
+        for param in wandle_function.lst_param:
+            lst_param.append('%s: %s'%(
+                py_name(param.name), py_type(param.wandle_class.name)))
+        s_async = ''
+        if wandle_function.b_is_async or wandle_function.is_flow():
+            s_async = 'async '
+        s_rtype = ''
+        if not wandle_function.is_flow():
+            s_rtype = ' -> %s'%(py_type(wandle_function.rtype.name))
+        if fn_name == None:
+            fn_name = py_name(wandle_function.name)
+        py_module.add(depth, '%sdef %s(%s)%s:'%(
+            s_async,
+            fn_name,
+            ', '.join(lst_param),
+            s_rtype))
+        lst_doc = []
+        if wandle_function.cost_dist != None:
+            lst_doc.append('Cost %s.'%(wandle_function.cost_dist.as_code()))
+        if wandle_function.lst_effect:
+            lst_doc.append('Effect %s.'%(', '.join(wandle_function.lst_effect)))
+        if wandle_function.budget_ms != None:
+            lst_doc.append('Budget %gms.'%(wandle_function.budget_ms))
+        if lst_doc:
+            py_module.add(depth + 1, "'''%s'''"%(' '.join(lst_doc)))
+        if not wandle_function.has_body():
+            py_module.add(depth + 1, 'raise NotImplementedError()')
+            return
+
+        idx_import = len(py_module.lst_line)
+        self.set_fn_import = set()
+        self.body(py_module, depth + 1, wandle_function)
+        py_module.lst_line[idx_import:idx_import] = [
+            INDENT * (depth + 1) + 'from . import %s as _%s'%(name, name)
+            for name in sorted(self.set_fn_import)]
+        self.set_fn_import = None
+
+    # --------------------------------------------------------
+    #   modules
+    # --------------------------------------------------------
+    def __members(self, py_module, owner, container, d_object, lst_base):
+        # Only what owner declares. Inherited members come from the base.
+        depth = 1
+        lst_field = list(d_object.items())
+        b_any = False
+        if lst_field:
+            py_module.add(depth, 'def __init__(self):')
+            if lst_base:
+                py_module.add(depth + 1, 'super().__init__()')
+            for (name, wandle_object) in lst_field:
+                py_module.add(depth + 1, 'self.%s: %s = None'%(
+                    py_name(name), py_type(wandle_object.get_type())))
+            b_any = True
+        for dd in (container.d_fab_async, container.d_fab_sync):
+            for wandle_function in dd.values():
+                if wandle_function.compile_container is not owner:
+                    continue
+                if b_any:
+                    py_module.add(0, '')
+                self.function(py_module, depth, wandle_function)
+                b_any = True
+        if not b_any:
+            py_module.add(depth, 'pass')
+
+    def class_module(self, name):
+        wandle_class = self.wandle_model.d_specific[name]
+        py_module = PyModule(self.d_module[name])
+        lst_base = []
+        for cname in wandle_class.lst_inherits_from:
+            lst_base.append(self.__ref_class(py_module, cname))
+        if lst_base:
+            py_module.add(0, 'class %s(%s):'%(name, ', '.join(lst_base)))
+        else:
+            py_module.add(0, 'class %s:'%(name))
+        self.__members(
+            py_module,
+            wandle_class,
+            wandle_class,
+            wandle_class.get_declared_objects(),
+            lst_base)
+        return py_module
+
+    def generic_module(self, name):
+        wandle_generic = self.wandle_model.d_generic[name]
+        py_module = PyModule(self.d_module[name])
+        py_module.b_typing = True
+        for tt in wandle_generic.lst_template_type:
+            py_module.add(0, "%s = typing.TypeVar('%s')"%(tt, tt))
+        py_module.add(0, '')
+        py_module.add(0, '')
+        py_module.add(0, 'class %s(typing.Generic[%s]):'%(
+            name, ', '.join(wandle_generic.lst_template_type)))
+        self.__members(
+            py_module,
+            wandle_generic,
+            wandle_generic,
+            wandle_generic.d_object,
+            [])
+        return py_module
+
+    def single_module(self, name):
+        wandle_single = self.wandle_model.d_single[name]
+        py_module = PyModule(self.d_module[name])
+        py_module.add(0, 'class _%s:'%(name))
+        wandle_class = wandle_single.wandle_class
+        self.__members(
+            py_module,
+            wandle_single,
+            wandle_class,
+            wandle_class.d_object,
+            [])
+        py_module.add(0, '')
+        py_module.add(0, '')
+        py_module.add(0, '%s = _%s()'%(name, name))
+        return py_module
+
+    def flows_module(self):
+        py_module = PyModule(FLOWS_MODULE)
+        b_first = True
+        for wandle_flow in self.wandle_model.d_flow.values():
+            if not b_first:
+                py_module.add(0, '')
+                py_module.add(0, '')
+            self.function(py_module, 0, wandle_flow, b_method=False)
+            b_first = False
+        return py_module
+
+    def modules(self):
+        '''
+        Yields each PyModule in turn.
+        '''
+        for name in self.__class_names():
+            yield self.class_module(name)
+        for name in self.wandle_model.d_generic.keys():
+            yield self.generic_module(name)
+        for name in self.wandle_model.d_single.keys():
+            yield self.single_module(name)
+        yield self.flows_module()
+
+
+def pygen_write_all(wandle_model, out_dir):
+    '''
+    Writes the package into out_dir, one module at a time. Returns the
+    list of paths written.
+    '''
+    wandle_model.check_all()
+    os.makedirs(out_dir, exist_ok=True)
+    lst_path = []
+
+    path = os.path.join(out_dir, '__init__.py')
+    f_ptr = open(path, 'w')
+    f_ptr.write('#\n# Generated by wandle.\n#\n')
+    f_ptr.close()
+    lst_path.append(path)
+
+    for py_module in PyGen(wandle_model).modules():
+        path = os.path.join(out_dir, py_module.name + '.py')
+        f_ptr = open(path, 'w')
+        for line in py_module.lines():
+            f_ptr.write(line)
+            f_ptr.write('\n')
+        f_ptr.close()
+        lst_path.append(path)
+    return lst_path
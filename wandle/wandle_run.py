@@ -0,0 +1,421 @@
+#
+# Runs flows as asyncio coroutines, straight from the model.
+#
+# The interpreter walks the checked statements of a flow. A sync call runs
+# the callee there and then, and the caller waits for it. An async send
+# (<<) schedules the callee as a task, and the caller carries on. If the
+# send has a left-hand side, that name holds the task until something
+# reads it, and the read waits for the result. A flow run returns when
+# its own body is done, and is done when the last task it started has
+# finished. We time both.
+#
+# What a call does:
+#   - If a Python implementation is registered under the method's
+#     qualified name, it is called with the receiver and the arguments.
+#     It can be a plain function or a coroutine function.
+#   - Otherwise a fake stands in. It takes the method's cost, sampled from
+#     its distribution, or the latency given for it, and then runs the
+#     body if there is one. A method without a body returns a new object
+#     of its return type.
+#
+# A sync fake blocks the event loop for its cost, as blocking work in a
+# sync method would. With b_sync_yields it sleeps with asyncio instead.
+# Async fakes always yield.
+#
+# Objects are Instance, a class and a dict of fields. Fields come into
+# being the first time they are read. Each single has one instance, shared
+# by every run. Recursion is skipped, as in the static analysis, since the
+# design has no way to stop it.
+#
+
+from .wandle_model import STYPE_ASYNC_LHS_RHS
+from .wandle_model import STYPE_SYNC_LHS_RHS
+from .wandle_model import STYPE_SYNC_VAR_NUL
+from .wandle_model import STYPE_SYNC_VAR_VAL
+from .wandle_sim import percentile
+
+import asyncio
+import importlib
+import inspect
+import random
+import time
+
+
+IMPL_REAL = 'real'
+IMPL_FAKE = 'fake'
+
+
+class Instance:
+
+    __slots__ = ('wandle_class', 'd_field')
+
+    def __init__(self, wandle_class):
+        self.wandle_class = wandle_class
+        self.d_field = {}
+
+    def __repr__(self):
+        return '<Instance %s>'%(self.wandle_class.name)
+
+    def has_field(self, name):
+        return name in self.d_field or name in self.wandle_class.d_object
+
+    def get_field(self, name):
+        if name not in self.d_field:
+            wandle_object = self.wandle_class.d_object.get(name)
+            if wandle_object == None:
+                raise Exception("%s has no field %s"%(
+                    self.wandle_class.name, name))
+            self.d_field[name] = Instance(wandle_object.wandle_class)
+        return self.d_field[name]
+
+    def set_field(self, name, value):
+        self.d_field[name] = value
+
+
+class FlowRun:
+    '''
+    One run of a flow, and the tasks it has started.
+    '''
+
+    def __init__(self, flow_name):
+        self.flow_name = flow_name
+        self.set_task = set()
+
+    def spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self.set_task.add(task)
+        task.add_done_callback(self.set_task.discard)
+        return task
+
+    async def join(self):
+        # Tasks can start tasks, so go round until none are left.
+        while self.set_task:
+            await asyncio.gather(*list(self.set_task))
+
+
+class Stats:
+
+    def __init__(self):
+        self.lst_s = []
+        self.count_error = 0
+        self.first_error = None
+
+    def record(self, s):
+        self.lst_s.append(s)
+
+    def error(self, e):
+        self.count_error += 1
+        if self.first_error == None:
+            self.first_error = repr(e)
+
+    def as_dict(self, duration_s):
+        lst_ms = sorted([s * 1000.0 for s in self.lst_s])
+        mean_ms = None
+        if lst_ms:
+            mean_ms = sum(lst_ms) / len(lst_ms)
+        return {
+            'count': len(lst_ms),
+            'throughput_per_s': len(lst_ms) / duration_s,
+            'mean_ms': mean_ms,
+            'p50_ms': percentile(lst_ms, 50.0),
+            'p95_ms': percentile(lst_ms, 95.0),
+            'p99_ms': percentile(lst_ms, 99.0),
+            'max_ms': lst_ms[-1] if lst_ms else None,
+        }
+
+
+class Interpreter:
+
+    def __init__(self, wandle_model, d_latency_ms=None, scale=1.0,
+            b_sync_yields=False, seed=None):
+        self.wandle_model = wandle_model
+        self.d_latency_ms = d_latency_ms or {}
+        self.scale = scale
+        self.b_sync_yields = b_sync_yields
+        self.rnd = random.Random(seed)
+
+        # qualified name vs WandleFunction
+        self.d_function = wandle_model.get_functions()
+        for name in self.d_latency_ms.keys():
+            if name not in self.d_function:
+                raise Exception("No method %s to give a latency to."%(name))
+
+        # qualified name vs callable
+        self.d_impl = {}
+
+        # single name vs Instance
+        self.d_single = {}
+        for (name, wandle_object) in wandle_model.d_single.items():
+            self.d_single[name] = Instance(wandle_object.wandle_class)
+
+        # flow name vs Stats, for the return and for the last task.
+        self.d_flow_return = {}
+        self.d_flow_done = {}
+        # qualified name vs Stats
+        self.d_method = {}
+
+    def register(self, name, fn):
+        '''
+        Calls to the method with qualified name go to fn, which takes the
+        receiver (None for a flow) followed by the arguments.
+        '''
+        if name not in self.d_function:
+            raise Exception("No method %s to implement."%(name))
+        self.d_impl[name] = fn
+
+    def unregister(self, name):
+        self.d_impl.pop(name, None)
+
+    # --------------------------------------------------------
+    #   values
+    # --------------------------------------------------------
+    async def __value(self, value):
+        if isinstance(value, asyncio.Future):
+            value = await value
+        return value
+
+    async def __read(self, dotref, d_local, receiver):
+        name = dotref[0]
+        if name in d_local:
+            value = d_local[name]
+        elif name in self.d_single:
+            value = self.d_single[name]
+        elif isinstance(receiver, Instance) and receiver.has_field(name):
+            value = receiver.get_field(name)
+        else:
+            raise Exception("Nothing called %s in scope"%('.'.join(dotref)))
+        value = await self.__value(value)
+        for name in dotref[1:]:
+            if not isinstance(value, Instance):
+                raise Exception("Cannot read %s of %r"%(name, value))
+            value = await self.__value(value.get_field(name))
+        return value
+
+    async def __write(self, dotref, value, d_local, receiver):
+        if dotref[0] == 'void':
+            return
+        if len(dotref) == 1:
+            name = dotref[0]
+            if name not in d_local and isinstance(receiver, Instance) \
+                    and receiver.has_field(name):
+                receiver.set_field(name, value)
+            else:
+                d_local[name] = value
+            return
+        owner = await self.__read(dotref[:-1], d_local, receiver)
+        if not isinstance(owner, Instance):
+            raise Exception("Cannot set %s of %r"%(dotref[-1], owner))
+        owner.set_field(dotref[-1], value)
+
+    def __new_value(self, wandle_class):
+        if wandle_class.name == 'Void':
+            return None
+        return Instance(wandle_class)
+
+    # --------------------------------------------------------
+    #   calls
+    # --------------------------------------------------------
+    async def __fake_cost(self, wandle_function):
+        name = wandle_function.get_qualified_name()
+        if name in self.d_latency_ms:
+            ms = self.d_latency_ms[name]
+        elif wandle_function.cost_dist != None:
+            ms = wandle_function.cost_dist.sample(self.rnd)
+        else:
+            return
+        s = ms * self.scale / 1000.0
+        if wandle_function.is_async() or self.b_sync_yields:
+            await asyncio.sleep(s)
+        else:
+            time.sleep(s)
+
+    async def call(self, wandle_function, receiver, lst_value, flow_run,
+            lst_stack):
+        name = wandle_function.get_qualified_name()
+        t_start = time.perf_counter()
+        impl = self.d_impl.get(name)
+        if impl != None:
+            value = impl(receiver, *lst_value)
+            if inspect.isawaitable(value):
+                value = await value
+        else:
+            await self.__fake_cost(wandle_function)
+            if wandle_function.has_body():
+                value = await self.body(
+                    wandle_function=wandle_function,
+                    receiver=receiver,
+                    lst_value=lst_value,
+                    flow_run=flow_run,
+                    lst_stack=lst_stack + [wandle_function])
+            else:
+                value = self.__new_value(wandle_function.rtype)
+        if name not in self.d_method:
+            self.d_method[name] = Stats()
+        self.d_method[name].record(time.perf_counter() - t_start)
+        return value
+
+    async def body(self, wandle_function, receiver, lst_value, flow_run,
+            lst_stack):
+        d_local = {'self': receiver}
+        for (param, value) in zip(wandle_function.lst_param, lst_value):
+            d_local[param.name] = value
+
+        for statement in wandle_function.lst_statement:
+            stype = statement.stype
+            if stype == STYPE_SYNC_VAR_NUL:
+                d_local[statement.lhs_dotref] = None
+            elif stype == STYPE_SYNC_VAR_VAL:
+                d_local[statement.lhs_dotref] = Instance(statement.wandle_class)
+            elif stype in (STYPE_SYNC_LHS_RHS, STYPE_ASYNC_LHS_RHS):
+                callee = statement.wandle_function
+                if callee == None:
+                    # Copy
+                    value = await self.__read(
+                        statement.rhs_dotref, d_local, receiver)
+                    await self.__write(
+                        statement.lhs_dotref, value, d_local, receiver)
+                    continue
+                if len(statement.rhs_dotref) == 1:
+                    callee_receiver = receiver
+                else:
+                    callee_receiver = await self.__read(
+                        statement.rhs_dotref[:-1], d_local, receiver)
+                lst_arg = []
+                for dotref in statement.lst_rhs_param:
+                    lst_arg.append(await self.__read(dotref, d_local, receiver))
+                if callee in lst_stack:
+                    value = self.__new_value(callee.rtype)
+                elif stype == STYPE_ASYNC_LHS_RHS:
+                    value = flow_run.spawn(self.call(
+                        wandle_function=callee,
+                        receiver=callee_receiver,
+                        lst_value=lst_arg,
+                        flow_run=flow_run,
+                        lst_stack=lst_stack))
+                else:
+                    value = await self.call(
+                        wandle_function=callee,
+                        receiver=callee_receiver,
+                        lst_value=lst_arg,
+                        flow_run=flow_run,
+                        lst_stack=lst_stack)
+                await self.__write(
+                    statement.lhs_dotref, value, d_local, receiver)
+
+        if wandle_function.return_dotref == None:
+            return self.__new_value(wandle_function.rtype)
+        return await self.__read(
+            wandle_function.return_dotref, d_local, receiver)
+
+    # --------------------------------------------------------
+    #   load
+    # --------------------------------------------------------
+    async def run_flow(self, flow_name):
+        '''
+        One run of the flow. Returns what its body returns.
+        '''
+        wandle_function = self.wandle_model.d_flow[flow_name]
+        if flow_name not in self.d_flow_return:
+            self.d_flow_return[flow_name] = Stats()
+            self.d_flow_done[flow_name] = Stats()
+        flow_run = FlowRun(flow_name)
+        t_start = time.perf_counter()
+        try:
+            value = await self.call(
+                wandle_function=wandle_function,
+                receiver=None,
+                lst_value=[None for p in wandle_function.lst_param],
+                flow_run=flow_run,
+                lst_stack=[])
+            self.d_flow_return[flow_name].record(time.perf_counter() - t_start)
+            await flow_run.join()
+        except Exception as e:
+            self.d_flow_done[flow_name].error(e)
+            # Let the rest of the run finish before the next one starts.
+            await asyncio.gather(*list(flow_run.set_task),
+                return_exceptions=True)
+            return None
+        self.d_flow_done[flow_name].record(time.perf_counter() - t_start)
+        return value
+
+    async def __worker(self, lst_flow, idx, t_end):
+        while time.perf_counter() < t_end:
+            flow_name = lst_flow[idx % len(lst_flow)]
+            idx += 1
+            await self.run_flow(flow_name)
+
+    async def run(self, lst_flow, concurrency, duration_s):
+        '''
+        concurrency workers run the flows in lst_flow back to back, for
+        duration_s. Returns the report.
+        '''
+        for flow_name in lst_flow:
+            if flow_name not in self.wandle_model.d_flow:
+                raise Exception("No flow %s."%(flow_name))
+        if concurrency < 1:
+            raise Exception("Concurrency must be at least 1.")
+        t_start = time.perf_counter()
+        t_end = t_start + duration_s
+        await asyncio.gather(*[
+            self.__worker(lst_flow, idx, t_end)
+            for idx in range(concurrency)])
+        return self.report(time.perf_counter() - t_start)
+
+    def report(self, duration_s):
+        lst_flow = []
+        for flow_name in sorted(self.d_flow_done.keys()):
+            d = self.d_flow_done[flow_name].as_dict(duration_s)
+            d_return = self.d_flow_return[flow_name].as_dict(duration_s)
+            d['flow'] = flow_name
+            d['errors'] = self.d_flow_done[flow_name].count_error
+            d['first_error'] = self.d_flow_done[flow_name].first_error
+            d['return_mean_ms'] = d_return['mean_ms']
+            d['return_p99_ms'] = d_return['p99_ms']
+            lst_flow.append(d)
+        lst_method = []
+        for name in sorted(self.d_method.keys()):
+            if name in self.wandle_model.d_flow:
+                continue
+            d = self.d_method[name].as_dict(duration_s)
+            d['method'] = name
+            d['impl'] = IMPL_REAL if name in self.d_impl else IMPL_FAKE
+            lst_method.append(d)
+        return {
+            'duration_s': duration_s,
+            'flows': lst_flow,
+            'methods': lst_method,
+        }
+
+
+def load_impl(spec):
+    '''
+    Finds the callable for a spec of the form module:attr.
+    '''
+    (module_name, sep, attr) = spec.partition(':')
+    if not sep or not module_name or not attr:
+        raise Exception("Implementation %s should be module:function"%(spec))
+    module = importlib.import_module(module_name)
+    fn = getattr(module, attr, None)
+    if fn == None or not callable(fn):
+        raise Exception("%s has no function %s"%(module_name, attr))
+    return fn
+
+def run_flows(wandle_model, lst_flow, concurrency, duration_s, d_impl=None,
+        d_latency_ms=None, scale=1.0, b_sync_yields=False, seed=None):
+    '''
+    Runs the flows in lst_flow with concurrency workers for duration_s, and
+    returns the report. d_impl is qualified name vs a Python implementation.
+    '''
+    wandle_model.check_all()
+    interpreter = Interpreter(
+        wandle_model=wandle_model,
+        d_latency_ms=d_latency_ms,
+        scale=scale,
+        b_sync_yields=b_sync_yields,
+        seed=seed)
+    for (name, fn) in (d_impl or {}).items():
+        interpreter.register(name, fn)
+    return asyncio.run(interpreter.run(
+        lst_flow=lst_flow,
+        concurrency=concurrency,
+        duration_s=duration_s))
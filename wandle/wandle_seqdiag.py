@@ -0,0 +1,333 @@
+#
+# Generates sequence diagrams from flows, as PlantUML or Mermaid.
+#
+# Each flow becomes one diagram. The flow itself is the first participant.
+# Every call in its body is a message to the object the call was made on.
+# Sync calls get a solid arrow and a dashed reply. Async sends (<<) get an
+# open arrow, and only get a reply if their result is kept. Notes are drawn
+# over the participant whose body they sit in.
+#
+# Bodies of the methods called can be expanded in place, to max_depth. With
+# a depth of 0 you get the flow's own calls only.
+#
+# Participants are named by the path the call was made through. 'self' is
+# replaced by the participant we are inside, and singles are known by their
+# own name. Any other receiver inside an expanded body is qualified by the
+# participant that owns the body, as in org:person.
+#
+# Diagrams are produced as a stream of lines, one flow at a time, so memory
+# does not grow with the number of flows. seqdiag_write_all can farm flows
+# out to a pool of worker processes.
+#
+
+from .arpeggio_parse import arpeggio_parse_go
+from .wandle_model import STYPE_ASYNC_LHS_RHS
+from .wandle_model import STYPE_NOTE_CONTENT
+from .wandle_model import STYPE_SYNC_LHS_RHS
+from .wandle_model import wandle_model_build
+
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import multiprocessing
+import os
+
+
+FMT_MERMAID = 'mermaid'
+FMT_PLANTUML = 'plantuml'
+
+D_FMT_SUFFIX = {
+    FMT_MERMAID: '.mmd',
+    FMT_PLANTUML: '.puml',
+}
+
+
+# --------------------------------------------------------
+#   syntax
+# --------------------------------------------------------
+class PlantumlSyntax:
+
+    def begin(self, title):
+        return ['@startuml', 'title %s'%(title)]
+
+    def end(self):
+        return ['@enduml']
+
+    def participant(self, alias, label):
+        return 'participant "%s" as %s'%(label, alias)
+
+    def sync_call(self, src, dst, txt):
+        return '%s -> %s : %s'%(src, dst, txt)
+
+    def sync_reply(self, src, dst, txt):
+        return '%s --> %s : %s'%(src, dst, txt)
+
+    def async_call(self, src, dst, txt):
+        return '%s ->> %s : %s'%(src, dst, txt)
+
+    def async_reply(self, src, dst, txt):
+        return '%s -->> %s : %s'%(src, dst, txt)
+
+    def note(self, alias, txt):
+        return 'note over %s : %s'%(alias, txt)
+
+    def activate(self, alias):
+        return 'activate %s'%(alias)
+
+    def deactivate(self, alias):
+        return 'deactivate %s'%(alias)
+
+class MermaidSyntax:
+
+    def begin(self, title):
+        return ['sequenceDiagram', '    title %s'%(title)]
+
+    def end(self):
+        return []
+
+    def participant(self, alias, label):
+        return '    participant %s as %s'%(alias, label)
+
+    def sync_call(self, src, dst, txt):
+        return '    %s->>%s: %s'%(src, dst, txt)
+
+    def sync_reply(self, src, dst, txt):
+        return '    %s-->>%s: %s'%(src, dst, txt)
+
+    def async_call(self, src, dst, txt):
+        return '    %s-)%s: %s'%(src, dst, txt)
+
+    def async_reply(self, src, dst, txt):
+        return '    %s--)%s: %s'%(src, dst, txt)
+
+    def note(self, alias, txt):
+        # Mermaid treats ; as a line break.
+        return '    Note over %s: %s'%(alias, txt.replace(';', ','))
+
+    def activate(self, alias):
+        return '    activate %s'%(alias)
+
+    def deactivate(self, alias):
+        return '    deactivate %s'%(alias)
+
+D_SYNTAX = {
+    FMT_MERMAID: MermaidSyntax,
+    FMT_PLANTUML: PlantumlSyntax,
+}
+
+
+# --------------------------------------------------------
+#   diagram
+# --------------------------------------------------------
+class SeqDiagram:
+    '''
+    Holds the state for one flow's diagram: the participants seen so far,
+    and the stack of functions being expanded.
+    '''
+
+    def __init__(self, wandle_model, fmt, max_depth):
+        if fmt not in D_SYNTAX:
+            raise Exception("Unknown diagram format %s."%(fmt))
+        self.wandle_model = wandle_model
+        self.syntax = D_SYNTAX[fmt]()
+        self.max_depth = max_depth
+
+        # path -> alias
+        self.d_participant = {}
+        self.lst_stack = []
+
+    def __participant(self, path, label):
+        '''
+        Returns (alias, line). line is the declaration, or None if we have
+        seen this participant before.
+        '''
+        if path in self.d_participant:
+            return (self.d_participant[path], None)
+        alias = 'p%s'%(len(self.d_participant))
+        self.d_participant[path] = alias
+        return (alias, self.syntax.participant(alias=alias, label=label))
+
+    def __receiver(self, statement, current_path, b_flow):
+        '''
+        Returns (path, label) for the object a call was made on. The path
+        identifies the participant. The label adds its type.
+        '''
+        wandle_function = statement.wandle_function
+        lst_path = list(statement.rhs_dotref[:-1])
+        if not lst_path:
+            return (current_path, None)
+        if lst_path[0] == 'self':
+            path = '.'.join([current_path] + lst_path[1:])
+        elif lst_path[0] in self.wandle_model.d_single:
+            path = '.'.join(lst_path)
+            return (path, path)
+        elif b_flow:
+            path = '.'.join(lst_path)
+        else:
+            path = '%s:%s'%(current_path, '.'.join(lst_path))
+        return (path, '%s (%s)'%(path, wandle_function.compile_container.name))
+
+    def __expandable(self, wandle_function, depth):
+        if depth >= self.max_depth:
+            return False
+        if not wandle_function.has_body():
+            return False
+        for entry in self.lst_stack:
+            if entry is wandle_function:
+                # Recursion. Draw the call, but do not expand it again.
+                return False
+        return True
+
+    def body_lines(self, wandle_function, alias, path, depth):
+        syntax = self.syntax
+        b_flow = wandle_function.is_flow()
+        self.lst_stack.append(wandle_function)
+        for statement in wandle_function.lst_statement:
+            if statement.stype == STYPE_NOTE_CONTENT:
+                yield syntax.note(alias=alias, txt=statement.txt)
+                continue
+            if statement.stype not in (STYPE_SYNC_LHS_RHS, STYPE_ASYNC_LHS_RHS):
+                continue
+            callee = statement.wandle_function
+            if callee == None:
+                # A copy between vars. There is no message in that.
+                continue
+
+            (callee_path, callee_label) = self.__receiver(
+                statement=statement,
+                current_path=path,
+                b_flow=b_flow)
+            (callee_alias, line) = self.__participant(
+                path=callee_path,
+                label=callee_label)
+            if line != None:
+                yield line
+
+            txt = '%s(%s)'%(
+                callee.name,
+                ', '.join(['.'.join(p) for p in statement.lst_rhs_param]))
+            lhs = '.'.join(statement.lhs_dotref)
+            b_async = statement.stype == STYPE_ASYNC_LHS_RHS
+            if b_async:
+                yield syntax.async_call(src=alias, dst=callee_alias, txt=txt)
+            else:
+                yield syntax.sync_call(src=alias, dst=callee_alias, txt=txt)
+
+            if self.__expandable(callee, depth):
+                yield syntax.activate(callee_alias)
+                for line in self.body_lines(
+                        wandle_function=callee,
+                        alias=callee_alias,
+                        path=callee_path,
+                        depth=depth+1):
+                    yield line
+                if not b_async:
+                    yield syntax.sync_reply(
+                        src=callee_alias, dst=alias, txt=lhs)
+                yield syntax.deactivate(callee_alias)
+            elif not b_async:
+                yield syntax.sync_reply(src=callee_alias, dst=alias, txt=lhs)
+
+            if b_async and lhs != 'void':
+                yield syntax.async_reply(src=callee_alias, dst=alias, txt=lhs)
+        self.lst_stack.pop()
+
+    def lines(self, wandle_flow):
+        for line in self.syntax.begin(title=wandle_flow.name):
+            yield line
+        (alias, line) = self.__participant(
+            path=wandle_flow.name,
+            label=wandle_flow.name)
+        yield line
+        for line in self.body_lines(
+                wandle_function=wandle_flow,
+                alias=alias,
+                path=wandle_flow.name,
+                depth=0):
+            yield line
+        for line in self.syntax.end():
+            yield line
+
+
+def seqdiag_lines(wandle_model, flow_name, fmt=FMT_PLANTUML, max_depth=1):
+    '''
+    Yields the lines of the diagram for one flow.
+    '''
+    if flow_name not in wandle_model.d_flow:
+        raise Exception("No flow exists called %s"%(flow_name))
+    seq_diagram = SeqDiagram(
+        wandle_model=wandle_model,
+        fmt=fmt,
+        max_depth=max_depth)
+    return seq_diagram.lines(wandle_model.d_flow[flow_name])
+
+def seqdiag_write(f_out, wandle_model, flow_name, fmt=FMT_PLANTUML, max_depth=1):
+    for line in seqdiag_lines(
+            wandle_model=wandle_model,
+            flow_name=flow_name,
+            fmt=fmt,
+            max_depth=max_depth):
+        f_out.write(line)
+        f_out.write('\n')
+
+
+# --------------------------------------------------------
+#   many flows
+# --------------------------------------------------------
+# Each worker process builds the model once, and then draws whichever flows
+# it is given. We check every body up front. Checking per flow would walk
+# the shared methods again for each one.
+_worker = {}
+
+def seqdiag_worker_init(model_filename):
+    f_ptr = open(model_filename)
+    wandle_src = f_ptr.read()
+    f_ptr.close()
+    _worker['wandle_model'] = wandle_model_build(
+        parse_tree=arpeggio_parse_go(wandle_src),
+        b_print_diagnostic=False)
+
+def seqdiag_worker_write(flow_name, out_dir, fmt, max_depth):
+    wandle_model = _worker['wandle_model']
+    path = os.path.join(out_dir, flow_name + D_FMT_SUFFIX[fmt])
+    f_ptr = open(path, 'w')
+    seqdiag_write(
+        f_out=f_ptr,
+        wandle_model=wandle_model,
+        flow_name=flow_name,
+        fmt=fmt,
+        max_depth=max_depth)
+    f_ptr.close()
+    return path
+
+def seqdiag_write_all(model_filename, out_dir, fmt=FMT_PLANTUML, max_depth=1,
+        lst_flow_name=None, jobs=1):
+    '''
+    Writes one file per flow into out_dir, named after the flow. Returns
+    the list of paths written, in flow order.
+    '''
+    seqdiag_worker_init(model_filename)
+    if lst_flow_name == None:
+        lst_flow_name = list(_worker['wandle_model'].d_flow.keys())
+    os.makedirs(out_dir, exist_ok=True)
+
+    if jobs <= 1:
+        return [seqdiag_worker_write(flow_name, out_dir, fmt, max_depth)
+            for flow_name in lst_flow_name]
+
+    # Where we can fork, workers inherit the model we have just built.
+    # Elsewhere, each one builds its own.
+    if 'fork' in multiprocessing.get_all_start_methods():
+        d_pool = {'mp_context': multiprocessing.get_context('fork')}
+    else:
+        d_pool = {
+            'initializer': seqdiag_worker_init,
+            'initargs': (model_filename,),
+        }
+    with ProcessPoolExecutor(max_workers=jobs, **d_pool) as executor:
+        return list(executor.map(
+            seqdiag_worker_write,
+            lst_flow_name,
+            itertools.repeat(out_dir),
+            itertools.repeat(fmt),
+            itertools.repeat(max_depth),
+            chunksize=8))
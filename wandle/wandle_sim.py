@@ -0,0 +1,506 @@
+#
+# Discrete-event simulation of flows under load.
+#
+# Flows arrive at the rates given (a Poisson process per flow) and run
+# concurrently. Each single is a resource: a pool of servers with a queue in
+# front. A call to a method of a single waits for a free server, holds it
+# for the method's cost and for the whole of its body, and then hands it to
+# the next in the queue. With b_instances, classes are resources in the
+# same way. We have no identity for instances in the design, so all the
+# instances of a class share one pool.
+#
+# Calls to methods of anything else take their cost, with no contention.
+# Sync calls run in turn. An async send (<<) starts a new process, and the
+# sender carries on. A flow is done when the last process it started has
+# finished. Recursion is skipped, as in the static analysis, and a process
+# that already holds a server on a resource does not queue for it again.
+#
+# When a queue is full, the call is rejected, and the process that made it
+# stops. Its flow counts as dropped.
+#
+# Holding a server while calling into another resource can deadlock, as it
+# would in the system itself. If we run out of events with processes still
+# queued, the runs they belong to are reported as stuck, along with the
+# resources they are queued on.
+#
+# Processes are generators. They yield commands to the event loop, which
+# keeps pending events in a heap ordered by time.
+#
+# Times are in ms.
+#
+
+from .wandle_model import STYPE_ASYNC_LHS_RHS
+
+import collections
+import heapq
+import itertools
+import json
+import random
+
+
+CMD_ACQUIRE = 'acquire'
+CMD_DELAY = 'delay'
+
+EV_ARRIVE = 0
+EV_RESUME = 1
+
+# Chrome trace process ids. One span per flow run, then the calls made in
+# each process. Resources follow on, with a thread per server.
+TRACE_PID_RUNS = 1
+TRACE_PID_PROCESSES = 2
+
+
+def resource_name(wandle_function, b_instances):
+    '''
+    The resource a call to wandle_function contends for, or None. That is
+    the single it belongs to, or with b_instances, its class.
+    '''
+    compile_container = wandle_function.compile_container
+    if compile_container.wtype == 'WandleSingle':
+        return compile_container.name
+    if b_instances and compile_container.wtype == 'WandleClass':
+        return compile_container.name
+    return None
+
+def percentile(lst_value, p):
+    '''
+    Nearest-rank percentile of an already sorted list.
+    '''
+    if not lst_value:
+        return None
+    idx = int(round(p / 100.0 * (len(lst_value) - 1)))
+    return lst_value[idx]
+
+
+class Resource:
+
+    def __init__(self, name, servers, queue_limit):
+        if servers < 1:
+            raise Exception("Resource %s needs at least one server"%(name))
+        self.name = name
+        self.servers = servers
+        # None for a queue without a limit.
+        self.queue_limit = queue_limit
+
+        self.busy = 0
+        self.lst_free_slot = list(range(servers))
+        self.queue = collections.deque()
+
+        self.count_served = 0
+        self.count_rejected = 0
+        self.max_queue = 0
+        self.lst_wait_ms = []
+        # Integral of busy servers over time, in server-ms.
+        self.busy_area = 0.0
+        self.t_last = 0.0
+
+    def __repr__(self):
+        return '<Resource %s x%s>'%(self.name, self.servers)
+
+    def account(self, now):
+        self.busy_area += self.busy * (now - self.t_last)
+        self.t_last = now
+
+    def summary(self, t_end_ms):
+        '''
+        Returns a dict of statistics for a run that lasted t_end_ms.
+        '''
+        lst_wait = sorted(self.lst_wait_ms)
+        utilization = 0.0
+        if t_end_ms > 0:
+            utilization = self.busy_area / (self.servers * t_end_ms)
+        throughput = 0.0
+        if t_end_ms > 0:
+            throughput = self.count_served * 1000.0 / t_end_ms
+        # The load at which every server is always busy. Past this, the
+        # queue grows without bound.
+        saturation = None
+        load_factor = None
+        if utilization > 0:
+            saturation = throughput / utilization
+            load_factor = 1.0 / utilization
+        mean_wait = None
+        if lst_wait:
+            mean_wait = sum(lst_wait) / len(lst_wait)
+        return {
+            'resource': self.name,
+            'servers': self.servers,
+            'served': self.count_served,
+            'rejected': self.count_rejected,
+            'throughput_per_s': throughput,
+            'utilization': utilization,
+            'mean_wait_ms': mean_wait,
+            'p95_wait_ms': percentile(lst_wait, 95.0),
+            'max_queue': self.max_queue,
+            'saturation_per_s': saturation,
+            'saturation_load': load_factor,
+        }
+
+
+class FlowRun:
+    # One arrival of a flow.
+
+    def __init__(self, idx, flow_name, t_arrive):
+        self.idx = idx
+        self.flow_name = flow_name
+        self.t_arrive = t_arrive
+        self.count_live = 0
+        self.t_return = None
+        self.b_dropped = False
+
+
+class Process:
+
+    def __init__(self, idx, flow_run, lst_stack, b_root):
+        self.idx = idx
+        self.flow_run = flow_run
+        # True for the process the flow itself runs in.
+        self.b_root = b_root
+        # Functions we are inside, for the recursion check.
+        self.lst_stack = lst_stack
+        self.set_held = set()
+        self.gen = None
+
+
+class Simulator:
+
+    def __init__(self, wandle_model, rnd, d_servers=None, d_queue=None,
+            b_instances=False, b_trace=False):
+        self.wandle_model = wandle_model
+        self.rnd = rnd
+        self.b_instances = b_instances
+        self.d_servers = d_servers or {}
+        self.d_queue = d_queue or {}
+
+        # name vs Resource
+        self.d_resource = {}
+        for name in wandle_model.d_single.keys():
+            self.__add_resource(name)
+        if b_instances:
+            for name in wandle_model.d_specific.keys():
+                if name.startswith('Single|') or name == 'Void':
+                    continue
+                self.__add_resource(name)
+        for name in list(self.d_servers.keys()) + list(self.d_queue.keys()):
+            if name not in self.d_resource:
+                raise Exception("No resource %s. Resources are singles%s."%(
+                    name, ' and classes' if b_instances else ''))
+
+        self.heap = []
+        self.seq = itertools.count()
+        self.now = 0.0
+        self.count_process = 0
+        self.count_run = 0
+
+        # flow name vs list of FlowRun, once finished.
+        self.d_flow_done = {}
+        self.d_flow_arrived = {}
+
+        self.b_trace = b_trace
+        self.lst_trace = []
+        # resource name vs trace pid
+        self.d_trace_pid = {}
+
+    def __add_resource(self, name):
+        queue_limit = self.d_queue.get(name)
+        self.d_resource[name] = Resource(
+            name=name,
+            servers=self.d_servers.get(name, 1),
+            queue_limit=queue_limit)
+
+    def __resource_for(self, wandle_function):
+        name = resource_name(wandle_function, self.b_instances)
+        if name == None:
+            return None
+        return self.d_resource.get(name)
+
+    # --------------------------------------------------------
+    #   event loop
+    # --------------------------------------------------------
+    def __push(self, t, kind, payload, value=None):
+        heapq.heappush(self.heap, (t, next(self.seq), kind, payload, value))
+
+    def __spawn(self, flow_run, wandle_function, lst_stack):
+        process = Process(
+            idx=self.count_process,
+            flow_run=flow_run,
+            lst_stack=list(lst_stack),
+            b_root=wandle_function.is_flow())
+        self.count_process += 1
+        process.gen = self.__process_main(process, wandle_function)
+        flow_run.count_live += 1
+        self.__push(self.now, EV_RESUME, process)
+
+    def __step(self, process, value):
+        while True:
+            try:
+                (cmd, arg) = process.gen.send(value)
+            except StopIteration as e:
+                self.__finish(process, e.value)
+                return
+            if cmd == CMD_DELAY:
+                self.__push(self.now + arg, EV_RESUME, process)
+                return
+            elif cmd == CMD_ACQUIRE:
+                resource = arg
+                if resource.lst_free_slot:
+                    resource.account(self.now)
+                    resource.busy += 1
+                    resource.lst_wait_ms.append(0.0)
+                    value = resource.lst_free_slot.pop()
+                    continue
+                limit = resource.queue_limit
+                if limit != None and len(resource.queue) >= limit:
+                    resource.count_rejected += 1
+                    value = None
+                    continue
+                resource.queue.append((process, self.now))
+                resource.max_queue = max(resource.max_queue, len(resource.queue))
+                return
+            else:
+                raise Exception("Unknown command %s"%(cmd))
+
+    def __release(self, resource, slot):
+        resource.count_served += 1
+        if resource.queue:
+            # The server goes straight to the next in line.
+            (process, t_queued) = resource.queue.popleft()
+            resource.lst_wait_ms.append(self.now - t_queued)
+            self.__push(self.now, EV_RESUME, process, slot)
+            return
+        resource.account(self.now)
+        resource.busy -= 1
+        resource.lst_free_slot.append(slot)
+
+    def __finish(self, process, b_ok):
+        flow_run = process.flow_run
+        if not b_ok:
+            flow_run.b_dropped = True
+        if process.b_root:
+            flow_run.t_return = self.now
+        flow_run.count_live -= 1
+        if flow_run.count_live == 0:
+            self.d_flow_done.setdefault(flow_run.flow_name, []).append(
+                (flow_run, self.now))
+            self.__trace_span(
+                pid=TRACE_PID_RUNS,
+                tid=flow_run.idx,
+                name=flow_run.flow_name,
+                t_start=flow_run.t_arrive,
+                t_end=self.now,
+                d_args={'dropped': flow_run.b_dropped})
+
+    # --------------------------------------------------------
+    #   processes
+    # --------------------------------------------------------
+    def __process_main(self, process, wandle_function):
+        if wandle_function.is_flow():
+            b_ok = yield from self.__body(process, wandle_function)
+        else:
+            b_ok = yield from self.__call(process, wandle_function)
+        return b_ok
+
+    def __call(self, process, wandle_function):
+        '''
+        Generator. Runs one call, and returns False if it was rejected.
+        '''
+        t_start = self.now
+        resource = self.__resource_for(wandle_function)
+        b_acquire = resource != None and resource not in process.set_held
+        slot = None
+        if b_acquire:
+            slot = yield (CMD_ACQUIRE, resource)
+            if slot == None:
+                return False
+            process.set_held.add(resource)
+        t_served = self.now
+
+        b_ok = True
+        if wandle_function.cost_dist != None:
+            yield (CMD_DELAY, wandle_function.cost_dist.sample(self.rnd))
+        if wandle_function.has_body():
+            process.lst_stack.append(wandle_function)
+            b_ok = yield from self.__body(process, wandle_function)
+            process.lst_stack.pop()
+
+        if b_acquire:
+            process.set_held.discard(resource)
+            self.__release(resource, slot)
+            self.__trace_span(
+                pid=self.d_trace_pid.get(resource.name),
+                tid=slot,
+                name=wandle_function.get_qualified_name(),
+                t_start=t_served,
+                t_end=self.now,
+                d_args={'run': process.flow_run.idx})
+        self.__trace_span(
+            pid=TRACE_PID_PROCESSES,
+            tid=process.idx,
+            name=wandle_function.get_qualified_name(),
+            t_start=t_start,
+            t_end=self.now,
+            d_args={'wait_ms': t_served - t_start})
+        return b_ok
+
+    def __body(self, process, wandle_function):
+        for statement in wandle_function.lst_statement:
+            callee = statement.wandle_function
+            if callee == None:
+                continue
+            if callee in process.lst_stack:
+                continue
+            if statement.stype == STYPE_ASYNC_LHS_RHS:
+                self.__spawn(
+                    flow_run=process.flow_run,
+                    wandle_function=callee,
+                    lst_stack=process.lst_stack + [wandle_function])
+                continue
+            b_ok = yield from self.__call(process, callee)
+            if not b_ok:
+                return False
+        return True
+
+    # --------------------------------------------------------
+    #   trace
+    # --------------------------------------------------------
+    def __trace_span(self, pid, tid, name, t_start, t_end, d_args):
+        if not self.b_trace:
+            return
+        self.lst_trace.append({
+            'name': name,
+            'ph': 'X',
+            'pid': pid,
+            'tid': tid,
+            'ts': t_start * 1000.0,
+            'dur': (t_end - t_start) * 1000.0,
+            'args': d_args,
+        })
+
+    def trace_write(self, f_out):
+        '''
+        Writes the timeline in the Chrome trace event format. Open it in
+        chrome://tracing or Perfetto.
+        '''
+        lst_event = []
+        def meta(name, pid, value, tid=None):
+            d = {'name': name, 'ph': 'M', 'pid': pid, 'args': {'name': value}}
+            if tid != None:
+                d['tid'] = tid
+            lst_event.append(d)
+        meta('process_name', TRACE_PID_RUNS, 'flow runs')
+        meta('process_name', TRACE_PID_PROCESSES, 'processes')
+        for (name, pid) in self.d_trace_pid.items():
+            meta('process_name', pid, name)
+            for slot in range(self.d_resource[name].servers):
+                meta('thread_name', pid, 'server %s'%(slot), tid=slot)
+        lst_event.extend(self.lst_trace)
+        json.dump({'traceEvents': lst_event, 'displayTimeUnit': 'ms'}, f_out)
+
+    # --------------------------------------------------------
+    #   run
+    # --------------------------------------------------------
+    def run(self, d_rate, duration_ms):
+        '''
+        d_rate is flow name vs arrivals per second. Flows arrive until
+        duration_ms, and the simulation runs until they have all finished.
+        '''
+        for (flow_name, rate) in d_rate.items():
+            if flow_name not in self.wandle_model.d_flow:
+                raise Exception("No flow exists called %s"%(flow_name))
+            if rate <= 0:
+                raise Exception("Rate for %s must be positive"%(flow_name))
+            self.d_flow_arrived[flow_name] = 0
+            self.__push(
+                self.rnd.expovariate(rate / 1000.0), EV_ARRIVE, flow_name)
+        for (idx, name) in enumerate(self.d_resource.keys()):
+            self.d_trace_pid[name] = TRACE_PID_PROCESSES + 1 + idx
+
+        while self.heap:
+            (t, _, kind, payload, value) = heapq.heappop(self.heap)
+            self.now = t
+            if kind == EV_ARRIVE:
+                flow_name = payload
+                if t > duration_ms:
+                    continue
+                self.d_flow_arrived[flow_name] += 1
+                flow_run = FlowRun(
+                    idx=self.count_run,
+                    flow_name=flow_name,
+                    t_arrive=t)
+                self.count_run += 1
+                self.__spawn(
+                    flow_run=flow_run,
+                    wandle_function=self.wandle_model.d_flow[flow_name],
+                    lst_stack=[])
+                self.__push(
+                    t + self.rnd.expovariate(d_rate[flow_name] / 1000.0),
+                    EV_ARRIVE,
+                    flow_name)
+            else:
+                self.__step(payload, value)
+
+        for resource in self.d_resource.values():
+            resource.account(self.now)
+        return self.summary(d_rate=d_rate)
+
+    def summary(self, d_rate):
+        t_end = self.now
+        lst_flow = []
+        for flow_name in d_rate.keys():
+            lst_done = self.d_flow_done.get(flow_name, [])
+            lst_latency = sorted([
+                t_done - flow_run.t_arrive
+                for (flow_run, t_done) in lst_done
+                if not flow_run.b_dropped])
+            mean = None
+            if lst_latency:
+                mean = sum(lst_latency) / len(lst_latency)
+            arrived = self.d_flow_arrived[flow_name]
+            lst_flow.append({
+                'flow': flow_name,
+                'rate_per_s': d_rate[flow_name],
+                'arrived': arrived,
+                'completed': len(lst_latency),
+                'dropped': len(lst_done) - len(lst_latency),
+                'stuck': arrived - len(lst_done),
+                'mean_ms': mean,
+                'p50_ms': percentile(lst_latency, 50.0),
+                'p95_ms': percentile(lst_latency, 95.0),
+                'p99_ms': percentile(lst_latency, 99.0),
+            })
+        lst_resource = [
+            resource.summary(t_end_ms=t_end)
+            for resource in self.d_resource.values()
+            if resource.count_served or resource.count_rejected]
+        return {
+            'elapsed_ms': t_end,
+            'flows': lst_flow,
+            'resources': lst_resource,
+            'deadlocked': [
+                resource.name
+                for resource in self.d_resource.values()
+                if resource.queue],
+        }
+
+
+def sim_run(wandle_model, d_rate, duration_ms, d_servers=None, d_queue=None,
+        b_instances=False, seed=None, f_trace=None):
+    '''
+    Simulates the flows in d_rate (flow name vs arrivals per second) for
+    duration_ms. Returns a dict with per-flow and per-resource statistics.
+    If f_trace is given, the timeline is written to it as a Chrome trace.
+    '''
+    wandle_model.check_all()
+    simulator = Simulator(
+        wandle_model=wandle_model,
+        rnd=random.Random(seed),
+        d_servers=d_servers,
+        d_queue=d_queue,
+        b_instances=b_instances,
+        b_trace=f_trace != None)
+    d_result = simulator.run(
+        d_rate=d_rate,
+        duration_ms=duration_ms)
+    if f_trace != None:
+        simulator.trace_write(f_trace)
+    return d_result
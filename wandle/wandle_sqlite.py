@@ -0,0 +1,232 @@
+#
+# Persistent symbol and call index across many model files, kept in SQLite.
+#
+# For each file we record where each class, generic, alias, single, flow,
+# method and field is defined, and where types and methods are referenced.
+# Files are keyed by path, and only rebuilt when the sha256 of their
+# content changes.
+#
+
+from .arpeggio_parse import arpeggio_parse_go
+from .arpeggio_parse import LineTable
+from .wandle_model import USE_FIELD
+from .wandle_model import wandle_model_build
+
+import hashlib
+import os
+import sqlite3
+
+
+KIND_ALIAS = 'alias'
+KIND_CLASS = 'class'
+KIND_FIELD = 'field'
+KIND_FLOW = 'flow'
+KIND_GENERIC = 'generic'
+KIND_METHOD = 'method'
+KIND_SINGLE = 'single'
+
+REF_CALL = 'call'
+REF_TYPE = 'type'
+
+LST_SCHEMA = [
+    '''create table if not exists file (
+        id integer primary key,
+        path text unique not null,
+        sha256 text not null,
+        status text not null,
+        error text)''',
+    '''create table if not exists symbol (
+        file_id integer not null references file(id),
+        kind text not null,
+        name text not null,
+        line integer,
+        col integer)''',
+    '''create table if not exists reference (
+        file_id integer not null references file(id),
+        kind text not null,
+        name text not null,
+        context text not null,
+        line integer,
+        col integer)''',
+    'create index if not exists idx_symbol_name on symbol(name)',
+    'create index if not exists idx_reference_name on reference(name)',
+    'create index if not exists idx_symbol_file on symbol(file_id)',
+    'create index if not exists idx_reference_file on reference(file_id)',
+]
+
+
+def sqlite_index_open(db_path):
+    conn = sqlite3.connect(db_path)
+    for sql in LST_SCHEMA:
+        conn.execute(sql)
+    conn.commit()
+    return conn
+
+def collect_definitions(wandle_model):
+    '''
+    Returns a list of (kind, name, position) for everything the model
+    declares. Inherited members are not repeated against the child.
+    '''
+    lst = []
+    def add_methods(owner, wandle_class):
+        for d in (wandle_class.d_fab_sync, wandle_class.d_fab_async):
+            for wandle_function in d.values():
+                if wandle_function.compile_container is not owner:
+                    continue
+                lst.append((
+                    KIND_METHOD,
+                    wandle_function.get_qualified_name(),
+                    wandle_function.position))
+
+    for (name, wandle_class) in wandle_model.d_specific.items():
+        if wandle_class.position == None:
+            # Void, template placeholders, single classes, and classes
+            # derived from generics.
+            continue
+        lst.append((KIND_CLASS, name, wandle_class.position))
+        add_methods(wandle_class, wandle_class)
+    for (name, wandle_generic) in wandle_model.d_generic.items():
+        lst.append((KIND_GENERIC, name, wandle_generic.position))
+        add_methods(wandle_generic, wandle_generic)
+    for (name, wandle_single) in wandle_model.d_single.items():
+        lst.append((KIND_SINGLE, name, wandle_single.position))
+        add_methods(wandle_single, wandle_single.wandle_class)
+    for (name, position) in wandle_model.d_alias_position.items():
+        lst.append((KIND_ALIAS, name, position))
+    for (name, wandle_function) in wandle_model.d_flow.items():
+        lst.append((KIND_FLOW, name, wandle_function.position))
+    for lst_use in wandle_model.wandle_index.d_type_use.values():
+        for (kind, where, position) in lst_use:
+            if kind == USE_FIELD:
+                lst.append((KIND_FIELD, where, position))
+    return lst
+
+def collect_references(wandle_model):
+    '''
+    Returns a list of (kind, name, context, position).
+    '''
+    lst = []
+    wandle_index = wandle_model.wandle_index
+    for (qname, lst_call) in wandle_index.d_call.items():
+        for (wandle_function, statement) in lst_call:
+            lst.append((
+                REF_CALL,
+                qname,
+                wandle_function.get_qualified_name(),
+                statement.position))
+    for (cstring, lst_use) in wandle_index.d_type_use.items():
+        for (kind, where, position) in lst_use:
+            lst.append((REF_TYPE, cstring, where, position))
+    return lst
+
+def sqlite_index_file(conn, path):
+    '''
+    Brings one file up to date in the index. Returns True if the file was
+    (re)indexed, False if it was unchanged.
+    '''
+    f_ptr = open(path, 'rb')
+    data = f_ptr.read()
+    f_ptr.close()
+    sha256 = hashlib.sha256(data).hexdigest()
+
+    row = conn.execute(
+        'select id, sha256 from file where path = ?', (path,)).fetchone()
+    if row != None and row[1] == sha256:
+        return False
+
+    wandle_src = data.decode('utf8')
+    try:
+        parse_tree = arpeggio_parse_go(wandle_src)
+        wandle_model = wandle_model_build(
+            parse_tree=parse_tree,
+            b_print_diagnostic=False)
+        status = 'valid'
+        error = None
+    except Exception as e:
+        wandle_model = None
+        status = 'invalid'
+        error = str(e)
+
+    if row == None:
+        cursor = conn.execute(
+            'insert into file (path, sha256, status, error) values (?, ?, ?, ?)',
+            (path, sha256, status, error))
+        file_id = cursor.lastrowid
+    else:
+        file_id = row[0]
+        conn.execute('delete from symbol where file_id = ?', (file_id,))
+        conn.execute('delete from reference where file_id = ?', (file_id,))
+        conn.execute(
+            'update file set sha256 = ?, status = ?, error = ? where id = ?',
+            (sha256, status, error, file_id))
+
+    if wandle_model == None:
+        return True
+
+    line_table = LineTable(wandle_src)
+    def linecol(position):
+        if position == None:
+            return (None, None)
+        return line_table.linecol(position)
+
+    lst_row = []
+    for (kind, name, position) in collect_definitions(wandle_model):
+        (line, col) = linecol(position)
+        lst_row.append((file_id, kind, name, line, col))
+    conn.executemany(
+        'insert into symbol (file_id, kind, name, line, col) values (?, ?, ?, ?, ?)',
+        lst_row)
+
+    lst_row = []
+    for (kind, name, context, position) in collect_references(wandle_model):
+        (line, col) = linecol(position)
+        lst_row.append((file_id, kind, name, context, line, col))
+    conn.executemany(
+        'insert into reference (file_id, kind, name, context, line, col) values (?, ?, ?, ?, ?, ?)',
+        lst_row)
+    return True
+
+def sqlite_index_update(conn, lst_path):
+    '''
+    Indexes the given files, skipping those whose content has not changed.
+    Files that are in the index but no longer exist on disk are dropped.
+    Returns (count_indexed, count_unchanged, count_dropped).
+    '''
+    count_indexed = 0
+    count_unchanged = 0
+    for path in lst_path:
+        path = os.path.abspath(path)
+        if sqlite_index_file(conn=conn, path=path):
+            count_indexed += 1
+        else:
+            count_unchanged += 1
+
+    count_dropped = 0
+    for (file_id, path) in conn.execute('select id, path from file').fetchall():
+        if os.path.exists(path):
+            continue
+        conn.execute('delete from symbol where file_id = ?', (file_id,))
+        conn.execute('delete from reference where file_id = ?', (file_id,))
+        conn.execute('delete from file where id = ?', (file_id,))
+        count_dropped += 1
+
+    conn.commit()
+    return (count_indexed, count_unchanged, count_dropped)
+
+def sqlite_index_find(conn, pattern):
+    '''
+    pattern is an SQLite glob, for example Org.* or PersonMap. Returns
+    (lst_definition, lst_reference). Each entry is a tuple that starts with
+    path, line, col.
+    '''
+    lst_definition = conn.execute('''
+        select f.path, s.line, s.col, s.kind, s.name
+        from symbol s join file f on f.id = s.file_id
+        where s.name glob ?
+        order by f.path, s.line, s.col''', (pattern,)).fetchall()
+    lst_reference = conn.execute('''
+        select f.path, r.line, r.col, r.kind, r.name, r.context
+        from reference r join file f on f.id = r.file_id
+        where r.name glob ?
+        order by f.path, r.line, r.col''', (pattern,)).fetchall()
+    return (lst_definition, lst_reference)
@@ -0,0 +1,480 @@
+#
+# Measured latencies, from traces of the running system.
+#
+# The ingest sub-command reads trace files and maps each span to a flow or
+# method of the model by its name. Durations go into a histogram per
+# qualified name, and the histograms are kept in a sidecar file next to the
+# model source, app.wandle -> app.measured.json. Ingesting more traces adds
+# to what is there.
+#
+# Traces can be:
+#   - Chrome trace files, either {"traceEvents": [...]} or a bare array.
+#     We take complete events (ph X), B/E pairs on a thread, and async b/e
+#     pairs.
+#   - OpenTelemetry JSON, as written by the OTLP file exporter. That is
+#     one ExportTraceServiceRequest, or one per line.
+# and may be gzipped. Files are streamed. We look for the array under
+# traceEvents or spans, and decode one element of it at a time, so memory
+# does not grow with the size of the file.
+#
+# A span name matches a qualified name (Db.get), a qualified name at the
+# end of a longer dotted name (app.store.Db.get, with :: taken as a
+# dot), or a flow name. An OpenTelemetry span can name its method outright
+# with a wandle.method attribute. d_map renames spans before any of that.
+#
+# Histograms have log buckets, 8 to each doubling, from 1us. That is about
+# 9% wide, as in the harness.
+#
+# A span times everything its method did, the body included, while a cost
+# in the model is the method's own work. So when the measurements are
+# applied, a method without a body takes its histogram as its cost. A
+# method with a body takes the measured mean, less what its body adds
+# under the model, as a constant cost. Flows have no cost; their
+# measurements are there to compare against.
+#
+
+from .wandle_model import CostDist
+from .wandle_model import DIST_CONST
+from .wandle_model import DIST_HISTOGRAM
+from .wandle_model import function_latency
+
+import gzip
+import json
+import math
+import os
+
+
+MEASURED_SUFFIX = '.measured.json'
+MEASURED_VERSION = 1
+
+BUCKETS_PER_DOUBLING = 8
+
+# Keys whose value is the array of events or spans we want.
+LST_ARRAY_KEY = ['"traceEvents"', '"spans"']
+
+ATTR_METHOD = 'wandle.method'
+
+CHUNK_SIZE = 1 << 16
+
+
+def measured_path(model_filename):
+    '''
+    The sidecar file for a model.
+    '''
+    return os.path.splitext(model_filename)[0] + MEASURED_SUFFIX
+
+
+# --------------------------------------------------------
+#   histogram
+# --------------------------------------------------------
+class Measured:
+    '''
+    Latency histogram of one flow or method. Times are in ms.
+    '''
+
+    def __init__(self):
+        # bucket index vs count
+        self.d_bucket = {}
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, ms):
+        us = max(ms * 1000.0, 1.0)
+        idx = int(math.floor(math.log2(us) * BUCKETS_PER_DOUBLING))
+        self.d_bucket[idx] = self.d_bucket.get(idx, 0) + 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def bucket_ms(self, idx):
+        '''
+        Middle of a bucket, in ms.
+        '''
+        return 2.0 ** ((idx + 0.5) / BUCKETS_PER_DOUBLING) / 1000.0
+
+    def mean_ms(self):
+        if self.count == 0:
+            return None
+        return self.total_ms / self.count
+
+    def percentile_ms(self, p):
+        if self.count == 0:
+            return None
+        rank = p / 100.0 * self.count
+        seen = 0
+        for idx in sorted(self.d_bucket.keys()):
+            seen += self.d_bucket[idx]
+            if seen >= rank:
+                return min(self.bucket_ms(idx), self.max_ms)
+        return self.max_ms
+
+    def cost_dist(self):
+        return CostDist(
+            kind=DIST_HISTOGRAM,
+            lst_bin=[
+                (self.bucket_ms(idx), self.d_bucket[idx])
+                for idx in sorted(self.d_bucket.keys())])
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'total_ms': self.total_ms,
+            'max_ms': self.max_ms,
+            'buckets': dict([
+                (str(idx), count)
+                for (idx, count) in sorted(self.d_bucket.items())]),
+        }
+
+    @staticmethod
+    def from_dict(d):
+        measured = Measured()
+        measured.count = d['count']
+        measured.total_ms = d['total_ms']
+        measured.max_ms = d['max_ms']
+        for (idx, count) in d['buckets'].items():
+            measured.d_bucket[int(idx)] = count
+        return measured
+
+
+def measured_read(path):
+    '''
+    Returns (d_measured, d_unmatched) from a sidecar file. Both are empty
+    if there is no file.
+    '''
+    if not os.path.exists(path):
+        return ({}, {})
+    f_ptr = open(path)
+    d = json.load(f_ptr)
+    f_ptr.close()
+    if d.get('version') != MEASURED_VERSION:
+        raise Exception("%s has version %s. Expected %s."%(
+            path, d.get('version'), MEASURED_VERSION))
+    d_measured = {}
+    for (name, dd) in d['measured'].items():
+        d_measured[name] = Measured.from_dict(dd)
+    return (d_measured, dict(d['unmatched']))
+
+def measured_write(path, d_measured, d_unmatched):
+    d = {
+        'version': MEASURED_VERSION,
+        'measured': dict([
+            (name, measured.as_dict())
+            for (name, measured) in sorted(d_measured.items())]),
+        'unmatched': dict(sorted(d_unmatched.items())),
+    }
+    path_tmp = path + '.tmp'
+    f_out = open(path_tmp, 'w')
+    json.dump(d, f_out, indent=1)
+    f_out.write('\n')
+    f_out.close()
+    os.replace(path_tmp, path)
+
+
+# --------------------------------------------------------
+#   streaming
+# --------------------------------------------------------
+class ArrayStream:
+    '''
+    Yields the elements of every array under one of LST_ARRAY_KEY, or of
+    the array that is the whole document, one decoded element at a time.
+    '''
+
+    def __init__(self, f_ptr):
+        self.f_ptr = f_ptr
+        self.decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.b_eof = False
+
+    def __more(self):
+        if self.b_eof:
+            return False
+        chunk = self.f_ptr.read(CHUNK_SIZE)
+        if not chunk:
+            self.b_eof = True
+            return False
+        if self.pos > 0:
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        self.buf = self.buf + chunk
+        return True
+
+    def __skip_space(self, s_skip):
+        '''
+        Moves past whitespace and the characters in s_skip. Returns the
+        next character, or None at the end of the file.
+        '''
+        while True:
+            while self.pos < len(self.buf):
+                ch = self.buf[self.pos]
+                if not (ch.isspace() or ch in s_skip):
+                    return ch
+                self.pos += 1
+            if not self.__more():
+                return None
+
+    def __find_key(self):
+        '''
+        Moves to just past the next array key. Returns False at the end of
+        the file.
+        '''
+        keep = max([len(key) for key in LST_ARRAY_KEY])
+        while True:
+            lst_found = []
+            for key in LST_ARRAY_KEY:
+                idx = self.buf.find(key, self.pos)
+                if idx >= 0:
+                    lst_found.append((idx, key))
+            if lst_found:
+                (idx, key) = min(lst_found)
+                self.pos = idx + len(key)
+                return True
+            self.pos = max(self.pos, len(self.buf) - keep)
+            if not self.__more():
+                return False
+
+    def __elements(self):
+        # We are just inside the [.
+        while True:
+            ch = self.__skip_space(',')
+            if ch == None or ch == ']':
+                # A Chrome trace is allowed to stop without its ].
+                self.pos += 1
+                return
+            while True:
+                try:
+                    (value, end) = self.decoder.raw_decode(self.buf, self.pos)
+                    break
+                except ValueError:
+                    if not self.__more():
+                        raise Exception("Trace ends inside an element.")
+            self.pos = end
+            yield value
+
+    def __iter__(self):
+        ch = self.__skip_space('')
+        if ch == '[':
+            self.pos += 1
+            yield from self.__elements()
+        while self.__find_key():
+            if self.__skip_space(':') != '[':
+                continue
+            self.pos += 1
+            yield from self.__elements()
+
+
+def trace_open(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt')
+    return open(path)
+
+
+# --------------------------------------------------------
+#   ingest
+# --------------------------------------------------------
+class SpanMapper:
+    '''
+    Maps span names to qualified names in the model.
+    '''
+
+    def __init__(self, set_qname, d_map=None):
+        self.set_qname = set_qname
+        self.d_map = d_map or {}
+        # span name vs qualified name or None
+        self.d_cache = {}
+
+    def __lookup(self, name):
+        name = self.d_map.get(name, name)
+        if name in self.set_qname:
+            return name
+        lst_part = name.replace('::', '.').split('.')
+        for n in (2, 1):
+            if len(lst_part) >= n:
+                qname = '.'.join(lst_part[-n:])
+                if qname in self.set_qname:
+                    return qname
+        return None
+
+    def qname(self, name):
+        if name not in self.d_cache:
+            self.d_cache[name] = self.__lookup(name)
+        return self.d_cache[name]
+
+
+class Ingest:
+
+    def __init__(self, span_mapper, d_measured=None, d_unmatched=None):
+        self.span_mapper = span_mapper
+        self.d_measured = d_measured if d_measured != None else {}
+        self.d_unmatched = d_unmatched if d_unmatched != None else {}
+        self.count_span = 0
+        self.count_matched = 0
+
+        # (pid, tid) vs list of open B events
+        self.d_stack = {}
+        # (pid, cat, id, name) vs ts of an open b event
+        self.d_async = {}
+
+    def record(self, name, ms, qname=None):
+        self.count_span += 1
+        if qname == None:
+            qname = self.span_mapper.qname(name)
+        if qname == None:
+            self.d_unmatched[name] = self.d_unmatched.get(name, 0) + 1
+            return
+        self.count_matched += 1
+        if qname not in self.d_measured:
+            self.d_measured[qname] = Measured()
+        self.d_measured[qname].record(ms)
+
+    def chrome_event(self, d):
+        ph = d.get('ph')
+        if ph == 'X':
+            if 'dur' in d:
+                self.record(d.get('name', ''), d['dur'] / 1000.0)
+        elif ph == 'B':
+            key = (d.get('pid'), d.get('tid'))
+            self.d_stack.setdefault(key, []).append(d)
+        elif ph == 'E':
+            lst_open = self.d_stack.get((d.get('pid'), d.get('tid')))
+            if lst_open:
+                d_begin = lst_open.pop()
+                self.record(
+                    d_begin.get('name', ''), (d['ts'] - d_begin['ts']) / 1000.0)
+        elif ph in ('b', 'e'):
+            key = (d.get('pid'), d.get('cat'), d.get('id', d.get('id2')),
+                d.get('name'))
+            if ph == 'b':
+                self.d_async[key] = d['ts']
+            elif key in self.d_async:
+                ts = self.d_async.pop(key)
+                self.record(d.get('name', ''), (d['ts'] - ts) / 1000.0)
+
+    def otel_span(self, d):
+        qname = None
+        for d_attr in d.get('attributes', []):
+            if d_attr.get('key') == ATTR_METHOD:
+                qname = self.span_mapper.qname(
+                    d_attr.get('value', {}).get('stringValue', ''))
+        ns = int(d['endTimeUnixNano']) - int(d['startTimeUnixNano'])
+        self.record(d.get('name', ''), ns / 1e6, qname=qname)
+
+    def ingest_file(self, path):
+        f_ptr = trace_open(path)
+        try:
+            for d in ArrayStream(f_ptr):
+                if not isinstance(d, dict):
+                    continue
+                if 'startTimeUnixNano' in d:
+                    self.otel_span(d)
+                elif 'ph' in d:
+                    self.chrome_event(d)
+        finally:
+            f_ptr.close()
+
+
+def trace_ingest(wandle_model, lst_path, sidecar_path, d_map=None,
+        b_reset=False):
+    '''
+    Adds the spans in the trace files to the sidecar. Returns the counts
+    of spans read and matched, and what the sidecar now holds.
+    '''
+    (d_measured, d_unmatched) = ({}, {})
+    if not b_reset:
+        (d_measured, d_unmatched) = measured_read(sidecar_path)
+    span_mapper = SpanMapper(
+        set_qname=set(wandle_model.get_functions().keys()),
+        d_map=d_map)
+    ingest = Ingest(
+        span_mapper=span_mapper,
+        d_measured=d_measured,
+        d_unmatched=d_unmatched)
+    for path in lst_path:
+        ingest.ingest_file(path)
+    measured_write(sidecar_path, d_measured, d_unmatched)
+    return {
+        'spans': ingest.count_span,
+        'matched': ingest.count_matched,
+        'measured': d_measured,
+        'unmatched': d_unmatched,
+    }
+
+
+# --------------------------------------------------------
+#   apply
+# --------------------------------------------------------
+def _functions_by_name(wandle_model):
+    '''
+    Qualified name vs every WandleFunction of that name, including the
+    copies held by classes derived from generics.
+    '''
+    d = {}
+    for (name, wandle_function) in wandle_model.d_flow.items():
+        d.setdefault(name, []).append(wandle_function)
+    lst_container = list(wandle_model.d_generic.values())
+    lst_container.extend(wandle_model.d_specific.values())
+    for container in lst_container:
+        for dd in (container.d_fab_sync, container.d_fab_async):
+            for wandle_function in dd.values():
+                lst = d.setdefault(wandle_function.get_qualified_name(), [])
+                if wandle_function not in lst:
+                    lst.append(wandle_function)
+    return d
+
+def measured_apply(wandle_model, d_measured):
+    '''
+    Sets the cost of every measured method from its measurements. Returns
+    the number of functions changed.
+    '''
+    d_function = _functions_by_name(wandle_model)
+    lst_body = []
+    count = 0
+    for (qname, measured) in d_measured.items():
+        if measured.count == 0 or qname in wandle_model.d_flow:
+            continue
+        for wandle_function in d_function.get(qname, []):
+            count += 1
+            if wandle_function.has_body():
+                lst_body.append((wandle_function, measured))
+            else:
+                wandle_function.set_cost(measured.cost_dist())
+
+    # Methods with a body, callees before callers, so that what the body
+    # adds is worked out from measured costs where there are any.
+    d_body = dict([(id(f), m) for (f, m) in lst_body])
+    set_done = set()
+
+    def settle(wandle_function):
+        if id(wandle_function) in set_done:
+            return
+        set_done.add(id(wandle_function))
+        for statement in wandle_function.lst_statement:
+            if statement.wandle_function != None:
+                settle(statement.wandle_function)
+        if id(wandle_function) not in d_body:
+            return
+        measured = d_body[id(wandle_function)]
+        wandle_function.set_cost(None)
+        body_ms = function_latency(
+            wandle_function=wandle_function,
+            d_memo={}).ret_ms
+        wandle_function.set_cost(CostDist(
+            kind=DIST_CONST,
+            value_ms=max(0.0, measured.mean_ms() - body_ms)))
+
+    for (wandle_function, measured) in lst_body:
+        settle(wandle_function)
+    return count
+
+def measured_load(wandle_model, model_filename):
+    '''
+    Applies the sidecar of model_filename to the model. Raises if there is
+    none.
+    '''
+    path = measured_path(model_filename)
+    if not os.path.exists(path):
+        raise Exception("No measurements for %s. Expected %s."%(
+            model_filename, path))
+    (d_measured, d_unmatched) = measured_read(path)
+    return measured_apply(wandle_model, d_measured)